@@ -1,41 +1,122 @@
-"""__init__ file."""
-
-from . import common
-from . import server_single_simple
-from . import server_single_sync
-from . import server_single_hash
-from . import server_single_multiprofile
-from . import server_double
-from . import simulator
-
-
-Strategy = common.Strategy
-Message = common.Message
-GlobalStats = common.GlobalStats
-Actor = common.Actor
-BaseDatabase = common.BaseDatabase
-BaseClient = common.BaseClient
-BaseFrontend = common.BaseFrontend
-BaseWorker = common.BaseWorker
-SingleVersionDatabase = common.SingleVersionDatabase
-MultiVersionDatabase = common.MultiVersionDatabase
-NetworkSystem = common.NetworkSystem
-STRATEGIES = common.STRATEGIES
-
-SimpleClient = server_single_simple.SimpleClient
-ForegroundReenrollFrontend = server_single_simple.ForegroundReenrollFrontend
-SingleVersionWorker = server_single_simple.SingleVersionWorker
-
-VersionQuery = server_single_sync.VersionQuery
-VersionSyncFrontend = server_single_sync.VersionSyncFrontend
-VersionSyncWorker = server_single_sync.VersionSyncWorker
-
-UserHashFrontend = server_single_hash.UserHashFrontend
-
-MultiProfileFrontend = server_single_multiprofile.MultiProfileFrontend
-
-BackgroundReenrollFrontend = server_double.BackgroundReenrollFrontend
-DoubleVersionWorker = server_double.DoubleVersionWorker
-DoubleVersionNetworkSystem = server_double.DoubleVersionNetworkSystem
-
-simulate = simulator.simulate
+"""__init__ file.
+
+Submodules and the names below are imported lazily on first access, such
+that `import SpeakerVerSim` stays cheap. Strategy modules are also only
+imported when their strategy is used, see registry.py.
+"""
+import importlib
+
+from . import registry
+
+register_strategy = registry.register_strategy
+list_strategies = registry.list_strategies
+
+# Mapping from each lazily imported name to its submodule.
+_LAZY_NAMES = {
+    "Strategy": "common",
+    "Message": "common",
+    "GlobalStats": "common",
+    "Actor": "common",
+    "BaseDatabase": "common",
+    "BaseClient": "common",
+    "BaseFrontend": "common",
+    "BaseWorker": "common",
+    "SingleVersionDatabase": "common",
+    "MultiVersionDatabase": "common",
+    "NetworkSystem": "common",
+    "STRATEGIES": "common",
+
+    "SimpleClient": "server_single_simple",
+    "ForegroundReenrollFrontend": "server_single_simple",
+    "SingleVersionWorker": "server_single_simple",
+
+    "VersionQuery": "server_single_sync",
+    "VersionSyncFrontend": "server_single_sync",
+    "VersionSyncWorker": "server_single_sync",
+
+    "UserHashFrontend": "server_single_hash",
+
+    "MultiProfileFrontend": "server_single_multiprofile",
+
+    "BackgroundReenrollFrontend": "server_double",
+    "DoubleVersionWorker": "server_double",
+    "DoubleVersionNetworkSystem": "server_double",
+
+    "simulate": "simulator",
+    "build_system": "simulator",
+
+    "EventCode": "tracing",
+    "Tracer": "tracing",
+
+    "ProfileReport": "profiling",
+
+    "RegionTopology": "topology",
+
+    "LatencyModel": "latency",
+
+    "MessageWriter": "message_log",
+
+    "DDSketch": "sketch",
+
+    "WindowedMetrics": "timeseries",
+
+    "Termination": "termination",
+
+    "SimulationConfig": "config",
+    "compile_config": "config",
+
+    "SLO": "planner",
+    "plan_capacity": "planner",
+
+    "Knob": "optimizer",
+    "Objective": "optimizer",
+    "optimize": "optimizer",
+
+    "RandomStreams": "random_streams",
+
+    "compare_strategies": "comparison",
+}
+
+_SUBMODULES = {
+    "admission",
+    "arrival",
+    "benchmark",
+    "common",
+    "comparison",
+    "config",
+    "hedging",
+    "latency",
+    "message_log",
+    "optimizer",
+    "planner",
+    "profiling",
+    "random_streams",
+    "request_log",
+    "scheduling",
+    "server_double",
+    "server_single_hash",
+    "server_single_multiprofile",
+    "server_single_simple",
+    "server_single_sync",
+    "simulator",
+    "sketch",
+    "termination",
+    "timeseries",
+    "topology",
+    "tracing",
+}
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _LAZY_NAMES:
+        module = importlib.import_module(f".{_LAZY_NAMES[name]}", __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_NAMES) | _SUBMODULES)
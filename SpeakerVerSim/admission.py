@@ -0,0 +1,79 @@
+"""Admission control of frontends.
+
+Each frontend decides whether to admit a request on its arrival, with the
+policy in config.admission_control:
+    none: admit all requests
+    token_bucket: admit at most config.admission_rate requests per second
+        on average, with bursts of up to config.admission_burst requests
+    concurrency: admit at most config.admission_concurrency requests in
+        flight, from their arrival until the frontend sends the response
+A request that is not admitted gets a rejection response right away.
+
+Workers may also reject verification requests if config.worker_concurrency
+is set and config.worker_queue_capacity requests already wait for an
+inference slot. Enrollment requests are never rejected by workers, since
+they belong to requests that are already admitted.
+
+Rejected requests are counted in GlobalStats.rejected_count by reason, and
+their responses are excluded from final_messages and the e2e latency.
+"""
+from typing import Any
+
+# Reasons of rejections.
+ADMISSION = "admission"
+WORKER_QUEUE = "worker_queue"
+
+
+def is_enabled(config: Any) -> bool:
+    """Whether frontends need an AdmissionController."""
+    return config.admission_control != "none"
+
+
+class TokenBucket:
+    """Tokens refill at a constant rate, up to a burst size."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.update_time = 0.0
+
+    def take(self, now: float) -> bool:
+        """Take one token if there is one."""
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.update_time) * self.rate)
+        self.update_time = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AdmissionController:
+    """Admits requests arriving at a frontend."""
+
+    def __init__(self, frontend: Any):
+        self.env = frontend.env
+        self.config = frontend.config
+        self.policy = self.config.admission_control
+        if self.policy not in {"token_bucket", "concurrency"}:
+            raise ValueError(
+                f"Unsupported admission_control: {self.policy}")
+        self.bucket = TokenBucket(
+            self.config.admission_rate, self.config.admission_burst)
+        # msg_ids of admitted requests without a response yet.
+        self.inflight: set[int] = set()
+
+    def admit(self, msg: Any) -> bool:
+        """Whether to admit a request."""
+        if self.policy == "token_bucket":
+            admitted = self.bucket.take(self.env.now)
+        else:
+            admitted = len(self.inflight) < self.config.admission_concurrency
+        if admitted:
+            self.inflight.add(msg.msg_id)
+        return admitted
+
+    def release(self, msg: Any) -> None:
+        """A response to a request is sent."""
+        self.inflight.discard(msg.msg_id)
@@ -0,0 +1,266 @@
+"""Arrival processes of client requests.
+
+Arrival times and user ids are generated in vectorized blocks ahead of
+time, and consumed by a single client process.
+
+Available processes, selected by config.arrival_process:
+    periodic: one request every client_request_interval seconds
+    poisson: Poisson arrivals with mean interval client_request_interval
+    diurnal: non-homogeneous Poisson arrivals with a sinusoidal daily rate
+    mmpp: Markov-modulated Poisson arrivals alternating between a normal
+        state and a burst state
+    replay: replay of a production request log, see request_log.py
+
+For all synthetic processes, the user of each request is drawn
+independently with weights given by config.user_distribution. For Poisson
+arrivals, this is the same as each user sending requests as an independent
+Poisson process with a rate proportional to its weight.
+"""
+import abc
+import itertools
+import math
+from typing import Iterator, Optional
+import munch
+import numpy as np
+
+from SpeakerVerSim import request_log
+
+# Multiplier of Fibonacci hashing for 64-bit integers.
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+class UserSampler:
+    """Samples user ids according to config.user_distribution."""
+
+    def __init__(self, config: munch.Munch, rng: np.random.Generator):
+        self.rng = rng
+        user_ids = np.arange(config.num_users, dtype=np.float64)
+        if config.user_distribution == "uniform":
+            weights = np.ones_like(user_ids)
+        elif config.user_distribution == "linear":
+            weights = user_ids + 1
+        elif config.user_distribution == "exponential":
+            weights = 0.8 ** user_ids
+        else:
+            raise ValueError(
+                "Unsupported user_distribution: {}".format(
+                    config.user_distribution))
+        self.cum_weights = np.cumsum(weights)
+        self.cum_weights /= self.cum_weights[-1]
+
+    def sample(self, size: int) -> np.ndarray:
+        """Sample a block of user ids."""
+        user_ids = np.searchsorted(
+            self.cum_weights, self.rng.random(size), side="right")
+        # Guard against rounding of the last cumulative weight.
+        return np.minimum(user_ids, len(self.cum_weights) - 1)
+
+
+class ArrivalProcess(abc.ABC):
+    """Base class for an arrival process."""
+
+    def __init__(self, config: munch.Munch, rng: np.random.Generator):
+        self.config = config
+        self.rng = rng
+        self.block_size = config.arrival_block_size
+
+    @abc.abstractmethod
+    def __iter__(self) -> Iterator[tuple[float, int, Optional[float]]]:
+        """Iterate over (arrival time, user id, audio length) tuples.
+
+        Audio length is None for the typical length.
+        """
+        pass
+
+
+class SyntheticArrivals(ArrivalProcess):
+    """Base class for a synthetic arrival process."""
+
+    def __init__(self, config: munch.Munch, rng: np.random.Generator):
+        super().__init__(config, rng)
+        self.user_sampler = UserSampler(config, rng)
+
+    @abc.abstractmethod
+    def next_times(self, start_time: Optional[float]) -> np.ndarray:
+        """Generate a sorted block of arrival times after start_time.
+
+        start_time is the last arrival time of the previous block, or None
+        for the first block.
+        """
+        pass
+
+    def __iter__(self) -> Iterator[tuple[float, int, Optional[float]]]:
+        last_time = None
+        while True:
+            times = self.next_times(last_time)
+            user_ids = self.user_sampler.sample(len(times))
+            yield from zip(
+                times.tolist(), user_ids.tolist(), itertools.repeat(None))
+            last_time = float(times[-1])
+
+
+class PeriodicArrivals(SyntheticArrivals):
+    """One request every client_request_interval seconds, from time 0."""
+
+    def next_times(self, start_time: Optional[float]) -> np.ndarray:
+        interval = self.config.client_request_interval
+        first = 0 if start_time is None else start_time + interval
+        return first + interval * np.arange(self.block_size)
+
+
+class PoissonArrivals(SyntheticArrivals):
+    """Poisson arrivals with mean interval client_request_interval."""
+
+    def next_times(self, start_time: Optional[float]) -> np.ndarray:
+        start_time = start_time or 0
+        return start_time + np.cumsum(self.rng.exponential(
+            self.config.client_request_interval, self.block_size))
+
+
+class DiurnalArrivals(SyntheticArrivals):
+    """Non-homogeneous Poisson arrivals with a sinusoidal rate.
+
+    The rate at time t is:
+        (1 + A * cos(2 * pi * (t - peak) / period)) / client_request_interval
+    where A is diurnal_amplitude in [0, 1]. Arrivals are generated by
+    thinning Poisson arrivals at the peak rate.
+    """
+
+    def next_times(self, start_time: Optional[float]) -> np.ndarray:
+        amplitude = self.config.diurnal_amplitude
+        period = self.config.diurnal_period
+        peak = self.config.diurnal_peak_time
+        max_interval = self.config.client_request_interval / (1 + amplitude)
+        blocks = []
+        num_times = 0
+        last_time = start_time or 0
+        while num_times < self.block_size:
+            candidates = last_time + np.cumsum(self.rng.exponential(
+                max_interval, self.block_size))
+            accept_prob = (1 + amplitude * np.cos(
+                2 * math.pi * (candidates - peak) / period)) / (1 + amplitude)
+            accepted = candidates[self.rng.random(self.block_size)
+                                  < accept_prob]
+            blocks.append(accepted)
+            num_times += len(accepted)
+            last_time = candidates[-1]
+        return np.concatenate(blocks)
+
+
+class MMPPArrivals(SyntheticArrivals):
+    """Two-state Markov-modulated Poisson arrivals.
+
+    In the normal state, the mean interval is client_request_interval. In
+    the burst state, the rate is multiplied by burst_rate_multiplier. The
+    durations of the normal and burst states are exponentially distributed
+    with means burst_mean_gap and burst_mean_duration.
+    """
+
+    def __init__(self, config: munch.Munch, rng: np.random.Generator):
+        super().__init__(config, rng)
+        self.in_burst = False
+        self.state_end = self.rng.exponential(
+            self.config.burst_mean_gap)
+
+    def next_times(self, start_time: Optional[float]) -> np.ndarray:
+        blocks = []
+        num_times = 0
+        last_time = start_time or 0
+        while num_times < self.block_size:
+            interval = self.config.client_request_interval
+            if self.in_burst:
+                interval /= self.config.burst_rate_multiplier
+            times = last_time + np.cumsum(
+                self.rng.exponential(interval, self.block_size))
+            times = times[times < self.state_end]
+            blocks.append(times)
+            num_times += len(times)
+            if len(times) == self.block_size:
+                last_time = times[-1]
+            else:
+                # Memoryless: restart arrivals at the state change.
+                last_time = self.state_end
+                self.in_burst = not self.in_burst
+                self.state_end += self.rng.exponential(
+                    self.config.burst_mean_duration
+                    if self.in_burst
+                    else self.config.burst_mean_gap)
+        return np.concatenate(blocks)
+
+
+class ReplayArrivals(ArrivalProcess):
+    """Replay of a request log, streamed in chunks.
+
+    Timestamps are shifted such that the first request arrives at time 0,
+    and then multiplied by request_log_time_scale.
+
+    User IDs are mapped to [0, num_users) by request_log_user_mapping:
+        none: user IDs must already be in range
+        modulo: user ID modulo num_users
+        hash: a multiplicative hash of the user ID modulo num_users
+        dense: user IDs in order of first appearance, modulo num_users
+    """
+
+    def __init__(self, config: munch.Munch, rng: np.random.Generator):
+        super().__init__(config, rng)
+        self.path = config.request_log_file
+        self.time_scale = config.request_log_time_scale
+        self.user_mapping = config.request_log_user_mapping
+        if self.user_mapping not in {"none", "modulo", "hash", "dense"}:
+            raise ValueError(
+                f"Unsupported request_log_user_mapping: {self.user_mapping}")
+        self.dense_user_ids: dict[int, int] = {}
+
+    def map_user_ids(self, user_ids: np.ndarray) -> np.ndarray:
+        """Map user IDs of the log to [0, num_users)."""
+        num_users = self.config.num_users
+        if self.user_mapping == "modulo":
+            return user_ids % num_users
+        if self.user_mapping == "hash":
+            hashed = user_ids.astype(np.uint64) * np.uint64(HASH_MULTIPLIER)
+            return (hashed % np.uint64(num_users)).astype(np.int64)
+        if self.user_mapping == "dense":
+            return np.array([
+                self.dense_user_ids.setdefault(
+                    user_id, len(self.dense_user_ids)) % num_users
+                for user_id in user_ids.tolist()], dtype=np.int64)
+        if len(user_ids) and (
+                user_ids.min() < 0 or user_ids.max() >= num_users):
+            raise ValueError(
+                "User ID of request log out of range; "
+                "consider setting request_log_user_mapping.")
+        return user_ids
+
+    def __iter__(self) -> Iterator[tuple[float, int, Optional[float]]]:
+        first_time = None
+        for chunk in request_log.iter_request_log(
+                self.path, self.block_size):
+            times = chunk["timestamp"]
+            if first_time is None:
+                first_time = times[0]
+            times = (times - first_time) * self.time_scale
+            user_ids = self.map_user_ids(chunk["user_id"])
+            if "audio_length" in chunk:
+                audio_lengths = chunk["audio_length"].tolist()
+            else:
+                audio_lengths = itertools.repeat(None)
+            yield from zip(times.tolist(), user_ids.tolist(), audio_lengths)
+
+
+ARRIVAL_PROCESSES = {
+    "periodic": PeriodicArrivals,
+    "poisson": PoissonArrivals,
+    "diurnal": DiurnalArrivals,
+    "mmpp": MMPPArrivals,
+    "replay": ReplayArrivals,
+}
+
+
+def create_arrival_process(
+        config: munch.Munch,
+        rng: np.random.Generator) -> ArrivalProcess:
+    """Create the arrival process in the config."""
+    name = config.arrival_process
+    if name not in ARRIVAL_PROCESSES:
+        raise ValueError(f"Unsupported arrival_process: {name}")
+    return ARRIVAL_PROCESSES[name](config, rng)
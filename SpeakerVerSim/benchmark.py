@@ -0,0 +1,216 @@
+"""Performance benchmark of all strategies across scales.
+
+Each benchmark case runs one simulation in a fresh subprocess, such that
+the peak RSS of each case is measured independently.
+"""
+import dataclasses
+import datetime
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Optional
+import munch
+
+from SpeakerVerSim import simulator
+from SpeakerVerSim.common import Strategy, STRATEGIES
+
+
+@dataclasses.dataclass
+class BenchmarkMatrix:
+    """The matrix of benchmark cases."""
+    strategies: list[str] = dataclasses.field(
+        default_factory=lambda: [str(x.value) for x in STRATEGIES])
+    num_cloud_workers: list[int] = dataclasses.field(
+        default_factory=lambda: [10, 100])
+    num_users: list[int] = dataclasses.field(
+        default_factory=lambda: [1, 100])
+    client_request_interval: list[float] = dataclasses.field(
+        default_factory=lambda: [10, 1])
+
+    # Only used by SSO-sync.
+    version_query_interval: list[float] = dataclasses.field(
+        default_factory=lambda: [600])
+
+
+# Presets of benchmark matrices.
+PRESETS = {
+    "quick": BenchmarkMatrix(),
+    "full": BenchmarkMatrix(
+        num_cloud_workers=[10, 100, 1000, 10000],
+        num_users=[1, 1000, 1000000],
+        client_request_interval=[10, 1, 0.1],
+        version_query_interval=[60, 600]),
+}
+
+
+def get_cases(
+        config: munch.Munch,
+        matrix: BenchmarkMatrix) -> dict[str, munch.Munch]:
+    """Create the config of each benchmark case, keyed by case name."""
+    cases = {}
+    for strategy, workers, users, interval in itertools.product(
+            matrix.strategies,
+            matrix.num_cloud_workers,
+            matrix.num_users,
+            matrix.client_request_interval):
+        query_intervals = [config.version_query_interval]
+        if strategy == Strategy.SSO_SYNC:
+            query_intervals = matrix.version_query_interval
+        for query_interval in query_intervals:
+            case = munch.Munch(config)
+            case.strategy = strategy
+            case.num_cloud_workers = workers
+            case.num_users = users
+            case.client_request_interval = interval
+            case.version_query_interval = query_interval
+            case.log_verbosity = 0
+            case.print_stats = False
+            name = f"{strategy}/w{workers}/u{users}/i{interval:g}"
+            if strategy == Strategy.SSO_SYNC:
+                name += f"/q{query_interval:g}"
+            cases[name] = case
+    return cases
+
+
+def get_peak_rss() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Bytes on macOS, kilobytes elsewhere.
+        return peak / 2**20
+    return peak / 2**10
+
+
+def measure_import_time(
+        module: str = "SpeakerVerSim", repeats: int = 5) -> float:
+    """Seconds to import a module in a fresh interpreter, best of repeats."""
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n")
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True, capture_output=True, text=True).stdout
+        times.append(float(output))
+    return min(times)
+
+
+def run_case(config: munch.Munch) -> dict:
+    """Run a single benchmark case in the current process."""
+    system = simulator.build_system(config)
+    # Count processed events: env.run() calls env.step() once per event.
+    num_events = 0
+    step = system.env.step
+
+    def counting_step() -> None:
+        nonlocal num_events
+        num_events += 1
+        step()
+
+    system.env.step = counting_step
+    start = time.perf_counter()
+    stats = system.simulate()
+    wall_time = time.perf_counter() - start
+    return {
+        "wall_time": wall_time,
+        "num_events": num_events,
+        "events_per_second": num_events / max(wall_time, 1e-9),
+        "peak_rss_mb": get_peak_rss(),
+        "num_messages": stats.total_num_messages,
+    }
+
+
+def run_suite(
+        config: munch.Munch,
+        matrix: BenchmarkMatrix,
+        repeats: int = 1,
+        verbose: bool = True) -> dict:
+    """Run all benchmark cases.
+
+    Each case is repeated, and the run with the smallest wall time is
+    reported.
+
+    Returns:
+        a JSON-serializable dict of metadata and results
+    """
+    results = {}
+    cases = get_cases(config, matrix)
+    for name, case in cases.items():
+        runs = []
+        for _ in range(repeats):
+            with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+                runs.append(pool.apply(run_case, (case,)))
+        best = min(runs, key=lambda x: x["wall_time"])
+        best["strategy"] = case.strategy
+        best["num_cloud_workers"] = case.num_cloud_workers
+        best["num_users"] = case.num_users
+        best["client_request_interval"] = case.client_request_interval
+        best["version_query_interval"] = case.version_query_interval
+        results[name] = best
+        if verbose:
+            print(f"{name}: {best['wall_time']:.3f} s, "
+                  f"{best['events_per_second']:.0f} events/s, "
+                  f"{best['peak_rss_mb']:.1f} MiB")
+    return {
+        "metadata": {
+            "time": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time_to_run": config.time_to_run,
+            "repeats": repeats,
+            "import_time": measure_import_time(),
+        },
+        "results": results,
+    }
+
+
+def compare(
+        baseline: dict,
+        current: dict,
+        threshold: float = 0.1,
+        metrics: Optional[list[str]] = None) -> list[dict]:
+    """Find regressions of current results over baseline results.
+
+    A regression is a relative increase of a metric above threshold, for a
+    case that exists in both results.
+
+    Returns:
+        a list of regressions
+    """
+    if metrics is None:
+        metrics = ["wall_time", "peak_rss_mb"]
+    regressions = []
+    for name, current_result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for metric in metrics:
+            before = baseline["results"][name][metric]
+            after = current_result[metric]
+            change = (after - before) / max(before, 1e-9)
+            if change > threshold:
+                regressions.append({
+                    "case": name,
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "change": change,
+                })
+    return regressions
+
+
+def save_results(results: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
@@ -1,13 +1,31 @@
 
 """Common components."""
-import copy
+import collections
 import enum
 import simpy
-from typing import Optional, Generator, Any
+from typing import Optional, Generator, Any, Union, Iterator
 import dataclasses
 import abc
+import copy
+import math
 import random
-import munch
+import time
+import numpy as np
+
+from SpeakerVerSim import admission
+from SpeakerVerSim import hedging
+from SpeakerVerSim import latency
+from SpeakerVerSim import message_log
+from SpeakerVerSim import profiling
+from SpeakerVerSim import random_streams
+from SpeakerVerSim import scheduling
+from SpeakerVerSim import sketch
+from SpeakerVerSim import termination
+from SpeakerVerSim import timeseries
+from SpeakerVerSim import topology
+from SpeakerVerSim import tracing
+from SpeakerVerSim.config import SimulationConfig
+from SpeakerVerSim.tracing import EventCode
 
 
 class Strategy(str, enum.Enum):
@@ -33,6 +51,10 @@ class Message:
     # Unique ID of the user.
     user_id: int = 0
 
+    # Length of the audio in seconds.
+    # None means the typical length, which is config.audio_length.
+    audio_length: Optional[float] = None
+
     # Unique ID of the version of the profile.
     # Will be updated after fetching profile from database.
     # For enrollment responses, the enrollment version will always
@@ -55,6 +77,27 @@ class Message:
     # Which worker handled this request.
     worker_name: str = ""
 
+    # Which frontend handled this request.
+    frontend_name: str = ""
+
+    # Model version of the worker when it returned this response, if
+    # piggybacked. See config.version_propagation.
+    worker_version: Optional[int] = None
+
+    # Index of the attempt of a hedged or retried request, where 0 is the
+    # first attempt, see hedging.py.
+    attempt: int = 0
+
+    # Whether the frontend no longer waits for this attempt.
+    cancelled: bool = False
+
+    # Why the request was rejected, or empty if it was not, see
+    # admission.py.
+    rejected: str = ""
+
+    # Region of the user who sent this request.
+    region: int = 0
+
     # Timing information.
     client_send_time: Optional[float] = None
     fetch_database_time: Optional[float] = None
@@ -77,6 +120,16 @@ class GlobalStats:
     # Count of version upgrades.
     forward_bounce_count: int = 0
 
+    # Count of model updates of workers.
+    num_worker_updates: int = 0
+
+    # Times of model updates of workers.
+    worker_update_times: list[float] = dataclasses.field(
+        default_factory=list)
+
+    # Count of enrollments written to database.
+    enrollment_count: int = 0
+
     # Average latency for fulfilling one request.
     average_e2e_latency: float = 0
 
@@ -89,12 +142,124 @@ class GlobalStats:
     # Max flops for fulfilling one request.
     max_total_flops: float = 0
 
-    # Configuration of the experiment.
-    config: munch.Munch = dataclasses.field(default_factory=munch.Munch)
+    # Percentiles of latencies from latency_sketches, as a mapping from
+    # metric to a mapping like {"p50": 1.0, "p95": 1.1, "p99": 1.5}.
+    latency_percentiles: dict[str, dict[str, float]] = dataclasses.field(
+        default_factory=dict)
+
+    # Quantile sketches of latencies, keyed by metric:
+    #   e2e: latency for fulfilling one request
+    #   database: time of one profile fetch or update, excluding cache hits
+    #   worker: time of one inference
+    #   worker_queue: time waiting for an inference slot, only with
+    #       config.worker_concurrency
+    #   worker_queue/<class>: the same for each scheduling class, see
+    #       scheduling.py
+    #   enrollment_overhead: time from sending a foreground enrollment to
+    #       resending the request
+    #   version_staleness: time from a worker update until a frontend
+    #       version table learns of it, only for VersionSyncFrontend
+    #   hedge_saved: time from the winning response of a hedged or retried
+    #       request until a losing attempt that ran inference responded
+    #   rejection: latency of a rejection response
+    # Sketches of multiple runs can be merged with sketch.merge_sketches().
+    latency_sketches: dict[str, sketch.DDSketch] = dataclasses.field(
+        default_factory=dict)
+
+    # Metrics of each window of config.metric_window seconds, as a mapping
+    # from metric to an array with one element per window. See
+    # timeseries.py for the metrics.
+    time_series: dict[str, np.ndarray] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of enrollments that were coalesced into an in-flight
+    # enrollment of the same user and version.
+    coalesced_enroll_count: int = 0
+
+    # Flops saved by coalescing enrollments.
+    coalesced_enroll_flops_saved: float = 0
+
+    # Count of requests sent to each frontend.
+    frontend_request_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of version query messages sent or received by each frontend.
+    version_query_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of version notifications pushed by workers to each frontend.
+    version_push_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of version table entries of each frontend refreshed by versions
+    # piggybacked on worker responses, which cost no extra messages.
+    version_piggyback_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of version table lookups by each frontend.
+    version_table_lookup_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of version table lookups by each frontend, where the table
+    # differed from the actual version of the worker.
+    stale_version_lookup_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of duplicate requests sent by hedging, see hedging.py.
+    hedge_count: int = 0
+
+    # Count of duplicate requests sent after timeouts.
+    retry_count: int = 0
+
+    # Count of responses from a duplicate, rather than the first attempt.
+    duplicate_win_count: int = 0
+
+    # Count of cancelled attempts that skipped inference.
+    cancelled_attempt_count: int = 0
+
+    # Flops spent on attempts whose responses were dropped.
+    duplicate_flops: float = 0
+
+    # Count of requests of each scheduling class that waited longer than
+    # config.starvation_threshold for an inference slot.
+    starvation_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of rejected requests by reason, see admission.py.
+    rejected_count: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Count of profile fetches served by frontend profile caches.
+    profile_cache_hit_count: int = 0
+
+    # Count of profile fetches that missed frontend profile caches.
+    profile_cache_miss_count: int = 0
+
+    # Count of requests sent from a frontend to a worker in another region.
+    cross_region_request_count: int = 0
+
+    # Count of profile writes replicated to other database replicas.
+    replication_count: int = 0
+
+    # Average latency for fulfilling one request, by region of the user.
+    # Only set with multiple regions.
+    average_e2e_latency_by_region: dict[str, float] = dataclasses.field(
+        default_factory=dict)
+
+    # Compiled configuration of the experiment, see config.py.
+    config: SimulationConfig = dataclasses.field(
+        default_factory=SimulationConfig)
 
     # Length of final_messages.
     total_num_messages: int = 0
 
+    # Simulated time when the simulation stopped.
+    simulated_time: float = 0
+
+    # Why the simulation stopped: "time_to_run", or the config of the
+    # early stopping condition, see termination.py.
+    stop_reason: str = "time_to_run"
+
     # Workload of the workers, as a mapping from name to
     # (time, flops) pairs.
     workload: dict[str, list[tuple[float, float]]
@@ -103,6 +268,20 @@ class GlobalStats:
     # Final messages for logging.
     final_messages: list[Message] = dataclasses.field(default_factory=list)
 
+    # If set, final messages were spilled to this file instead of being
+    # kept in final_messages. Read them with message_log.iter_messages().
+    final_messages_file: str = ""
+
+    # Traced events still in the ring buffer, if tracing is enabled.
+    # Use tracing.format_trace() to render them as text.
+    trace: Optional[np.ndarray] = None
+
+    # Names of actors, indexed by actor_id of traced events.
+    trace_actor_names: list[str] = dataclasses.field(default_factory=list)
+
+    # Performance report, if profile_simulation is enabled.
+    profile: Optional[profiling.ProfileReport] = None
+
 
 class Actor(abc.ABC):
     """An actor machine which can be either client or server."""
@@ -111,7 +290,7 @@ class Actor(abc.ABC):
             self,
             env: simpy.Environment,
             name: str,
-            config: munch.Munch,
+            config: SimulationConfig,
             stats: GlobalStats):
         self.env = env
         self.name = name
@@ -121,11 +300,63 @@ class Actor(abc.ABC):
         # A pool of messages to be processed.
         self.message_pool = simpy.Store(env)
 
+        # Tracing is disabled until set_tracer() is called.
+        self.tracer: Optional[tracing.Tracer] = None
+        self.actor_id = -1
+        self.trace_hops = False
+
+        # Region of this actor. The topology is only set with multiple
+        # regions, see set_topology().
+        self.topology: Optional[topology.RegionTopology] = None
+        self.region = 0
+
+        # Latency samplers, which are shared by all actors of a system.
+        # Created on first use if not set.
+        self.latency_model: Optional[latency.LatencyModel] = None
+
+        # Random streams, see set_streams(). Until set, self.random is the
+        # global random module.
+        self.streams = random_streams.UNSEEDED
+        self.random: Any = random
+
     @abc.abstractmethod
     def setup(self) -> None:
         """Function to add processes and other initializations."""
         pass
 
+    def set_tracer(self, tracer: tracing.Tracer, level: int) -> None:
+        """Enable structured event tracing at the given level."""
+        self.tracer = tracer
+        self.actor_id = tracer.register_actor(self.name)
+        self.trace_hops = level >= tracing.TRACE_HOP
+
+    def set_streams(self, streams: random_streams.RandomStreams) -> None:
+        """Draw the random decisions of this actor from its own stream."""
+        self.streams = streams
+        self.random = streams.get_python(f"actor/{self.name}")
+
+    def set_topology(
+            self, region_topology: topology.RegionTopology,
+            region: int) -> None:
+        """Place this actor in a region of a multi-region topology."""
+        self.topology = region_topology
+        self.region = region
+
+    def get_region_latency(self, region: int) -> float:
+        """Extra latency from the region of this actor to a region."""
+        if self.topology is None:
+            return 0.0
+        return self.topology.latency[self.region][region]
+
+    def trace(self, code: EventCode, msg_id: int = 0) -> None:
+        """Trace an infrequent event.
+
+        On hot paths, check self.trace_hops and call self.tracer.emit()
+        directly instead.
+        """
+        if self.tracer is not None:
+            self.tracer.emit(self.env.now, self.actor_id, code, msg_id)
+
     def log(self, text: str, verbosity: int = 2) -> None:
         """A replacement of print function with verbosity level support.
 
@@ -139,16 +370,120 @@ class Actor(abc.ABC):
             name = f"[{self.name}]"
             print(timestamp, name, text)
 
-    def get_latency(self, mu: float) -> simpy.events.Timeout:
-        """Simulate latency, which has a Gaussian distribution."""
-        sigma = mu / 10.0
-        latency = max(random.gauss(mu, sigma), EPS)
-        return self.env.timeout(latency)
+    def in_warmup(self, msg: Message) -> bool:
+        """Whether the request was sent during config.warmup_time, and is
+        thus excluded from stats."""
+        return (msg.client_send_time is not None
+                and msg.client_send_time < self.config.warmup_time)
+
+    def record_latency(self, metric: str, value: float) -> None:
+        """Add a latency to the sketch of a metric."""
+        sketches = self.stats.latency_sketches
+        if metric not in sketches:
+            sketches[metric] = sketch.DDSketch(
+                self.config.sketch_relative_accuracy)
+        sketches[metric].add(value)
+
+    def get_audio_scale(self, msg: Message) -> float:
+        """Ratio of the audio length of a message to the typical length."""
+        if msg.audio_length is None:
+            return 1.0
+        return msg.audio_length / self.config.audio_length
+
+    def get_latency(
+            self, mu: float, link: str = "default") -> simpy.events.Timeout:
+        """Simulate latency with mean mu, from the distribution of a link.
+
+        See latency.py for the links and their distributions.
+        """
+        if self.latency_model is None:
+            self.latency_model = latency.LatencyModel(self.config)
+        return self.env.timeout(
+            max(mu * self.latency_model.sample(link), EPS))
 
 
 class BaseDatabase(Actor):
-    """Base class for a database."""
+    """Base class for a database.
+
+    The data is sparse: only users whose profiles have been written are
+    stored in self.data, and all other users share self.default_data.
+
+    With multiple regions, each region may have its own replica. Writes
+    are applied to the local replica, and replicated to all peers after
+    config.replication_lag plus the latency between regions. Replicated
+    writes may arrive out of order, so each replica keeps the write time
+    of each user, and ignores writes older than its own.
+    """
     data: dict[int, Any]
+    default_data: Any
+
+    # Replicas of this database in other regions.
+    peers: list["BaseDatabase"]
+
+    # Time of the latest write of each user, only with peers.
+    write_times: dict[int, float]
+
+    def __init__(
+            self,
+            env: simpy.Environment,
+            name: str,
+            config: SimulationConfig,
+            stats: GlobalStats):
+        super().__init__(env, name, config, stats)
+        self.peers = []
+        self.write_times = {}
+
+    def get_data(self, user_id: int) -> Any:
+        """Get the stored data of a user."""
+        if not 0 <= user_id < self.config.num_users:
+            raise ValueError(f"Missing profile for user {user_id}")
+        return self.data.get(user_id, self.default_data)
+
+    def set_workers(self, workers: list["BaseWorker"]) -> None:
+        """Only needed by databases that track served versions."""
+        pass
+
+    def create_replica(self, name: str) -> "BaseDatabase":
+        """Create a replica with a copy of the current data."""
+        replica = copy.copy(self)
+        replica.name = name
+        replica.data = dict(self.data)
+        replica.write_times = dict(self.write_times)
+        replica.message_pool = simpy.Store(self.env)
+        return replica
+
+    def replicate(self, msg: Message) -> None:
+        """Replicate the data of the user of a request to all peers
+        asynchronously."""
+        user_id = msg.user_id
+        if self.peers:
+            self.write_times[user_id] = self.env.now
+        for peer in self.peers:
+            if not self.in_warmup(msg):
+                self.stats.replication_count += 1
+            self.env.process(self.send_replica(
+                peer, user_id, self.data[user_id], self.env.now))
+
+    def send_replica(
+            self,
+            peer: "BaseDatabase",
+            user_id: int,
+            data: Any,
+            write_time: float) -> Generator:
+        """Send the data of a user to one peer. Simulates latency."""
+        yield self.get_latency(
+            self.config.replication_lag
+            + self.get_region_latency(peer.region), "replication")
+        peer.apply_replica(user_id, data, write_time)
+
+    def apply_replica(
+            self, user_id: int, data: Any, write_time: float) -> None:
+        """Apply data replicated from a peer. Last writer wins, by the
+        time of the write rather than the time of arrival."""
+        if write_time < self.write_times.get(user_id, -math.inf):
+            return
+        self.write_times[user_id] = write_time
+        self.data[user_id] = data
 
     @abc.abstractmethod
     def fetch_profile(self, msg: Message) -> Generator:
@@ -159,20 +494,167 @@ class BaseDatabase(Actor):
         pass
 
 
+class ProfileCache:
+    """An LRU cache of user profiles with a time-to-live."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Mapping from user_id to (expiry time, profile).
+        self.entries: collections.OrderedDict[int, tuple[float, Any]] = (
+            collections.OrderedDict())
+
+    def get(self, user_id: int, now: float) -> Any:
+        """Get the cached profile of a user, or None."""
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: int, profile: Any, now: float) -> None:
+        self.entries[user_id] = (now + self.ttl, profile)
+        self.entries.move_to_end(user_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self.entries.pop(user_id, None)
+
+
 class BaseClient(Actor):
-    """Base class for a client."""
-    frontend: "BaseFrontend"
+    """Base class for a client.
+
+    With multiple frontends, the client also acts as the load balancer,
+    using the policy in config.frontend_balancer.
+    """
+    frontends: list["BaseFrontend"]
+
+    # Metrics of each window of time, if enabled.
+    windowed_metrics: Optional[timeseries.WindowedMetrics] = None
+
+    # Early stopping conditions, if enabled.
+    early_termination: Optional[termination.Termination] = None
+
+    def finish(self) -> None:
+        """Called once the simulation has stopped."""
+        pass
 
-    def set_frontend(self, frontend: "BaseFrontend") -> None:
-        self.frontend = frontend
+    def release_response(self, msg: Message) -> None:
+        """Called by a frontend once it no longer adds flops to a response
+        it has sent, see BaseFrontend.is_pending()."""
+        pass
+
+    def set_frontends(self, frontends: list["BaseFrontend"]) -> None:
+        self.frontends = frontends
+        self.frontend_dict = {
+            frontend.name: frontend for frontend in frontends}
+        self.frontend_balancer = self.config.frontend_balancer
+        if self.frontend_balancer not in {
+                "random", "round_robin", "user_hash"}:
+            raise ValueError(
+                f"Unsupported frontend_balancer: {self.frontend_balancer}")
+        self.num_balanced = 0
+
+        # With local routing, frontends of each region.
+        self.local_frontends = None
+        if (self.topology is not None and
+                self.config.frontend_routing == "local"):
+            self.local_frontends = [
+                self.topology.get_local(frontends, region)
+                for region in range(self.topology.num_regions)]
+
+    def select_frontend(self, msg: Message) -> "BaseFrontend":
+        """Decide which frontend to send the request to."""
+        frontends = self.frontends
+        if self.topology is not None:
+            msg.region = self.topology.get_user_region(msg.user_id)
+            if self.local_frontends is not None:
+                frontends = self.local_frontends[msg.region]
+        if len(frontends) == 1:
+            frontend = frontends[0]
+        elif self.frontend_balancer == "round_robin":
+            frontend = frontends[self.num_balanced % len(frontends)]
+        elif self.frontend_balancer == "user_hash":
+            frontend = frontends[msg.user_id % len(frontends)]
+        else:
+            frontend = self.random.choice(frontends)
+        self.num_balanced += 1
+        if not self.in_warmup(msg):
+            counts = self.stats.frontend_request_count
+            counts[frontend.name] = counts.get(frontend.name, 0) + 1
+        return frontend
+
+    def record_response(self, msg: Message) -> bool:
+        """Record the latencies of a final response.
+
+        Returns:
+            False if the request was sent during warm-up, and thus the
+            response is excluded from stats
+        """
+        if self.in_warmup(msg):
+            return False
+        if msg.rejected:
+            self.record_latency(
+                "rejection", msg.client_return_time - msg.client_send_time)
+            return False
+        self.record_latency(
+            "e2e", msg.client_return_time - msg.client_send_time)
+        if self.windowed_metrics is not None:
+            self.windowed_metrics.add_response(
+                msg.client_return_time - msg.client_send_time)
+        if (msg.frontend_send_worker_enroll_time is not None and
+                msg.frontend_send_worker_time is not None):
+            self.record_latency(
+                "enrollment_overhead",
+                msg.frontend_send_worker_time
+                - msg.frontend_send_worker_enroll_time)
+        if self.early_termination is not None:
+            self.early_termination.on_response()
+        return True
+
+    def get_user_latency(
+            self, msg: Message, frontend: "BaseFrontend") -> float:
+        """Extra latency from the region of the user to a frontend."""
+        if self.topology is None:
+            return 0.0
+        return self.topology.latency[msg.region][frontend.region]
 
     def send_to_frontend(self, msg: Message) -> Generator:
         """Send a message to frontend. Simulates latency."""
-        self.log("send request")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.SEND_REQUEST, msg.msg_id)
         msg.client_send_time = self.env.now
         # Simulate network latency.
-        yield self.get_latency(self.config.client_frontend_latency)
-        self.frontend.message_pool.put(msg)
+        frontend = self.select_frontend(msg)
+        yield self.get_latency(
+            self.config.client_frontend_latency * self.get_audio_scale(msg)
+            + self.get_user_latency(msg, frontend), "client_frontend")
+        frontend.receive_request(msg)
+
+    def post_to_frontend(self, msg: Message) -> None:
+        """Same as send_to_frontend, but without a process per message.
+
+        The message is put into the frontend message pool by a callback of
+        the latency timeout.
+        """
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.SEND_REQUEST, msg.msg_id)
+        msg.client_send_time = self.env.now
+        frontend = self.select_frontend(msg)
+        # Simulate network latency.
+        latency = self.get_latency(
+            self.config.client_frontend_latency * self.get_audio_scale(msg)
+            + self.get_user_latency(msg, frontend), "client_frontend")
+        latency.callbacks.append(
+            lambda _: frontend.receive_request(msg))
 
 
 class BaseFrontend(Actor):
@@ -180,43 +662,181 @@ class BaseFrontend(Actor):
     client: BaseClient
     workers: list["BaseWorker"]
 
+    # In-flight enrollments, as a mapping from (user_id, version) to the
+    # event that succeeds once the enrollment has been written to database.
+    inflight_enrollments: dict[tuple[int, int], simpy.Event]
+
+    # Mapping from msg_id of enrollment requests to their keys in
+    # inflight_enrollments.
+    enrollment_keys: dict[int, tuple[int, int]]
+
+    def __init__(
+            self,
+            env: simpy.Environment,
+            name: str,
+            config: SimulationConfig,
+            stats: GlobalStats):
+        super().__init__(env, name, config, stats)
+        self.inflight_enrollments = {}
+        self.enrollment_keys = {}
+        self.profile_cache = None
+        if self.config.profile_cache_ttl > 0:
+            self.profile_cache = ProfileCache(
+                self.config.profile_cache_ttl,
+                self.config.profile_cache_size)
+        self.hedger = None
+        if hedging.is_enabled(self.config):
+            self.hedger = hedging.Hedger(self)
+        self.admission = None
+        if admission.is_enabled(self.config):
+            self.admission = admission.AdmissionController(self)
+
     def set_client(self, client: BaseClient) -> None:
         self.client = client
 
+    def is_pending(self, msg: Message) -> bool:
+        """Whether the frontend may still add flops to a response it has
+        sent, in which case it calls client.release_response() later."""
+        return False
+
     def set_workers(self, workers: list["BaseWorker"]) -> None:
         self.workers = workers
 
     def set_database(self, database: BaseDatabase) -> None:
         self.database = database
 
+    def receive_request(self, msg: Message) -> None:
+        """Accept a request from the client, or reject it."""
+        if self.admission is not None and not self.admission.admit(msg):
+            self.env.process(self.reject(msg, admission.ADMISSION))
+            return
+        self.message_pool.put(msg)
+
+    def reject(self, msg: Message, reason: str) -> Generator:
+        """Send a rejection response to the client."""
+        msg.rejected = reason
+        msg.is_request = False
+        yield from self.send_to_client(msg)
+
     def select_worker(self, msg: Message) -> "BaseWorker":
         """Decide which worker to send the request to."""
         # By default, simply send request to a random worker.
-        return random.choice(self.workers)
+        return self.random.choice(self.workers)
+
+    def get_database_latency(self) -> float:
+        """Extra round-trip latency to a database in another region."""
+        return (self.get_region_latency(self.database.region)
+                + self.database.get_region_latency(self.region))
+
+    def fetch_profile(self, msg: Message) -> Generator:
+        """Fetch profile from the profile cache or the database."""
+        if self.profile_cache is not None:
+            entry = self.profile_cache.get(msg.user_id, self.env.now)
+            if entry is not None:
+                if not self.in_warmup(msg):
+                    self.stats.profile_cache_hit_count += 1
+                msg.profile_version = entry[0]
+                msg.profile_versions = list(entry[1])
+                return
+            if not self.in_warmup(msg):
+                self.stats.profile_cache_miss_count += 1
+        start_time = self.env.now
+        if self.topology is not None and self.get_database_latency() > 0:
+            yield self.get_latency(self.get_database_latency(), "region")
+        yield from self.database.fetch_profile(msg)
+        if not self.in_warmup(msg):
+            self.record_latency("database", self.env.now - start_time)
+        if self.profile_cache is not None:
+            self.profile_cache.put(
+                msg.user_id,
+                (msg.profile_version, tuple(msg.profile_versions)),
+                self.env.now)
+
+    def update_profile(self, msg: Message) -> Generator:
+        """Update profile in the database, and invalidate the cache."""
+        start_time = self.env.now
+        if self.topology is not None and self.get_database_latency() > 0:
+            yield self.get_latency(self.get_database_latency(), "region")
+        yield from self.database.update_profile(msg)
+        if not self.in_warmup(msg):
+            self.record_latency("database", self.env.now - start_time)
+            self.stats.enrollment_count += 1
+        if self.profile_cache is not None:
+            self.profile_cache.invalidate(msg.user_id)
+
+    def join_enrollment(
+            self, msg: Message, version: int) -> Optional[simpy.Event]:
+        """Join an in-flight enrollment of the same user and version.
+
+        Returns:
+            the event of the in-flight enrollment if this request has been
+            coalesced into it, or None if the caller should run the
+            enrollment by itself
+        """
+        if not self.config.coalesce_enrollments:
+            return None
+        key = (msg.user_id, version)
+        if key in self.inflight_enrollments:
+            if not self.in_warmup(msg):
+                self.stats.coalesced_enroll_count += 1
+                self.stats.coalesced_enroll_flops_saved += (
+                    self.config.flops_per_inference
+                    * self.get_audio_scale(msg))
+            return self.inflight_enrollments[key]
+        self.inflight_enrollments[key] = self.env.event()
+        self.enrollment_keys[msg.msg_id] = key
+        return None
+
+    def complete_enrollment(self, msg: Message) -> None:
+        """Wake up all requests waiting for this enrollment."""
+        key = self.enrollment_keys.pop(msg.msg_id, None)
+        if key is not None:
+            self.inflight_enrollments.pop(key).succeed()
 
     def send_to_worker(self, worker: Actor, msg: Message) -> Generator:
         """Send a message to worker. Simulates latency."""
-        self.log("send request")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.SEND_REQUEST, msg.msg_id)
         if msg.is_enroll:
             msg.frontend_send_worker_enroll_time = self.env.now
         else:
             msg.frontend_send_worker_time = self.env.now
+        msg.frontend_name = self.name
+        if self.hedger is not None:
+            self.hedger.track(worker, msg)
+        if (self.topology is not None and worker.region != self.region
+                and not self.in_warmup(msg)):
+            self.stats.cross_region_request_count += 1
         # Simulate network latency.
-        yield self.get_latency(self.config.frontend_worker_latency)
+        yield self.get_latency(
+            self.config.frontend_worker_latency * self.get_audio_scale(msg)
+            + self.get_region_latency(worker.region), "frontend_worker")
         worker.message_pool.put(msg)
 
     def send_to_client(self, msg: Message) -> Generator:
         """Send a message to client. Simulates latency."""
-        self.log("send response")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.SEND_RESPONSE, msg.msg_id)
         msg.frontend_return_time = self.env.now
+        if msg.rejected and not self.in_warmup(msg):
+            counts = self.stats.rejected_count
+            counts[msg.rejected] = counts.get(msg.rejected, 0) + 1
+        if self.admission is not None:
+            self.admission.release(msg)
         # Simulate network latency.
-        yield self.get_latency(self.config.client_frontend_latency)
+        yield self.get_latency(
+            self.config.client_frontend_latency
+            + self.get_region_latency(msg.region), "client_frontend")
         self.client.message_pool.put(msg)
 
 
 class BaseWorker(Actor):
     """Base class for a cloud worker."""
-    frontend: BaseFrontend
+    frontends: dict[str, BaseFrontend]
 
     # For single version worker.
     version: int
@@ -224,8 +844,21 @@ class BaseWorker(Actor):
     # For multi version worker.
     versions: list[int]
 
-    def set_frontend(self, frontend: BaseFrontend) -> None:
-        self.frontend = frontend
+    def __init__(
+            self,
+            env: simpy.Environment,
+            name: str,
+            config: SimulationConfig,
+            stats: GlobalStats):
+        super().__init__(env, name, config, stats)
+        # Slots of concurrent inferences. Unlimited if None.
+        self.inference_slots: Optional[scheduling.WorkerScheduler] = None
+        if config.worker_concurrency > 0:
+            self.inference_slots = scheduling.WorkerScheduler(
+                env, config, config.worker_concurrency)
+
+    def set_frontends(self, frontends: list[BaseFrontend]) -> None:
+        self.frontends = {frontend.name: frontend for frontend in frontends}
 
     def set_model_version(self, version: int) -> None:
         self.version = version
@@ -233,26 +866,102 @@ class BaseWorker(Actor):
     def set_model_versions(self, versions: list[int]) -> None:
         self.versions = versions
 
+    def record_update(self) -> None:
+        """Record a model update of this worker."""
+        self.stats.num_worker_updates += 1
+        self.stats.worker_update_times.append(self.env.now)
+        self.trace(EventCode.UPDATE_MODEL_VERSION)
+
     def send_to_frontend(self, msg: Message) -> Generator:
         """Send a message to frontend. Simulates latency."""
-        self.log("send response")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.SEND_RESPONSE, msg.msg_id)
         msg.worker_return_time = self.env.now
+        frontend = self.frontends[msg.frontend_name]
         # Simulate network latency.
-        yield self.get_latency(self.config.frontend_worker_latency)
-        self.frontend.message_pool.put(msg)
+        yield self.get_latency(
+            self.config.frontend_worker_latency
+            + self.get_region_latency(frontend.region), "frontend_worker")
+        if frontend.hedger is not None and not frontend.hedger.accept(msg):
+            return
+        frontend.message_pool.put(msg)
+
+    def can_serve(self, msg: Message) -> bool:
+        """Whether this worker serves a profile version of the request."""
+        return True
 
     def run_inference(self, msg: Message) -> Generator:
-        """Run inference of speech engine. Simulates latency."""
-        self.log("run inference")
+        """Run inference of speech engine. Simulates latency.
+
+        With config.worker_concurrency, first waits for a free slot, in
+        the order of config.worker_scheduling, or rejects verification
+        requests if config.worker_queue_capacity requests are already
+        waiting. Attempts cancelled by the frontend before inference are
+        skipped.
+        """
+        if self.inference_slots is None:
+            if not self.skip_cancelled(msg):
+                yield from self.infer(msg)
+            return
+        if self.skip_cancelled(msg):
+            return
+        capacity = self.config.worker_queue_capacity
+        if (capacity > 0 and not msg.is_enroll
+                and self.inference_slots.queue_length >= capacity):
+            msg.rejected = admission.WORKER_QUEUE
+            return
+        start_time = self.env.now
+        yield self.inference_slots.request(msg, self.get_audio_scale(msg))
+        try:
+            self.record_queue_wait(msg, self.env.now - start_time)
+            if not self.skip_cancelled(msg):
+                yield from self.infer(msg)
+        finally:
+            self.inference_slots.release()
+
+    def record_queue_wait(self, msg: Message, wait: float) -> None:
+        """Record the time waiting for a slot, overall and by class."""
+        if self.in_warmup(msg):
+            return
+        self.record_latency("worker_queue", wait)
+        name = scheduling.get_class(msg)
+        self.record_latency(f"worker_queue/{name}", wait)
+        if wait > self.config.starvation_threshold:
+            counts = self.stats.starvation_count
+            counts[name] = counts.get(name, 0) + 1
+
+    def skip_cancelled(self, msg: Message) -> bool:
+        """Whether to skip inference of a cancelled attempt."""
+        if msg.cancelled:
+            if not self.in_warmup(msg):
+                self.stats.cancelled_attempt_count += 1
+            return True
+        return False
+
+    def infer(self, msg: Message) -> Generator:
+        """Inference of one message, once it has a slot."""
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.RUN_INFERENCE, msg.msg_id)
         # Simulate computation latency.
-        yield self.get_latency(self.config.worker_inference_latency)
-        msg.total_flops += self.config.flops_per_inference
+        audio_scale = self.get_audio_scale(msg)
+        start_time = self.env.now
+        yield self.get_latency(
+            self.config.worker_inference_latency * audio_scale,
+            "worker_inference")
+        flops = self.config.flops_per_inference * audio_scale
+        msg.total_flops += flops
+        if self.in_warmup(msg):
+            return
 
         # Add to stats.
+        self.record_latency("worker", self.env.now - start_time)
         if self.name not in self.stats.workload:
             self.stats.workload[self.name] = []
-        self.stats.workload[self.name].append(
-            (self.env.now, self.config.flops_per_inference))
+        self.stats.workload[self.name].append((self.env.now, flops))
 
 
 class SingleVersionDatabase(BaseDatabase):
@@ -265,8 +974,7 @@ class SingleVersionDatabase(BaseDatabase):
     def create(self, init_version: int) -> None:
         """Add initial version for all users."""
         self.data = {}
-        for user_id in range(self.config.num_users):
-            self.data[user_id] = init_version
+        self.default_data = init_version
 
     def fetch_profile(self, msg: Message) -> Generator:
         """Fetch profile from database. Simulates latency."""
@@ -275,11 +983,9 @@ class SingleVersionDatabase(BaseDatabase):
         if msg.is_enroll:
             raise ValueError("Cannot fetch profile with enrollment request.")
         msg.fetch_database_time = self.env.now
-        yield self.get_latency(self.config.database_read_latency)
-        if msg.user_id not in self.data:
-            raise ValueError(f"Missing profile for user {msg.user_id}")
-
-        msg.profile_version = self.data[msg.user_id]
+        yield self.get_latency(
+            self.config.database_read_latency, "database_read")
+        msg.profile_version = self.get_data(msg.user_id)
 
     def update_profile(self, msg: Message) -> Generator:
         """Update profile in database. Simulates latency."""
@@ -288,22 +994,104 @@ class SingleVersionDatabase(BaseDatabase):
         if msg.is_enroll:
             raise ValueError("Cannot update profile with enrollment request.")
         msg.udpate_database_time = self.env.now
-        yield self.get_latency(self.config.database_write_latency)
+        yield self.get_latency(
+            self.config.database_write_latency, "database_write")
+        # Validate user_id before materializing the entry.
+        self.get_data(msg.user_id)
         self.data[msg.user_id] = msg.profile_version
+        self.replicate(msg)
 
 
 class MultiVersionDatabase(BaseDatabase):
-    """Database storing multiple versions of profile for each user."""
+    """Database storing multiple versions of profile for each user.
+
+    The versions of each user are stored as an integer bitmask, where bit i
+    means that version (base_version + i) has been enrolled. This gives
+    per-user isolation and O(1) membership checks.
+
+    Retention is controlled by two configs:
+        profile_retention_versions: if positive, only keep the latest K
+            versions for each user.
+        drop_unserved_profile_versions: if True, drop versions that are
+            older than any version served by the workers.
+    """
+    workers: list["BaseWorker"]
+
+    # Version represented by bit 0 of each bitmask.
+    base_version: int
+
+    # Versions below this are treated as dropped for all users.
+    min_version: int
 
     def setup(self) -> None:
         """No processes."""
         pass
 
+    def set_workers(self, workers: list["BaseWorker"]) -> None:
+        self.workers = workers
+
     def create(self, init_versions: list[int]) -> None:
         """Add initial versions for all users."""
+        if len(init_versions) == 0:
+            raise ValueError("init_versions must not be empty.")
+        self.base_version = min(init_versions)
+        self.min_version = self.base_version
         self.data = {}
-        for user_id in range(self.config.num_users):
-            self.data[user_id] = init_versions
+        self.default_data = self.apply_retention(self.encode(init_versions))
+
+    def encode(self, versions: list[int]) -> int:
+        """Encode a list of versions as a bitmask."""
+        mask = 0
+        for version in versions:
+            if version < self.base_version:
+                raise ValueError(
+                    f"Version {version} is older than base version "
+                    f"{self.base_version}.")
+            mask |= 1 << (version - self.base_version)
+        return mask
+
+    def decode(self, mask: int) -> list[int]:
+        """Decode a bitmask as a sorted list of versions."""
+        versions = []
+        offset = 0
+        while mask:
+            if mask & 1:
+                versions.append(self.base_version + offset)
+            mask >>= 1
+            offset += 1
+        return versions
+
+    def apply_retention(self, mask: int) -> int:
+        """Drop versions from a bitmask according to the retention policy.
+
+        The newest version is always kept.
+        """
+        newest_bit = 1 << (mask.bit_length() - 1)
+        mask &= ~((1 << (self.min_version - self.base_version)) - 1)
+        max_versions = self.config.profile_retention_versions
+        if max_versions:
+            while mask.bit_count() > max_versions:
+                # Clear the lowest set bit.
+                mask &= mask - 1
+        return mask | newest_bit
+
+    def has_version(self, user_id: int, version: int) -> bool:
+        """Check whether a version is enrolled for a user."""
+        if version < self.min_version:
+            return False
+        mask = self.get_data(user_id)
+        return bool((mask >> (version - self.base_version)) & 1)
+
+    def update_min_version(self) -> None:
+        """Drop versions that are not served by any worker."""
+        served = []
+        for worker in self.workers:
+            if hasattr(worker, "versions"):
+                served.append(min(worker.versions))
+            else:
+                served.append(worker.version)
+        if served:
+            self.min_version = max(self.min_version, min(served))
 
     def fetch_profile(self, msg: Message) -> Generator:
         """Fetch profiles from database. Simulates latency."""
@@ -312,11 +1100,10 @@ class MultiVersionDatabase(BaseDatabase):
         if msg.is_enroll:
             raise ValueError("Cannot fetch profile with enrollment request.")
         msg.fetch_database_time = self.env.now
-        yield self.get_latency(self.config.database_read_latency)
-        if msg.user_id not in self.data:
-            raise ValueError(f"Missing profile for user {msg.user_id}")
-
-        msg.profile_versions = self.data[msg.user_id]
+        yield self.get_latency(
+            self.config.database_read_latency, "database_read")
+        msg.profile_versions = self.decode(
+            self.apply_retention(self.get_data(msg.user_id)))
 
     def update_profile(self, msg: Message) -> Generator:
         """Update profiles in database. Simulates latency."""
@@ -325,37 +1112,65 @@ class MultiVersionDatabase(BaseDatabase):
         if msg.is_enroll:
             raise ValueError("Cannot update profile with enrollment request.")
         msg.udpate_database_time = self.env.now
-        yield self.get_latency(self.config.database_write_latency)
-        if msg.profile_version is not None:
-            # From single version worker.
-            if msg.profile_version not in self.data[msg.user_id]:
-                self.data[msg.user_id].append(msg.profile_version)
-        else:
+        yield self.get_latency(
+            self.config.database_write_latency, "database_write")
+        if msg.profile_version is None:
             raise ValueError("profile_version should not be empty.")
-            # TODO: remove
-            # From multi version worker.
-            if len(msg.profile_versions) == 0:
-                raise ValueError("Expecting non-empty profile_versions.")
-            for version in msg.profile_versions:
-                if version not in self.data[msg.user_id]:
-                    self.data[msg.user_id].append(version)
+        if self.config.drop_unserved_profile_versions:
+            self.update_min_version()
+        self.data[msg.user_id] = self.apply_retention(
+            self.get_data(msg.user_id) | self.encode([msg.profile_version]))
+        self.replicate(msg)
+
+    def apply_replica(
+            self, user_id: int, data: int, write_time: float) -> None:
+        """Merge versions replicated from a peer, in any order."""
+        self.data[user_id] = self.apply_retention(
+            self.get_data(user_id) | data)
+
+
+def create_frontends(
+        frontend_class: type[BaseFrontend],
+        env: simpy.Environment,
+        config: SimulationConfig,
+        stats: GlobalStats) -> list[BaseFrontend]:
+    """Create config.num_frontends frontends of the same class."""
+    num_frontends = config.num_frontends
+    if num_frontends == 1:
+        return [frontend_class(env, "frontend", config, stats)]
+    return [
+        frontend_class(env, f"frontend-{i}", config, stats)
+        for i in range(num_frontends)]
 
 
 class NetworkSystem:
-    """Class for the entire network system."""
+    """Class for the entire network system.
+
+    There can be multiple frontends, each with its own message pool and
+    state, behind a load balancer in the client.
+
+    With multiple regions in config.regions, actors are placed in regions,
+    and the database is replicated to each region in config.database_regions.
+    Each frontend uses the nearest database replica.
+    """
 
     def __init__(
             self,
             env: simpy.Environment,
             client: BaseClient,
-            frontend: BaseFrontend,
+            frontend: Union[BaseFrontend, list[BaseFrontend]],
             workers: list[BaseWorker],
             database: BaseDatabase):
         self.env = env
 
         # Set actors.
         self.client = client
-        self.frontend = frontend
+        if isinstance(frontend, BaseFrontend):
+            self.frontends = [frontend]
+        else:
+            self.frontends = frontend
+        # The first frontend, for convenience.
+        self.frontend = self.frontends[0]
         self.workers = workers
 
         # Set database.
@@ -367,51 +1182,207 @@ class NetworkSystem:
         # Set worker model version.
         self.set_worker_model_version()
 
+        # Random streams of all actors, see random_streams.py.
+        self.streams = random_streams.RandomStreams(
+            self.config.random_seed)
+
+        # Share the latency samplers across all actors.
+        self.latency_model = latency.LatencyModel(
+            self.config, streams=self.streams)
+
+        # Place actors in regions.
+        self.topology = topology.RegionTopology(self.config)
+        self.databases = [self.database]
+        if self.topology.enabled:
+            self.set_regions()
+
         # Build connections.
-        self.client.set_frontend(self.frontend)
-        self.frontend.set_client(self.client)
-        self.frontend.set_workers(self.workers)
-        self.frontend.set_database(self.database)
+        self.client.set_frontends(self.frontends)
+        local_workers = (
+            self.topology.enabled and
+            self.config.worker_routing == "local")
+        for frontend in self.frontends:
+            frontend.set_client(self.client)
+            if local_workers:
+                frontend.set_workers(
+                    self.topology.get_local(self.workers, frontend.region))
+            else:
+                frontend.set_workers(self.workers)
+            frontend.set_database(min(
+                self.databases,
+                key=lambda x: (frontend.get_region_latency(x.region)
+                               + x.get_region_latency(frontend.region))))
+        for database in self.databases:
+            database.set_workers(self.workers)
+        for actor in self.get_actors():
+            actor.latency_model = self.latency_model
+            actor.set_streams(self.streams)
         for worker in self.workers:
-            worker.set_frontend(self.frontend)
+            worker.set_frontends(self.frontends)
+
+        # Enable tracing before any process starts.
+        self.tracer = None
+        trace_level = self.config.trace_level
+        if trace_level > tracing.TRACE_OFF:
+            self.tracer = tracing.Tracer(
+                self.config.trace_buffer_size,
+                self.config.trace_file)
+            for actor in self.get_actors():
+                actor.set_tracer(self.tracer, trace_level)
+
+        # Record metrics of each window of time.
+        self.windowed_metrics = None
+        if self.config.metric_window > 0:
+            self.windowed_metrics = timeseries.WindowedMetrics(
+                self.env, self.client.stats)
+            self.client.windowed_metrics = self.windowed_metrics
+            self.env.process(self.windowed_metrics.run())
+
+        # Stop early on the stopping conditions in the config.
+        self.early_termination = None
+        if any(getattr(self.config, key) > 0 for key in [
+                "stop_after_requests",
+                "stop_settle_time",
+                "stop_stability_tolerance"]):
+            self.early_termination = termination.Termination(self)
+            self.client.early_termination = self.early_termination
 
         # Add processes.
         self.client.setup()
-        self.frontend.setup()
+        for frontend in self.frontends:
+            frontend.setup()
         for worker in self.workers:
             worker.setup()
 
+    def set_regions(self) -> None:
+        """Place all actors in regions, and create database replicas."""
+        self.client.set_topology(self.topology, 0)
+        for i, frontend in enumerate(self.frontends):
+            frontend.set_topology(
+                self.topology, self.topology.get_region("frontend", i))
+        for i, worker in enumerate(self.workers):
+            worker.set_topology(
+                self.topology, self.topology.get_region("worker", i))
+        self.database.set_topology(
+            self.topology, self.topology.get_region("database", 0))
+        for i in range(1, len(self.config.database_regions)):
+            region = self.topology.get_region("database", i)
+            replica = self.database.create_replica(
+                f"{self.database.name}-{self.topology.regions[region]}")
+            replica.set_topology(self.topology, region)
+            self.databases.append(replica)
+        for database in self.databases:
+            database.peers = [x for x in self.databases if x is not database]
+
+    def get_actors(self) -> list[Actor]:
+        """All actors in the system."""
+        return [self.client, *self.frontends, *self.workers, *self.databases]
+
+    def get_phase(self) -> str:
+        """Phase of the model update of the workers."""
+        num_updates = self.client.stats.num_worker_updates
+        if num_updates == 0:
+            return "before_update"
+        if num_updates < len(self.workers):
+            return "updating"
+        return "after_update"
+
     def set_worker_model_version(self):
         for worker in self.workers:
             worker.set_model_version(1)
 
+    def iter_final_columns(self) -> Iterator[dict[str, np.ndarray]]:
+        """Iterate over the columns of final messages, in chunks.
+
+        Only the columns needed by aggregate_metrics() are guaranteed.
+        """
+        stats = self.client.stats
+        if stats.final_messages_file:
+            for columns in message_log.iter_message_chunks(
+                    stats.final_messages_file):
+                if len(columns["msg_id"]):
+                    yield columns
+        elif stats.final_messages:
+            messages = stats.final_messages
+            yield {
+                "msg_id": np.array([x.msg_id for x in messages]),
+                "client_send_time": np.array(
+                    [x.client_send_time for x in messages]),
+                "client_return_time": np.array(
+                    [x.client_return_time for x in messages]),
+                "total_flops": np.array(
+                    [x.total_flops for x in messages], dtype=np.float64),
+                "region": np.array([x.region for x in messages]),
+            }
+
     def aggregate_metrics(self) -> GlobalStats:
         """Aggregate metrics, and maybe print."""
         stats = self.client.stats
-        stats.total_num_messages = len(stats.final_messages)
-        for msg in stats.final_messages:
-            stats.average_e2e_latency += (
-                msg.client_return_time - msg.client_send_time)
+        num_regions = self.topology.num_regions
+        region_latencies = np.zeros(num_regions)
+        region_counts = np.zeros(num_regions, dtype=np.int64)
+        for columns in self.iter_final_columns():
+            latencies = (
+                columns["client_return_time"] - columns["client_send_time"])
+            flops = columns["total_flops"]
+            stats.total_num_messages += len(latencies)
+            stats.average_e2e_latency += float(latencies.sum())
             stats.max_e2e_latency = max(
-                stats.max_e2e_latency,
-                msg.client_return_time - msg.client_send_time)
-            stats.average_total_flops += msg.total_flops
+                stats.max_e2e_latency, float(latencies.max()))
+            stats.average_total_flops += float(flops.sum())
             stats.max_total_flops = max(
-                stats.max_total_flops, msg.total_flops)
-        stats.average_e2e_latency /= stats.total_num_messages
-        stats.average_total_flops /= stats.total_num_messages
+                stats.max_total_flops, float(flops.max()))
+            np.add.at(region_latencies, columns["region"], latencies)
+            region_counts += np.bincount(
+                columns["region"], minlength=num_regions)
+        if stats.total_num_messages:
+            stats.average_e2e_latency /= stats.total_num_messages
+            stats.average_total_flops /= stats.total_num_messages
+        stats.latency_percentiles = {
+            metric: {
+                f"p{percentile:g}": metric_sketch.quantile(percentile / 100)
+                for percentile in self.config.reported_percentiles}
+            for metric, metric_sketch in stats.latency_sketches.items()}
+        if self.topology.enabled:
+            stats.average_e2e_latency_by_region = {
+                name: float(region_latencies[i] / region_counts[i])
+                for i, name in enumerate(self.topology.regions)
+                if region_counts[i]}
 
         if self.config.print_stats:
             print("========================================")
             print("Global stats:")
-            stats_short = copy.deepcopy(stats)
-            stats_short.final_messages = None
-            stats_short.workload = None
+            stats_short = dataclasses.replace(
+                stats,
+                final_messages=None,
+                workload=None,
+                trace=None,
+                trace_actor_names=None,
+                profile=None,
+                latency_sketches=None,
+                time_series=None)
             print(stats_short)
 
         return stats
 
     def simulate(self) -> GlobalStats:
         """Run simulation."""
-        self.env.run(until=self.config.time_to_run)
-        return self.aggregate_metrics()
+        if self.config.profile_simulation:
+            self.client.stats.profile = profiling.run_profiled(
+                self.env, self.config.time_to_run, self.get_phase)
+        else:
+            self.env.run(until=self.config.time_to_run)
+        self.client.stats.simulated_time = self.env.now
+        self.client.finish()
+        if self.windowed_metrics is not None:
+            self.client.stats.time_series = self.windowed_metrics.finish()
+        if self.tracer is not None:
+            self.tracer.close()
+            self.client.stats.trace = self.tracer.events()
+            self.client.stats.trace_actor_names = self.tracer.actor_names
+        if self.client.stats.profile is None:
+            return self.aggregate_metrics()
+        start = time.perf_counter()
+        stats = self.aggregate_metrics()
+        stats.profile.aggregate_time = time.perf_counter() - start
+        return stats
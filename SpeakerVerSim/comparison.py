@@ -0,0 +1,202 @@
+"""Paired comparison of strategies with common random numbers.
+
+Each replicate simulates every strategy with the same config.random_seed,
+so that all strategies see the same arrivals, worker update times and
+latency draws, see random_streams.py. The difference of a metric between a
+strategy and the baseline strategy is then estimated by the mean of the
+paired differences over replicates, whose variance is much smaller than
+that of independent runs, as the shared noise cancels out:
+    Var(A - B) = Var(A) + Var(B) - 2 Cov(A, B)
+
+Each difference is reported with the half width of its confidence interval
+from the paired differences, and, for reference, the half width if the
+same runs had been independent. The ratio of their squares is roughly how
+many times more replicates independent runs would need for the same
+precision.
+"""
+import dataclasses
+import math
+import multiprocessing
+import statistics
+from typing import Any, Optional
+
+from SpeakerVerSim import planner
+from SpeakerVerSim.common import STRATEGIES
+from SpeakerVerSim.config import check_requirements, compile_config
+
+# Metrics of planner.run_replicate() that are compared.
+METRICS = [
+    "mean_latency",
+    "latency",
+    "backward_bounce_rate",
+    "forward_bounce_rate",
+    "query_rate",
+    "mean_flops",
+    "duplicate_flops",
+    "rejection_rate",
+]
+
+
+@dataclasses.dataclass
+class PairedDifference:
+    """Difference of a metric between a strategy and the baseline."""
+    strategy: str
+    metric: str
+
+    # Mean of the strategy minus the baseline.
+    mean: float
+
+    # Half width of the confidence interval from paired differences.
+    half_width: float
+
+    # Half width of the confidence interval if runs were independent.
+    unpaired_half_width: float
+
+    @property
+    def variance_reduction(self) -> float:
+        """How many times fewer replicates pairing needs."""
+        if self.half_width == 0:
+            return math.inf if self.unpaired_half_width > 0 else 1.0
+        return (self.unpaired_half_width / self.half_width) ** 2
+
+
+@dataclasses.dataclass
+class ComparisonReport:
+    """Result of comparing strategies."""
+    baseline: str
+    replicates: int
+    confidence: float
+
+    # Metrics of each replicate, as a mapping from strategy to metric to
+    # values, where the i-th values of all strategies are paired.
+    metrics: dict[str, dict[str, list[float]]] = dataclasses.field(
+        default_factory=dict)
+
+    # Differences of each strategy other than the baseline.
+    differences: list[PairedDifference] = dataclasses.field(
+        default_factory=list)
+
+    # Count of simulations that were run, excluding cache hits.
+    num_simulations: int = 0
+
+    def format(self) -> list[str]:
+        """Lines of a text table of the differences."""
+        lines = [
+            f"Differences to {self.baseline}, {self.replicates} replicates, "
+            f"{self.confidence:.0%} confidence:"]
+        for diff in self.differences:
+            lines.append(
+                f"{diff.strategy:>10s} {diff.metric:>20s}: "
+                f"{diff.mean:+.4g} +/- {diff.half_width:.2g} "
+                f"(unpaired +/- {diff.unpaired_half_width:.2g}, "
+                f"{diff.variance_reduction:.1f}x fewer runs)")
+        return lines
+
+
+def get_half_width(values: list[float], z_score: float) -> float:
+    """Half width of the confidence interval of the mean of values."""
+    if len(values) < 2:
+        return 0.0
+    return z_score * statistics.stdev(values) / math.sqrt(len(values))
+
+
+def get_differences(
+        metrics: dict[str, dict[str, list[float]]],
+        baseline: str,
+        z_score: float) -> list[PairedDifference]:
+    """Paired differences of all strategies to the baseline."""
+    differences = []
+    base = metrics[baseline]
+    for strategy, values in metrics.items():
+        if strategy == baseline:
+            continue
+        for metric in METRICS:
+            paired = [x - y for x, y in zip(values[metric], base[metric])]
+            differences.append(PairedDifference(
+                strategy=strategy,
+                metric=metric,
+                mean=statistics.fmean(paired),
+                half_width=get_half_width(paired, z_score),
+                unpaired_half_width=math.hypot(
+                    get_half_width(values[metric], z_score),
+                    get_half_width(base[metric], z_score))))
+    return differences
+
+
+def compare_strategies(
+        config: Any,
+        strategies: Optional[list[str]] = None,
+        baseline: Optional[str] = None,
+        replicates: int = 10,
+        processes: int = 1,
+        confidence: float = 0.95,
+        seed: int = 0,
+        percentile: float = 99,
+        common_random_numbers: bool = True,
+        cache_file: str = "") -> ComparisonReport:
+    """Compare strategies on the same config.
+
+    Args:
+        config: a Munch of the configurations, or a compiled config
+        strategies: strategies to compare; all built-in ones if None
+        baseline: strategy to compare against; the first one if None
+        replicates: number of replicates of each strategy
+        processes: number of parallel processes
+        confidence: confidence level of the intervals
+        seed: random seed of the first replicate; replicate i uses seed + i
+        percentile: percentile of the e2e latency for the latency metric
+        common_random_numbers: if False, each strategy uses different
+            seeds, as independent runs
+        cache_file: pickle file to cache results, see planner.py
+
+    Returns:
+        the comparison report
+    """
+    if strategies is None:
+        strategies = [str(x.value) for x in STRATEGIES]
+    strategies = [str(getattr(x, "value", x)) for x in strategies]
+    if baseline is None:
+        baseline = strategies[0]
+    if baseline not in strategies:
+        strategies = [baseline] + strategies
+    if replicates <= 0:
+        raise ValueError("replicates must be positive.")
+    base_config = dataclasses.replace(
+        compile_config(config), log_verbosity=0, print_stats=False)
+
+    tasks = {}
+    keys: dict[str, list[str]] = {}
+    for index, strategy in enumerate(strategies):
+        keys[strategy] = []
+        for i in range(replicates):
+            random_seed = seed + i
+            if not common_random_numbers:
+                random_seed += index * replicates
+            strategy_config = dataclasses.replace(
+                base_config, strategy=strategy)
+            check_requirements(strategy_config)
+            key, task = planner.get_task(
+                strategy_config, random_seed, percentile)
+            tasks[key] = task
+            keys[strategy].append(key)
+
+    cache = planner.load_cache(cache_file)
+    report = ComparisonReport(
+        baseline=baseline, replicates=replicates, confidence=confidence)
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        report.num_simulations = planner.run_missing(tasks, cache, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        planner.save_cache(cache, cache_file)
+
+    for strategy in strategies:
+        results = [cache[key] for key in keys[strategy]]
+        report.metrics[strategy] = {
+            metric: [result[metric] for result in results]
+            for metric in METRICS}
+    report.differences = get_differences(
+        report.metrics, baseline, planner.get_z_score(confidence))
+    return report
@@ -0,0 +1,375 @@
+"""Compiled, validated configuration of a simulation.
+
+A configuration is usually loaded from YAML as a Munch. Before building a
+system, it is compiled by compile_config() into a SimulationConfig: a
+frozen, slotted object with one typed field per key, such that actors read
+it by plain attribute access in the hot paths, instead of dict lookups
+through Munch.__getattr__.
+
+Compilation validates the configuration once, and fails up front with a
+clear error on:
+    unknown keys, such as typos, with a suggestion of the closest key
+    values of the wrong type
+    values out of range, or not one of the supported choices
+    strategy-specific requirements, see STRATEGY_REQUIREMENTS
+
+Keys that are not set take the defaults below, which disable optional
+features, such as logging and time series. These differ from
+example_config.yml, which enables some of them. Latencies are jittered
+even by default, with latency.DEFAULT_DISTRIBUTION for links that are not
+in latency_distributions. Actors read every key as an attribute, so the
+defaults below are the only ones. Keys of custom strategies, see
+registry.py, can be set under the "extra" key, and are read like any other
+key.
+"""
+import dataclasses
+import difflib
+import math
+import typing
+from typing import Any, Mapping, Optional, Union
+import munch
+
+from SpeakerVerSim import registry
+
+
+def _field(
+        default: Any,
+        minimum: Optional[float] = None,
+        maximum: Optional[float] = None,
+        positive: bool = False,
+        choices: Optional[tuple] = None) -> Any:
+    """A field of SimulationConfig, with its constraints as metadata."""
+    metadata = {
+        "minimum": minimum,
+        "maximum": maximum,
+        "positive": positive,
+        "choices": choices,
+    }
+    if isinstance(default, (list, dict)):
+        return dataclasses.field(
+            default_factory=lambda: type(default)(default), metadata=metadata)
+    return dataclasses.field(default=default, metadata=metadata)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class SimulationConfig:
+    """Configuration of a simulation, see example_config.yml."""
+    strategy: str = "SSO"
+
+    # Seed of the random streams, see random_streams.py. None means the
+    # global random module.
+    random_seed: Optional[int] = None
+
+    # Logging, tracing and profiling.
+    log_verbosity: int = _field(0, minimum=0)
+    trace_level: int = _field(0, minimum=0, maximum=2)
+    trace_buffer_size: int = _field(100000, positive=True)
+    trace_file: str = ""
+    profile_simulation: bool = False
+    print_stats: bool = True
+    spill_messages_file: str = ""
+    spill_chunk_size: int = _field(10000, positive=True)
+
+    # System.
+    num_cloud_workers: int = _field(10, positive=True)
+    num_frontends: int = _field(1, positive=True)
+    worker_concurrency: int = _field(0, minimum=0)
+    frontend_balancer: str = _field(
+        "random", choices=("random", "round_robin", "user_hash"))
+    profile_cache_ttl: float = _field(0, minimum=0)
+    profile_cache_size: int = _field(10000, positive=True)
+    hedge_delay: float = _field(0, minimum=0)
+    hedge_percentile: float = _field(0, minimum=0, maximum=100)
+    worker_request_timeout: float = _field(0, minimum=0)
+    worker_request_retries: int = _field(1, minimum=0)
+    worker_queue_capacity: int = _field(0, minimum=0)
+    worker_scheduling: str = _field(
+        "fifo", choices=("fifo", "strict", "weighted_fair", "deadline"))
+    worker_class_weights: dict = _field(
+        {"verification": 4, "enrollment": 1})
+    worker_class_deadlines: dict = _field(
+        {"verification": 1, "enrollment": 30})
+    starvation_threshold: float = _field(10, positive=True)
+    admission_control: str = _field(
+        "none", choices=("none", "token_bucket", "concurrency"))
+    admission_rate: float = _field(10, positive=True)
+    admission_burst: float = _field(10, minimum=1)
+    admission_concurrency: int = _field(100, positive=True)
+
+    # Regions.
+    regions: tuple = ("default",)
+    region_latency: tuple = ()
+    frontend_regions: tuple = ()
+    worker_regions: tuple = ()
+    database_regions: tuple = ()
+    replication_lag: float = _field(1, minimum=0)
+    frontend_routing: str = _field("global", choices=("global", "local"))
+    worker_routing: str = _field("global", choices=("global", "local"))
+
+    # Duration and early termination.
+    time_to_run: float = _field(10800, positive=True)
+    warmup_time: float = _field(0, minimum=0)
+    stop_after_requests: int = _field(0, minimum=0)
+    stop_settle_time: float = _field(0, minimum=0)
+    stop_stability_tolerance: float = _field(0, minimum=0)
+    stop_stability_metric: str = "mean"
+    stop_stability_checks: int = _field(3, positive=True)
+    stop_stability_interval: float = _field(600, positive=True)
+
+    # Latencies.
+    client_frontend_latency: float = _field(0.244, minimum=0)
+    frontend_worker_latency: float = _field(0.0012, minimum=0)
+    database_read_latency: float = _field(0.0005, minimum=0)
+    database_write_latency: float = _field(0.01, minimum=0)
+    worker_inference_latency: float = _field(0.5, minimum=0)
+    latency_distributions: dict = _field({})
+    latency_block_size: int = _field(1024, positive=True)
+
+    # Metrics.
+    sketch_relative_accuracy: float = _field(
+        0.01, positive=True, maximum=0.5)
+    reported_percentiles: tuple = (50, 95, 99)
+    metric_window: float = _field(0, minimum=0)
+    flops_per_inference: float = _field(2.1e9, minimum=0)
+
+    # Workload.
+    client_request_interval: float = _field(10, positive=True)
+    arrival_process: str = _field(
+        "periodic", choices=("periodic", "poisson", "diurnal", "mmpp",
+                             "replay"))
+    arrival_block_size: int = _field(1024, positive=True)
+    diurnal_amplitude: float = _field(0.5, minimum=0, maximum=1)
+    diurnal_period: float = _field(86400, positive=True)
+    diurnal_peak_time: float = 0
+    burst_rate_multiplier: float = _field(10, positive=True)
+    burst_mean_duration: float = _field(300, positive=True)
+    burst_mean_gap: float = _field(3600, positive=True)
+    request_log_file: str = ""
+    request_log_time_scale: float = _field(1, positive=True)
+    request_log_user_mapping: str = _field(
+        "none", choices=("none", "modulo", "hash", "dense"))
+    audio_length: float = _field(5, positive=True)
+    num_users: int = _field(1, positive=True)
+    user_distribution: str = _field(
+        "exponential", choices=("uniform", "linear", "exponential"))
+
+    # Model updates and profiles.
+    worker_update_mean_time: float = _field(3600, positive=True)
+    version_query_interval: float = _field(600, minimum=0)
+    version_propagation: tuple = ("poll",)
+    profile_retention_versions: int = _field(0, minimum=0)
+    drop_unserved_profile_versions: bool = False
+    coalesce_enrollments: bool = False
+    enroll_expiry_time: float = _field(60, minimum=0)
+
+    # Keys of custom strategies.
+    extra: dict = _field({})
+
+    def __getattr__(self, key: str) -> Any:
+        # Only called for keys that are not fields.
+        try:
+            return object.__getattribute__(self, "extra")[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Value of a key, like dict.get()."""
+        return getattr(self, key, default)
+
+    def to_dict(self) -> dict:
+        """The configuration as a dict, with extra keys merged."""
+        result = {
+            field.name: getattr(self, field.name)
+            for field in dataclasses.fields(self) if field.name != "extra"}
+        result.update(self.extra)
+        return result
+
+
+# Types accepted for each annotation; ints are accepted for floats.
+_TYPES = {
+    "str": (str,),
+    "int": (int,),
+    "float": (int, float),
+    "bool": (bool,),
+    "tuple": (list, tuple),
+    "dict": (dict,),
+}
+
+FIELD_NAMES = frozenset(
+    field.name for field in dataclasses.fields(SimulationConfig))
+
+
+def check_stability_metric(config: SimulationConfig) -> None:
+    metric = config.stop_stability_metric
+    if metric == "mean":
+        return
+    try:
+        valid = metric.startswith("p") and 0 <= float(metric[1:]) <= 100
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ValueError(
+            "stop_stability_metric must be \"mean\" or a percentile like "
+            f"\"p99\", got: {metric!r}")
+
+
+def check_percentiles(config: SimulationConfig) -> None:
+    for percentile in config.reported_percentiles:
+        if (isinstance(percentile, bool)
+                or not isinstance(percentile, (int, float))
+                or not 0 <= percentile <= 100):
+            raise ValueError(
+                "reported_percentiles must be numbers in [0, 100], "
+                f"got: {percentile!r}")
+
+
+def check_replay(config: SimulationConfig) -> None:
+    if config.arrival_process == "replay" and not config.request_log_file:
+        raise ValueError(
+            "request_log_file is required by arrival_process: replay")
+
+
+VERSION_PROPAGATION_MODES = ("poll", "push", "piggyback")
+
+
+def check_version_propagation(config: SimulationConfig) -> None:
+    modes = config.version_propagation
+    if (not modes or len(set(modes)) != len(modes)
+            or any(mode not in VERSION_PROPAGATION_MODES for mode in modes)):
+        raise ValueError(
+            "version_propagation must be distinct modes of "
+            f"{VERSION_PROPAGATION_MODES}, got: {list(modes)}")
+
+
+def check_worker_queue(config: SimulationConfig) -> None:
+    if config.worker_queue_capacity > 0 and config.worker_concurrency <= 0:
+        raise ValueError(
+            "worker_queue_capacity requires worker_concurrency, since "
+            "workers only queue requests with limited concurrency")
+
+
+def check_worker_classes(config: SimulationConfig) -> None:
+    for name in ["worker_class_weights", "worker_class_deadlines"]:
+        values = getattr(config, name)
+        if (set(values) != {"verification", "enrollment"} or any(
+                isinstance(value, bool)
+                or not isinstance(value, (int, float)) or value <= 0
+                for value in values.values())):
+            raise ValueError(
+                f"{name} must map verification and enrollment to positive "
+                f"numbers, got: {values!r}")
+
+
+def check_version_query(config: SimulationConfig) -> None:
+    if "poll" not in config.version_propagation:
+        return
+    if config.version_query_interval <= 0:
+        raise ValueError(
+            f"version_query_interval must be positive for strategy "
+            f"{config.strategy}, got: {config.version_query_interval}")
+
+
+# Checks that apply to all strategies.
+COMMON_REQUIREMENTS = [
+    check_stability_metric,
+    check_percentiles,
+    check_replay,
+    check_worker_queue,
+    check_worker_classes,
+]
+
+# Additional checks of each strategy. Custom strategies may add their own.
+STRATEGY_REQUIREMENTS = {
+    "SSO-sync": [check_version_propagation, check_version_query],
+}
+
+
+def check_field(field: dataclasses.Field, value: Any) -> Any:
+    """Check the type and constraints of a value, and normalize it."""
+    name = field.name
+    # The type of an Optional field is its non-None type.
+    types = [x for x in typing.get_args(field.type) if x is not type(None)]
+    type_name = (types[0] if types else field.type).__name__
+    types = _TYPES[type_name]
+    if (not isinstance(value, types)
+            or (isinstance(value, bool) and bool not in types)):
+        raise TypeError(
+            f"{name} must be of type {type_name}, "
+            f"got {type(value).__name__}: {value!r}")
+    if isinstance(value, list):
+        value = tuple(
+            tuple(item) if isinstance(item, list) else item
+            for item in value)
+    if isinstance(value, float) and math.isnan(value):
+        raise ValueError(f"{name} must not be NaN.")
+    metadata = field.metadata
+    if metadata.get("choices") and value not in metadata["choices"]:
+        raise ValueError(
+            f"Unsupported {name}: {value!r}, must be one of "
+            f"{list(metadata['choices'])}")
+    if metadata.get("positive") and not value > 0:
+        raise ValueError(f"{name} must be positive, got: {value}")
+    if metadata.get("minimum") is not None and value < metadata["minimum"]:
+        raise ValueError(
+            f"{name} must be at least {metadata['minimum']}, got: {value}")
+    if metadata.get("maximum") is not None and value > metadata["maximum"]:
+        raise ValueError(
+            f"{name} must be at most {metadata['maximum']}, got: {value}")
+    return value
+
+
+def compile_config(
+        config: Union[SimulationConfig, Mapping[str, Any]]
+) -> SimulationConfig:
+    """Validate a configuration, and compile it into a SimulationConfig.
+
+    Args:
+        config: a Munch or dict of the configurations; a SimulationConfig
+            is returned as is
+
+    Returns:
+        the compiled configuration
+
+    Raises:
+        TypeError: on values of the wrong type
+        ValueError: on unknown keys, on invalid values, or if the strategy
+            is unsupported
+    """
+    if isinstance(config, SimulationConfig):
+        return config
+    values = dict(config)
+    for key in values:
+        if key not in FIELD_NAMES:
+            close = difflib.get_close_matches(key, FIELD_NAMES, n=1)
+            hint = f", did you mean {close[0]!r}?" if close else (
+                ", keys of custom strategies belong under \"extra\".")
+            raise ValueError(f"Unknown config key {key!r}{hint}")
+    kwargs = {}
+    for field in dataclasses.fields(SimulationConfig):
+        if field.name in values and values[field.name] is not None:
+            kwargs[field.name] = check_field(field, values[field.name])
+    if isinstance(kwargs.get("extra"), munch.Munch):
+        kwargs["extra"] = munch.unmunchify(kwargs["extra"])
+    if "latency_distributions" in kwargs:
+        kwargs["latency_distributions"] = munch.unmunchify(
+            kwargs["latency_distributions"])
+    compiled = SimulationConfig(**kwargs)
+    check_requirements(compiled)
+    return compiled
+
+
+def check_requirements(config: SimulationConfig) -> None:
+    """Check the strategy, and the requirements that involve several keys.
+
+    Also useful after dataclasses.replace() of a compiled config.
+
+    Raises:
+        ValueError: if the strategy is unsupported, or its requirements
+            are not met
+    """
+    strategy = registry.get_name(config.strategy)
+    if strategy not in registry.list_strategies():
+        raise ValueError(f"Strategy not supported: {config.strategy}")
+    for check in COMMON_REQUIREMENTS + STRATEGY_REQUIREMENTS.get(
+            strategy, []):
+        check(config)
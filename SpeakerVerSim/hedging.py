@@ -0,0 +1,217 @@
+"""Hedged and timeout-retried worker requests of a frontend.
+
+After a frontend sends a verification request to a worker, it may send
+duplicates of the request to other workers:
+    hedge: if there is no response after config.hedge_delay seconds, or
+        after config.hedge_percentile of the response times observed by
+        the frontend so far, send one duplicate, and keep both
+    retry: if there is no response after config.worker_request_timeout
+        seconds since the latest attempt, cancel the outstanding attempts
+        and send a duplicate, up to config.worker_request_retries times
+Duplicates only go to workers that serve a profile version of the request,
+see BaseWorker.can_serve(), and no duplicate is sent if there is none.
+
+The first response wins, and all other attempts are cancelled, except that
+a rejection by a worker does not win while another attempt is still
+waiting for a worker. A cancelled attempt skips inference if it has not
+started yet. Otherwise its flops are spent, and counted as duplicate flops.
+Responses of cancelled attempts are dropped on arrival at the frontend.
+Enrollment requests are never hedged or retried.
+"""
+import dataclasses
+from typing import Any, Generator, Optional
+import simpy
+
+from SpeakerVerSim import sketch
+
+# Response times needed before hedging at a percentile.
+HEDGE_MIN_SAMPLES = 20
+
+
+def is_enabled(config: Any) -> bool:
+    """Whether frontends need a Hedger."""
+    return (config.hedge_delay > 0
+            or config.hedge_percentile > 0
+            or config.worker_request_timeout > 0)
+
+
+@dataclasses.dataclass
+class PendingRequest:
+    """A verification request waiting for its first response."""
+
+    # A copy of the request as first sent, since workers modify the
+    # message of each attempt.
+    msg: Any
+
+    # Flops spent on the request before it was first sent.
+    base_flops: float
+
+    # Succeeds on the first response.
+    done: simpy.Event
+
+    # Each attempt sent, as (message, worker, send time).
+    attempts: list[tuple[Any, Any, float]] = dataclasses.field(
+        default_factory=list)
+
+    # Count of attempts without a response yet.
+    outstanding: int = 0
+
+    # Arrival time of the first response.
+    win_time: Optional[float] = None
+
+
+class Hedger:
+    """Sends duplicates of slow requests of a frontend."""
+
+    def __init__(self, frontend: Any):
+        self.frontend = frontend
+        self.env: simpy.Environment = frontend.env
+        self.config = frontend.config
+        self.stats = frontend.stats
+        self.hedge_delay = self.config.hedge_delay
+        self.hedge_percentile = self.config.hedge_percentile
+        self.timeout = self.config.worker_request_timeout
+        self.max_retries = self.config.worker_request_retries
+        # Requests that have attempts without a response, by msg_id.
+        self.pending: dict[int, PendingRequest] = {}
+        # Response times of first attempts, for hedge_percentile.
+        self.response_times = sketch.DDSketch(
+            self.config.sketch_relative_accuracy)
+
+    def get_hedge_delay(self) -> Optional[float]:
+        """Delay before hedging a new request, or None to not hedge."""
+        if (self.hedge_percentile > 0
+                and self.response_times.count >= HEDGE_MIN_SAMPLES):
+            return self.response_times.quantile(self.hedge_percentile / 100)
+        if self.hedge_delay > 0:
+            return self.hedge_delay
+        return None
+
+    def track(self, worker: Any, msg: Any) -> None:
+        """Start watching a request sent to a worker."""
+        if msg.is_enroll or msg.attempt > 0:
+            return
+        pending = PendingRequest(
+            msg=dataclasses.replace(msg),
+            base_flops=msg.total_flops,
+            done=self.env.event())
+        pending.attempts.append((msg, worker, self.env.now))
+        pending.outstanding = 1
+        self.pending[msg.msg_id] = pending
+        self.env.process(self.watch(pending))
+
+    def watch(self, pending: PendingRequest) -> Generator:
+        """Hedge or retry the request until it has a response."""
+        hedge_delay = self.get_hedge_delay()
+        retries = 0
+        while True:
+            deadlines = []
+            if hedge_delay is not None:
+                deadlines.append(
+                    (pending.attempts[0][2] + hedge_delay, "hedge"))
+            if self.timeout > 0 and retries < self.max_retries:
+                deadlines.append(
+                    (pending.attempts[-1][2] + self.timeout, "retry"))
+            if not deadlines:
+                return
+            deadline, kind = min(deadlines)
+            yield pending.done | self.env.timeout(
+                max(deadline - self.env.now, 0))
+            if pending.done.triggered:
+                return
+            counted = not self.frontend.in_warmup(pending.msg)
+            if kind == "hedge":
+                hedge_delay = None
+                if self.send_duplicate(pending, cancel=False) and counted:
+                    self.stats.hedge_count += 1
+            else:
+                retries += 1
+                if self.send_duplicate(pending, cancel=True) and counted:
+                    self.stats.retry_count += 1
+
+    def select_worker(self, pending: PendingRequest) -> Any:
+        """A worker not tried yet that serves the request, or None."""
+        tried = {worker.name for _, worker, _ in pending.attempts}
+        candidates = [
+            worker for worker in self.frontend.workers
+            if worker.name not in tried and worker.can_serve(pending.msg)]
+        if not candidates:
+            return None
+        return self.frontend.random.choice(candidates)
+
+    def send_duplicate(self, pending: PendingRequest, cancel: bool) -> bool:
+        """Send a duplicate of the request to another worker.
+
+        Args:
+            pending: the request
+            cancel: whether to cancel the outstanding attempts
+
+        Returns:
+            whether a duplicate was sent
+        """
+        worker = self.select_worker(pending)
+        if worker is None:
+            return False
+        if cancel:
+            for attempt, _, _ in pending.attempts:
+                attempt.cancelled = True
+        duplicate = dataclasses.replace(
+            pending.msg,
+            total_flops=0,
+            attempt=len(pending.attempts),
+            cancelled=False)
+        pending.attempts.append((duplicate, worker, self.env.now))
+        pending.outstanding += 1
+        self.env.process(self.frontend.send_to_worker(worker, duplicate))
+        return True
+
+    def add_response_time(self, pending: PendingRequest) -> None:
+        """Observe the response time of the first attempt."""
+        self.response_times.add(self.env.now - pending.attempts[0][2])
+
+    def accept(self, msg: Any) -> bool:
+        """Whether a response arriving at the frontend should be handled.
+
+        Responses of cancelled attempts are dropped.
+        """
+        pending = self.pending.get(msg.msg_id)
+        if msg.is_enroll or pending is None or not any(
+                msg is attempt for attempt, _, _ in pending.attempts):
+            return True
+        pending.outstanding -= 1
+        if pending.outstanding == 0:
+            del self.pending[msg.msg_id]
+        if msg.rejected and any(
+                attempt is not msg and attempt.is_request
+                and not attempt.cancelled
+                for attempt, _, _ in pending.attempts):
+            # Wait for another attempt instead.
+            return False
+        counted = not self.frontend.in_warmup(msg)
+        if msg.cancelled or pending.done.triggered:
+            # A losing attempt.
+            flops = msg.total_flops
+            if msg.attempt == 0:
+                flops -= pending.base_flops
+            if counted:
+                self.stats.duplicate_flops += flops
+            if flops > 0:
+                if msg.attempt == 0:
+                    self.add_response_time(pending)
+                if pending.win_time is not None and counted:
+                    self.frontend.record_latency(
+                        "hedge_saved", self.env.now - pending.win_time)
+            return False
+
+        pending.win_time = self.env.now
+        pending.done.succeed()
+        for attempt, _, _ in pending.attempts:
+            if attempt is not msg:
+                attempt.cancelled = True
+        if msg.attempt == 0:
+            self.add_response_time(pending)
+        else:
+            if counted:
+                self.stats.duplicate_win_count += 1
+            msg.total_flops += pending.base_flops
+        return True
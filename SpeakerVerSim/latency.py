@@ -0,0 +1,166 @@
+"""Latency distributions of links.
+
+Each latency is the mean latency of its link, multiplied by a unit-mean
+sample from the distribution of the link. Samples are drawn in NumPy blocks
+ahead of time, and consumed from a buffer of each link.
+
+Links:
+    client_frontend: between client and frontend
+    frontend_worker: between frontend and worker
+    database_read: reading a profile from database
+    database_write: writing a profile to database
+    worker_inference: running inference on a worker
+    region: extra round trip to a database in another region
+    replication: replicating a profile to another database replica
+
+The distribution of each link is configured in config.latency_distributions,
+keyed by link name, falling back to the "default" entry. Available types:
+    normal: Gaussian with standard deviation cv times the mean
+    lognormal: log-normal with sigma as the standard deviation of the log
+    gamma: gamma with the given shape
+    empirical: piecewise linear inverse CDF through quantiles, given as
+        [probability, value] pairs inline or in a CSV file, such as
+        percentiles measured in production; values are relative, as the
+        distribution is rescaled to unit mean
+"""
+import abc
+from typing import Optional
+import munch
+import numpy as np
+
+from SpeakerVerSim import random_streams
+
+DEFAULT_DISTRIBUTION = {"type": "normal", "cv": 0.1}
+
+
+class LatencyDistribution(abc.ABC):
+    """Base class for a unit-mean latency distribution."""
+
+    @abc.abstractmethod
+    def sample_block(
+            self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """Sample a block of unit-mean latency multipliers."""
+        pass
+
+
+class NormalDistribution(LatencyDistribution):
+
+    def __init__(self, spec: munch.Munch):
+        self.cv = spec.get("cv", 0.1)
+
+    def sample_block(
+            self, rng: np.random.Generator, size: int) -> np.ndarray:
+        return rng.normal(1, self.cv, size)
+
+
+class LogNormalDistribution(LatencyDistribution):
+
+    def __init__(self, spec: munch.Munch):
+        self.sigma = spec.get("sigma", 0.5)
+
+    def sample_block(
+            self, rng: np.random.Generator, size: int) -> np.ndarray:
+        return rng.lognormal(-self.sigma ** 2 / 2, self.sigma, size)
+
+
+class GammaDistribution(LatencyDistribution):
+
+    def __init__(self, spec: munch.Munch):
+        self.shape = spec.get("shape", 4)
+        if self.shape <= 0:
+            raise ValueError("Shape of gamma distribution must be positive.")
+
+    def sample_block(
+            self, rng: np.random.Generator, size: int) -> np.ndarray:
+        return rng.gamma(self.shape, 1 / self.shape, size)
+
+
+class EmpiricalDistribution(LatencyDistribution):
+
+    def __init__(self, spec: munch.Munch):
+        if spec.get("quantiles_file"):
+            quantiles = np.loadtxt(
+                spec.quantiles_file, delimiter=",", ndmin=2)
+        else:
+            quantiles = np.array(spec.get("quantiles", []), dtype=np.float64)
+        if quantiles.ndim != 2 or quantiles.shape[1] != 2 or len(
+                quantiles) < 2:
+            raise ValueError(
+                "Empirical distribution needs [probability, value] pairs.")
+        self.probs = quantiles[:, 0]
+        self.values = quantiles[:, 1]
+        if self.probs[0] != 0 or self.probs[-1] != 1:
+            raise ValueError("Quantiles must range from probability 0 to 1.")
+        if np.any(np.diff(self.probs) <= 0) or np.any(
+                np.diff(self.values) < 0):
+            raise ValueError("Quantiles must be increasing.")
+        # Mean of the piecewise linear inverse CDF.
+        mean = np.sum(np.diff(self.probs)
+                      * (self.values[:-1] + self.values[1:]) / 2)
+        if mean <= 0:
+            raise ValueError("Quantiles must have a positive mean.")
+        self.values = self.values / mean
+
+    def sample_block(
+            self, rng: np.random.Generator, size: int) -> np.ndarray:
+        return np.interp(rng.random(size), self.probs, self.values)
+
+
+DISTRIBUTIONS = {
+    "normal": NormalDistribution,
+    "lognormal": LogNormalDistribution,
+    "gamma": GammaDistribution,
+    "empirical": EmpiricalDistribution,
+}
+
+
+def create_distribution(spec: munch.Munch) -> LatencyDistribution:
+    """Create a latency distribution from its config."""
+    spec = munch.Munch(spec)
+    name = spec.get("type", "normal")
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"Unsupported latency distribution: {name}")
+    return DISTRIBUTIONS[name](spec)
+
+
+class LatencyModel:
+    """Buffered samplers of the latency multipliers of all links."""
+
+    def __init__(
+            self,
+            config: munch.Munch,
+            rng: Optional[np.random.Generator] = None,
+            streams: Optional[random_streams.RandomStreams] = None):
+        self.rng = rng or random_streams.create_rng()
+        # With seeded streams, each link has its own generator, such that
+        # draws on one link do not shift the draws on other links.
+        self.streams = streams if streams and streams.seeded else None
+        self.rngs: dict[str, np.random.Generator] = {}
+        self.block_size = config.latency_block_size
+        specs = config.latency_distributions
+        default = create_distribution(
+            specs.get("default", DEFAULT_DISTRIBUTION))
+        self.distributions = {
+            link: create_distribution(spec)
+            for link, spec in specs.items() if link != "default"}
+        self.default = default
+        # Buffer of unused samples of each link.
+        self.buffers: dict[str, list[float]] = {}
+
+    def get_rng(self, link: str) -> np.random.Generator:
+        """Generator of the samples of a link."""
+        if self.streams is None:
+            return self.rng
+        if link not in self.rngs:
+            self.rngs[link] = self.streams.get_numpy(f"latency/{link}")
+        return self.rngs[link]
+
+    def sample(self, link: str) -> float:
+        """Get the next latency multiplier of a link."""
+        buffer = self.buffers.get(link)
+        if not buffer:
+            distribution = self.distributions.get(link, self.default)
+            buffer = distribution.sample_block(
+                self.get_rng(link), self.block_size).tolist()
+            self.buffers[link] = buffer
+        return buffer.pop()
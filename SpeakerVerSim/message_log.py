@@ -0,0 +1,151 @@
+"""Spilling final messages to disk during simulation.
+
+Final messages are buffered in chunks of fixed size, and each full chunk
+is appended to a binary file in a columnar layout, so that the resident
+memory does not grow with the number of messages.
+
+File layout:
+    magic bytes MESSAGE_FILE_MAGIC
+    header size, as a little-endian uint64
+    JSON header with the names and dtypes of the columns
+    chunks, each with the number of rows as a little-endian uint64,
+        followed by the values of each column in header order
+
+Missing values are stored as NaN for floats and -1 for integers. The
+profile_versions field is not stored.
+"""
+import dataclasses
+import json
+import math
+import struct
+from typing import Iterator
+import numpy as np
+
+# Magic bytes at the beginning of a message file.
+MESSAGE_FILE_MAGIC = b"SVSMSGS\x00"
+
+# Names are truncated to this many bytes.
+MAX_NAME_LENGTH = 64
+
+# Dtype of each stored field of Message.
+COLUMN_DTYPES = {
+    "msg_id": "<i8",
+    "user_id": "<i8",
+    "audio_length": "<f8",
+    "profile_version": "<i8",
+    "is_request": "|b1",
+    "is_enroll": "|b1",
+    "total_flops": "<f8",
+    "worker_name": f"|S{MAX_NAME_LENGTH}",
+    "frontend_name": f"|S{MAX_NAME_LENGTH}",
+    "region": "<i4",
+    "client_send_time": "<f8",
+    "fetch_database_time": "<f8",
+    "frontend_send_worker_enroll_time": "<f8",
+    "udpate_database_time": "<f8",
+    "frontend_send_worker_time": "<f8",
+    "worker_receive_time": "<f8",
+    "worker_return_time": "<f8",
+    "frontend_return_time": "<f8",
+    "client_return_time": "<f8",
+}
+
+
+def get_missing_value(dtype: str):
+    """Value stored for None."""
+    return math.nan if dtype[1] == "f" else -1
+
+
+class MessageWriter:
+    """Buffers final messages, and appends full chunks to a file."""
+
+    def __init__(self, path: str, chunk_size: int):
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be positive.")
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffer: list = []
+        self.num_messages = 0
+        self.file = open(path, "wb")
+        header = json.dumps({"columns": COLUMN_DTYPES}).encode("utf-8")
+        self.file.write(MESSAGE_FILE_MAGIC)
+        self.file.write(struct.pack("<Q", len(header)))
+        self.file.write(header)
+
+    def append(self, msg) -> None:
+        """Add a message, and flush the chunk if it is full."""
+        self.buffer.append(msg)
+        self.num_messages += 1
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Append buffered messages to the file as one chunk."""
+        if not self.buffer:
+            return
+        self.file.write(struct.pack("<Q", len(self.buffer)))
+        for column, dtype in COLUMN_DTYPES.items():
+            missing = get_missing_value(dtype)
+            values = [getattr(msg, column) for msg in self.buffer]
+            if dtype[1] == "S":
+                values = [value.encode("utf-8") for value in values]
+            else:
+                values = [missing if value is None else value
+                          for value in values]
+            self.file.write(np.array(values, dtype=dtype).tobytes())
+        self.buffer = []
+
+    def close(self) -> None:
+        """Flush remaining messages and close the file."""
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def iter_message_chunks(path: str) -> Iterator[dict[str, np.ndarray]]:
+    """Lazily iterate over the chunks of a message file, as columns."""
+    with open(path, "rb") as f:
+        if f.read(len(MESSAGE_FILE_MAGIC)) != MESSAGE_FILE_MAGIC:
+            raise ValueError(f"Not a message file: {path}")
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+        columns = {
+            column: np.dtype(dtype)
+            for column, dtype in header["columns"].items()}
+        while True:
+            size_bytes = f.read(8)
+            if not size_bytes:
+                return
+            (num_rows,) = struct.unpack("<Q", size_bytes)
+            yield {
+                column: np.frombuffer(
+                    f.read(dtype.itemsize * num_rows), dtype=dtype)
+                for column, dtype in columns.items()}
+
+
+def iter_messages(path: str) -> Iterator:
+    """Lazily iterate over the messages of a message file.
+
+    Yields:
+        Message objects, with missing values restored as None
+    """
+    # Imported here since common imports this module.
+    from SpeakerVerSim.common import Message
+    fields = {field.name for field in dataclasses.fields(Message)}
+    for chunk in iter_message_chunks(path):
+        rows = {
+            column: values.tolist() for column, values in chunk.items()
+            if column in fields}
+        for i in range(len(chunk["msg_id"])):
+            kwargs = {}
+            for column, values in rows.items():
+                value = values[i]
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8")
+                elif isinstance(value, float) and math.isnan(value):
+                    value = None
+                elif column == "profile_version" and value == -1:
+                    value = None
+                kwargs[column] = value
+            yield Message(**kwargs)
@@ -0,0 +1,311 @@
+"""Optimization of continuous config knobs under a noisy objective.
+
+The objective of one simulation combines latency, bounces and the traffic
+of version queries:
+    latency_weight * latency
+    + bounce_weight * (backward + forward bounces per response)
+    + query_weight * (version query and push messages per second)
+where latency is the mean e2e latency, or a percentile of it. The
+objective of a candidate is its mean over replicates, and replicate i uses
+the same seed for all candidates, such that candidates are compared under
+the same random numbers.
+
+The search is successive halving with local refinement. Knob values are
+mapped to a unit cube, on a log scale by default:
+    1. Spread num_candidates over the cube in a Latin hypercube.
+    2. Evaluate all candidates with the current number of replicates, in
+       parallel processes.
+    3. Keep the best half, and fill up to num_candidates with neighbors of
+       the best survivors, at a step that halves every round.
+    4. Double the number of replicates, and repeat from 2 for all rounds.
+Survivors reuse the replicates they already have, see planner.py for the
+cache, so most simulations are spent near the optimum.
+"""
+import dataclasses
+import math
+import multiprocessing
+import random
+import statistics
+from typing import Any, Optional
+
+from SpeakerVerSim import planner
+from SpeakerVerSim.config import SimulationConfig, compile_config
+
+# Type of each key of the compiled config.
+FIELD_TYPES = {
+    field.name: field.type
+    for field in dataclasses.fields(SimulationConfig)}
+
+
+@dataclasses.dataclass
+class Knob:
+    """A config key to optimize within [low, high]."""
+    name: str
+    low: float
+    high: float
+
+    # Whether to search on a log scale, which needs low > 0.
+    log_scale: bool = True
+
+    # Whether values are rounded to integers.
+    integer: bool = False
+
+    def __post_init__(self):
+        if not self.low < self.high:
+            raise ValueError(f"Knob {self.name} must have low < high.")
+        if self.log_scale and self.low <= 0:
+            raise ValueError(
+                f"Knob {self.name} must have low > 0 on a log scale.")
+
+    def from_unit(self, unit: float) -> float:
+        """Map a value in [0, 1] to the knob range."""
+        if self.log_scale:
+            value = self.low * (self.high / self.low) ** unit
+        else:
+            value = self.low + (self.high - self.low) * unit
+        value = min(max(value, self.low), self.high)
+        return round(value) if self.integer else value
+
+
+@dataclasses.dataclass
+class Objective:
+    """Weights of the objective, which is minimized."""
+    latency_weight: float = 1.0
+    bounce_weight: float = 1.0
+    query_weight: float = 0.01
+
+    # Percentile of the e2e latency in [0, 100], or None for the mean.
+    latency_percentile: Optional[float] = None
+
+    def evaluate(self, result: dict) -> float:
+        """Objective of one replicate, see planner.run_replicate()."""
+        latency = (result["mean_latency"] if self.latency_percentile is None
+                   else result["latency"])
+        bounce_rate = (result["backward_bounce_rate"]
+                       + result["forward_bounce_rate"])
+        return (self.latency_weight * latency
+                + self.bounce_weight * bounce_rate
+                + self.query_weight * result["query_rate"])
+
+
+@dataclasses.dataclass
+class Evaluation:
+    """Objective of one candidate over its replicates."""
+
+    # Value of each knob.
+    params: dict[str, float]
+
+    # Objective of each replicate.
+    values: list[float]
+
+    mean: float = 0.0
+
+    # Half width of the confidence interval of the mean.
+    half_width: float = 0.0
+
+
+@dataclasses.dataclass
+class OptimizationResult:
+    """Result of an optimization."""
+
+    # Value of each knob of the best candidate.
+    best: dict[str, float] = dataclasses.field(default_factory=dict)
+
+    # Evaluation of the best candidate.
+    best_evaluation: Optional[Evaluation] = None
+
+    # Latest evaluation of each candidate, in the order of evaluation, such
+    # that the candidates of the last round come last.
+    evaluations: list[Evaluation] = dataclasses.field(default_factory=list)
+
+    # Count of simulations that were run, excluding cache hits.
+    num_simulations: int = 0
+
+
+def latin_hypercube(
+        num_points: int, num_dims: int, rng: random.Random
+) -> list[tuple[float, ...]]:
+    """Points at the centers of strata of [0, 1] in each dimension, with
+    strata randomly paired across dimensions."""
+    columns = []
+    for _ in range(num_dims):
+        strata = list(range(num_points))
+        rng.shuffle(strata)
+        columns.append([(i + 0.5) / num_points for i in strata])
+    if num_dims == 1:
+        columns[0].sort()
+    return list(zip(*columns))
+
+
+class Optimizer:
+    """Minimizes a noisy objective over knobs of the config."""
+
+    def __init__(
+            self,
+            config: Any,
+            knobs: list[Knob],
+            objective: Objective,
+            num_candidates: int = 8,
+            rounds: int = 3,
+            replicates: int = 2,
+            processes: int = 1,
+            confidence: float = 0.95,
+            seed: int = 0,
+            cache_file: str = ""):
+        self.config = dataclasses.replace(
+            compile_config(config), log_verbosity=0, print_stats=False)
+        if not knobs:
+            raise ValueError("At least one knob is needed.")
+        knobs = list(knobs)
+        for i, knob in enumerate(knobs):
+            if not hasattr(self.config, knob.name):
+                raise ValueError(f"Unknown knob: {knob.name}")
+            if FIELD_TYPES.get(knob.name) is int:
+                # Keep integer keys integers.
+                knobs[i] = dataclasses.replace(knob, integer=True)
+        if num_candidates < 2 or rounds <= 0 or replicates <= 0:
+            raise ValueError(
+                "Need num_candidates >= 2, and positive rounds and "
+                "replicates.")
+        self.knobs = list(knobs)
+        self.objective = objective
+        self.num_candidates = num_candidates
+        self.rounds = rounds
+        self.replicates = replicates
+        self.processes = processes
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.percentile = (
+            99 if objective.latency_percentile is None
+            else objective.latency_percentile)
+        self.z_score = planner.get_z_score(confidence)
+        self.cache_file = cache_file
+        self.cache = planner.load_cache(cache_file)
+        self.result = OptimizationResult()
+        # Latest evaluation of each candidate, keyed by get_key().
+        self.evaluations: dict[tuple, Evaluation] = {}
+        self.pool: Optional[Any] = None
+
+    def get_params(self, point: tuple[float, ...]) -> dict[str, float]:
+        return {knob.name: knob.from_unit(unit)
+                for knob, unit in zip(self.knobs, point)}
+
+    def evaluate(
+            self, points: list[tuple[float, ...]], num_seeds: int
+    ) -> list[Evaluation]:
+        """Evaluate candidates with num_seeds replicates each.
+
+        Missing replicates of all candidates are simulated in one batch.
+        """
+        seeds = [self.seed + i for i in range(num_seeds)]
+        tasks = {}
+        keys = []
+        for point in points:
+            config = dataclasses.replace(
+                self.config, **self.get_params(point))
+            point_tasks = dict(
+                planner.get_task(config, seed, self.percentile)
+                for seed in seeds)
+            tasks.update(point_tasks)
+            keys.append(list(point_tasks))
+        self.result.num_simulations += planner.run_missing(
+            tasks, self.cache, self.pool)
+
+        evaluations = []
+        for point, point_keys in zip(points, keys):
+            values = [self.objective.evaluate(self.cache[key])
+                      for key in point_keys]
+            evaluation = Evaluation(
+                params=self.get_params(point),
+                values=values,
+                mean=statistics.fmean(values))
+            if len(values) > 1:
+                evaluation.half_width = (
+                    self.z_score * statistics.stdev(values)
+                    / math.sqrt(len(values)))
+            evaluations.append(evaluation)
+            key = self.get_key(point)
+            self.evaluations.pop(key, None)
+            self.evaluations[key] = evaluation
+        self.result.evaluations = list(self.evaluations.values())
+        return evaluations
+
+    def refine(
+            self, survivors: list[tuple[float, ...]], step: float
+    ) -> list[tuple[float, ...]]:
+        """Survivors, and their neighbors up to num_candidates."""
+        points = list(survivors)
+        seen = {self.get_key(point) for point in points}
+        for point in survivors:
+            for dim in range(len(self.knobs)):
+                for sign in [-1, 1]:
+                    if len(points) >= self.num_candidates:
+                        return points
+                    neighbor = list(point)
+                    neighbor[dim] = min(max(point[dim] + sign * step, 0), 1)
+                    key = self.get_key(tuple(neighbor))
+                    if key not in seen:
+                        seen.add(key)
+                        points.append(tuple(neighbor))
+        return points
+
+    def get_key(self, point: tuple[float, ...]) -> tuple:
+        """Candidates with the same knob values are the same."""
+        return tuple(sorted(self.get_params(point).items()))
+
+    def run(self) -> OptimizationResult:
+        """Run all rounds.
+
+        Returns:
+            the optimization result
+        """
+        points = latin_hypercube(
+            self.num_candidates, len(self.knobs), self.rng)
+        step = 0.5 / self.num_candidates
+        num_seeds = self.replicates
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(self.processes)
+        try:
+            for round_index in range(self.rounds):
+                evaluations = self.evaluate(points, num_seeds)
+                ranked = sorted(
+                    zip(evaluations, points), key=lambda x: x[0].mean)
+                best_evaluation = ranked[0][0]
+                if round_index == self.rounds - 1:
+                    break
+                survivors = [
+                    point for _, point in ranked[:max(1, len(ranked) // 2)]]
+                points = self.refine(survivors, step)
+                step /= 2
+                num_seeds *= 2
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            planner.save_cache(self.cache, self.cache_file)
+        self.result.best = best_evaluation.params
+        self.result.best_evaluation = best_evaluation
+        return self.result
+
+
+def optimize(
+        config: Any,
+        knobs: list[Knob],
+        objective: Optional[Objective] = None,
+        **kwargs) -> OptimizationResult:
+    """Minimize the objective over knobs of the config.
+
+    Args:
+        config: a Munch of the configurations, or a compiled config
+        knobs: the knobs to optimize
+        objective: weights of the objective; the default if None
+        **kwargs: arguments of Optimizer, such as num_candidates, rounds,
+            replicates, processes and cache_file
+
+    Returns:
+        the optimization result
+    """
+    if objective is None:
+        objective = Objective()
+    return Optimizer(config, knobs, objective, **kwargs).run()
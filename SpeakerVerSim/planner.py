@@ -0,0 +1,336 @@
+"""Capacity planning: the minimal worker count that meets a latency SLO.
+
+For a given config, which includes the strategy and the traffic profile,
+the planner bisects num_cloud_workers, or another integer config key,
+between a lower and an upper limit. Each probed value is simulated with
+several replicates, in parallel processes, and each replicate uses the
+same seed at every probe, such that probes are compared under the same
+random numbers.
+
+A probe meets the SLO if, for every metric of the SLO, its estimate over
+replicates is within the limit. Estimates are the mean over replicates,
+and confidence bounds use a normal approximation. Assuming the metrics
+decrease with more workers, three bisections give:
+    min_workers: the smallest value whose mean meets the SLO
+    lower_bound: the smallest value whose lower confidence bound meets the
+        SLO; smaller values are infeasible with confidence
+    upper_bound: the smallest value whose upper confidence bound meets the
+        SLO; it is feasible with confidence
+
+Results of replicates are cached by config and seed, optionally in a
+pickle file, such that repeated plans and the three bisections reuse the
+same simulations.
+"""
+import dataclasses
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import statistics
+from typing import Any, Callable, Optional
+
+from SpeakerVerSim import simulator
+from SpeakerVerSim.config import compile_config
+
+
+@dataclasses.dataclass
+class SLO:
+    """A service level objective; each limit is ignored if infinite."""
+
+    # Percentile of the e2e latency in [0, 100], and its limit in seconds.
+    latency_percentile: float = 99
+    max_latency: float = math.inf
+
+    # Limit of backward bounces per recorded response.
+    max_backward_bounce_rate: float = math.inf
+
+    def get_limits(self) -> dict[str, float]:
+        """Limit of each metric, as used in replicate results."""
+        limits = {
+            "latency": self.max_latency,
+            "backward_bounce_rate": self.max_backward_bounce_rate,
+        }
+        return {
+            metric: limit for metric, limit in limits.items()
+            if limit < math.inf}
+
+
+@dataclasses.dataclass
+class Probe:
+    """Results of all replicates at one value of the searched key."""
+    value: int
+
+    # Metrics of each replicate, as a mapping from metric to values.
+    metrics: dict[str, list[float]]
+
+    # Mean and half width of the confidence interval of each metric.
+    means: dict[str, float] = dataclasses.field(default_factory=dict)
+    half_widths: dict[str, float] = dataclasses.field(default_factory=dict)
+
+    def meets(self, limits: dict[str, float], bound: int = 0) -> bool:
+        """Whether the SLO is met by the lower (-1), mean (0) or upper (1)
+        confidence bound of every metric."""
+        return all(
+            self.means[metric] + bound * self.half_widths[metric] <= limit
+            for metric, limit in limits.items())
+
+
+@dataclasses.dataclass
+class CapacityPlan:
+    """Result of capacity planning."""
+    key: str
+    slo: SLO
+    confidence: float
+
+    # Whether the SLO is met by the mean at the upper limit of the search.
+    feasible: bool = False
+
+    # See the docstring of this module. None if not found within limits.
+    min_workers: Optional[int] = None
+    lower_bound: Optional[int] = None
+    upper_bound: Optional[int] = None
+
+    # Probe of each value of the searched key, in the order of probing.
+    probes: dict[int, Probe] = dataclasses.field(default_factory=dict)
+
+    # Count of simulations that were run, excluding cache hits.
+    num_simulations: int = 0
+
+
+def run_replicate(config: Any, seed: int, percentile: float) -> dict:
+    """Simulate one replicate, and summarize the stats.
+
+    Returns:
+        a dict of metrics:
+            latency: e2e latency at the percentile
+            mean_latency: mean e2e latency
+            backward_bounce_rate, forward_bounce_rate: bounces per response
+            query_rate: version query and push messages per simulated
+                second
+            mean_flops: average flops for fulfilling one request
+            duplicate_flops: flops of dropped hedged or retried attempts
+                per response
+            rejection_rate: rejected requests per request
+            num_responses: count of recorded responses
+    """
+    random.seed(seed)
+    stats = simulator.build_system(config).simulate()
+    e2e = stats.latency_sketches.get("e2e")
+    num_responses = e2e.count if e2e is not None else 0
+    rejection = stats.latency_sketches.get("rejection")
+    num_rejected = rejection.count if rejection is not None else 0
+    return {
+        "latency": e2e.quantile(percentile / 100) if num_responses else 0.0,
+        "mean_latency": e2e.mean if num_responses else 0.0,
+        "backward_bounce_rate": (
+            stats.backward_bounce_count / max(num_responses, 1)),
+        "forward_bounce_rate": (
+            stats.forward_bounce_count / max(num_responses, 1)),
+        "query_rate": (
+            (sum(stats.version_query_count.values())
+             + sum(stats.version_push_count.values()))
+            / max(stats.simulated_time, 1e-9)),
+        "mean_flops": stats.average_total_flops,
+        "duplicate_flops": stats.duplicate_flops / max(num_responses, 1),
+        "rejection_rate": (
+            num_rejected / max(num_responses + num_rejected, 1)),
+        "num_responses": num_responses,
+    }
+
+
+def _run_replicate(args: tuple) -> dict:
+    return run_replicate(*args)
+
+
+def run_missing(tasks: dict[str, tuple], cache: dict, pool: Any) -> int:
+    """Run the replicates that are not cached yet, and cache them.
+
+    Args:
+        tasks: arguments of run_replicate(), keyed by cache key
+        cache: results of run_replicate(), keyed by cache key
+        pool: a multiprocessing pool to run in, or None to run in this
+            process
+
+    Returns:
+        count of replicates that were run
+    """
+    missing = {
+        key: args for key, args in tasks.items() if key not in cache}
+    if pool is not None:
+        results = pool.map(_run_replicate, missing.values())
+    else:
+        results = [_run_replicate(args) for args in missing.values()]
+    cache.update(zip(missing.keys(), results))
+    return len(missing)
+
+
+def get_cache_key(config: Any, seed: int, percentile: float) -> str:
+    """Key of a replicate in the cache."""
+    text = json.dumps(
+        [config.to_dict(), seed, percentile], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_task(
+        config: Any, seed: int, percentile: float) -> tuple[str, tuple]:
+    """Cache key and arguments of run_replicate() for one replicate.
+
+    The replicate uses its seed as config.random_seed, since the random
+    streams ignore the global seed once config.random_seed is set.
+    """
+    config = dataclasses.replace(config, random_seed=seed)
+    return get_cache_key(config, seed, percentile), (config, seed, percentile)
+
+
+def load_cache(path: str) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_cache(cache: dict, path: str) -> None:
+    if path:
+        with open(path, "wb") as f:
+            pickle.dump(cache, f)
+
+
+def get_z_score(confidence: float) -> float:
+    """z score of a two-sided confidence interval."""
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be in (0, 1).")
+    return statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def summarize(value: int, results: list[dict], z_score: float) -> Probe:
+    """Create the probe of a value from the results of its replicates."""
+    metrics = {
+        metric: [result[metric] for result in results]
+        for metric in ["latency", "backward_bounce_rate"]}
+    probe = Probe(value=value, metrics=metrics)
+    for metric, values in metrics.items():
+        probe.means[metric] = statistics.fmean(values)
+        probe.half_widths[metric] = (
+            z_score * statistics.stdev(values) / math.sqrt(len(values))
+            if len(values) > 1 else 0.0)
+    return probe
+
+
+def bisect(predicate: Callable[[int], bool], low: int, high: int
+           ) -> Optional[int]:
+    """Smallest value in [low, high] that satisfies a monotonic predicate,
+    or None if even high does not."""
+    if not predicate(high):
+        return None
+    while low < high:
+        middle = (low + high) // 2
+        if predicate(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return high
+
+
+class CapacityPlanner:
+    """Searches the minimal value of a config key that meets an SLO."""
+
+    def __init__(
+            self,
+            config: Any,
+            slo: SLO,
+            key: str = "num_cloud_workers",
+            replicates: int = 4,
+            processes: int = 1,
+            confidence: float = 0.95,
+            seed: int = 0,
+            cache_file: str = ""):
+        self.config = dataclasses.replace(
+            compile_config(config), log_verbosity=0, print_stats=False)
+        if not isinstance(getattr(self.config, key, None), int):
+            raise ValueError(f"Cannot search non-integer config key: {key}")
+        if not slo.get_limits():
+            raise ValueError("The SLO must have at least one finite limit.")
+        if replicates <= 0:
+            raise ValueError("replicates must be positive.")
+        self.slo = slo
+        self.key = key
+        self.replicates = replicates
+        self.processes = processes
+        self.seeds = [seed + i for i in range(replicates)]
+        self.z_score = get_z_score(confidence)
+        self.cache_file = cache_file
+        self.cache = load_cache(cache_file)
+        self.plan = CapacityPlan(key=key, slo=slo, confidence=confidence)
+        self.pool: Optional[Any] = None
+
+    def probe(self, value: int) -> Probe:
+        """Simulate the replicates of a value, reusing cached results."""
+        if value in self.plan.probes:
+            return self.plan.probes[value]
+        config = dataclasses.replace(self.config, **{self.key: value})
+        percentile = self.slo.latency_percentile
+        tasks = dict(
+            get_task(config, seed, percentile) for seed in self.seeds)
+        self.plan.num_simulations += run_missing(tasks, self.cache, self.pool)
+        keys = list(tasks)
+        probe = summarize(
+            value, [self.cache[cache_key] for cache_key in keys],
+            self.z_score)
+        self.plan.probes[value] = probe
+        return probe
+
+    def run(self, low: int, high: int) -> CapacityPlan:
+        """Search within [low, high].
+
+        Returns:
+            the capacity plan
+        """
+        if not 0 < low <= high:
+            raise ValueError("Search limits must satisfy 0 < low <= high.")
+        limits = self.slo.get_limits()
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(self.processes)
+        try:
+            plan = self.plan
+            plan.min_workers = bisect(
+                lambda x: self.probe(x).meets(limits), low, high)
+            plan.feasible = plan.min_workers is not None
+            if plan.feasible:
+                plan.lower_bound = bisect(
+                    lambda x: self.probe(x).meets(limits, -1),
+                    low, plan.min_workers)
+                plan.upper_bound = bisect(
+                    lambda x: self.probe(x).meets(limits, 1),
+                    plan.min_workers, high)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            save_cache(self.cache, self.cache_file)
+        return plan
+
+
+def plan_capacity(
+        config: Any,
+        slo: SLO,
+        low: int = 1,
+        high: int = 100,
+        **kwargs) -> CapacityPlan:
+    """Find the minimal worker count that meets an SLO.
+
+    Args:
+        config: a Munch of the configurations, or a compiled config
+        slo: the SLO
+        low: lower limit of the search
+        high: upper limit of the search
+        **kwargs: arguments of CapacityPlanner, such as replicates,
+            processes and cache_file
+
+    Returns:
+        the capacity plan
+    """
+    return CapacityPlanner(config, slo, **kwargs).run(low, high)
@@ -0,0 +1,165 @@
+"""Instrumentation of the simulation loop.
+
+This is used to find out where the time of a slow simulation goes.
+It is only enabled when profile_simulation is set in the config, since
+stepping the environment from Python is slower than simpy.Environment.run,
+and a ProfiledEnvironment keeps a second queue of scheduled events.
+"""
+import collections
+import dataclasses
+import heapq
+import time
+import tracemalloc
+from typing import Any, Callable, Generator, Optional
+import weakref
+import simpy
+
+
+@dataclasses.dataclass
+class ProfileReport:
+    """Performance report of one simulation."""
+
+    # Wall-clock time of the simulation in seconds.
+    wall_time: float = 0
+
+    # Simulated time in seconds.
+    sim_time: float = 0
+
+    # Simulated seconds per wall-clock second.
+    sim_speed: float = 0
+
+    # Total number of processed simpy events.
+    num_events: int = 0
+
+    # Number of processed events, per type of the actor that waits on them.
+    events_per_actor_type: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Number of processed events, per phase of the model update.
+    events_per_phase: dict[str, int] = dataclasses.field(
+        default_factory=dict)
+
+    # Peak memory allocated by Python during the simulation, in bytes.
+    peak_memory: int = 0
+
+    # Wall-clock time of aggregating metrics after the simulation.
+    aggregate_time: float = 0
+
+    def summary(self) -> str:
+        """A short human-readable summary."""
+        lines = [
+            f"Wall time: {self.wall_time:.3f} s",
+            f"Simulated time: {self.sim_time:.1f} s "
+            f"({self.sim_speed:.1f} simulated s per wall s)",
+            f"Events: {self.num_events} "
+            f"({self.num_events / max(self.wall_time, 1e-9):.0f} per s)",
+            f"Peak memory: {self.peak_memory / 2**20:.2f} MiB",
+            f"Metric aggregation: {self.aggregate_time:.3f} s",
+            "Events per actor type:",
+        ]
+        for name, count in sorted(
+                self.events_per_actor_type.items(), key=lambda x: -x[1]):
+            lines.append(f"  {name}: {count}")
+        lines.append("Events per phase:")
+        for name, count in self.events_per_phase.items():
+            lines.append(f"  {name}: {count}")
+        return "\n".join(lines)
+
+
+class ProfiledEnvironment(simpy.Environment):
+    """An environment that tells which event the next step() processes.
+
+    It keeps its own queue of scheduled events, in the same order as
+    simpy.Environment processes them: by time, priority, then scheduling
+    order. It also records the type of the actor that owns each process.
+    """
+
+    def __init__(self, initial_time: float = 0):
+        super().__init__(initial_time)
+        self.scheduled: list[tuple[float, Any, int, simpy.Event]] = []
+        self.num_scheduled = 0
+        self.process_owners: weakref.WeakKeyDictionary = (
+            weakref.WeakKeyDictionary())
+
+    def process(self, generator: Generator) -> simpy.Process:
+        process = super().process(generator)
+        # Processes of actors run generator methods of the actor.
+        frame = generator.gi_frame
+        if frame is not None and "self" in frame.f_locals:
+            self.process_owners[process] = type(
+                frame.f_locals["self"]).__name__
+        return process
+
+    def schedule(
+            self,
+            event: simpy.Event,
+            priority: Any = simpy.events.NORMAL,
+            delay: float = 0) -> None:
+        super().schedule(event, priority, delay)
+        heapq.heappush(
+            self.scheduled,
+            (self.now + delay, priority, self.num_scheduled, event))
+        self.num_scheduled += 1
+
+    def step(self) -> None:
+        if self.scheduled:
+            heapq.heappop(self.scheduled)
+        super().step()
+
+    def peek_event(self) -> Optional[simpy.Event]:
+        """The event to be processed by the next step(), if any."""
+        return self.scheduled[0][3] if self.scheduled else None
+
+
+def create_environment(config: Any) -> simpy.Environment:
+    """A ProfiledEnvironment if profile_simulation is set in the config."""
+    if config.profile_simulation:
+        return ProfiledEnvironment()
+    return simpy.Environment()
+
+
+def get_actor_type(env: ProfiledEnvironment, event: simpy.Event) -> str:
+    """Get the type of the actor whose process waits on an event.
+
+    A process waits on an event through a callback bound to the process.
+    Events that no actor process waits on, such as puts into a
+    simpy.Store, are reported by their own type.
+    """
+    for callback in event.callbacks or []:
+        process = getattr(callback, "__self__", None)
+        if process in env.process_owners:
+            return env.process_owners[process]
+    return type(event).__name__
+
+
+def run_profiled(
+        env: ProfiledEnvironment,
+        until: float,
+        get_phase: Callable[[], str]) -> ProfileReport:
+    """Same as env.run(until=until), but collects a ProfileReport."""
+    report = ProfileReport()
+    per_actor = collections.Counter()
+    per_phase = collections.Counter()
+    tracemalloc.start()
+    start_sim_time = env.now
+    start = time.perf_counter()
+    try:
+        while env.peek() < until:
+            event = env.peek_event()
+            per_actor[get_actor_type(env, event)] += 1
+            per_phase[get_phase()] += 1
+            env.step()
+        # Advance the clock to exactly the same time as env.run would.
+        env.run(until=until)
+    except simpy.core.StopSimulation:
+        # Stopped early by an event, like env.run would.
+        pass
+    report.wall_time = time.perf_counter() - start
+    report.peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report.sim_time = env.now - start_sim_time
+    report.sim_speed = report.sim_time / max(report.wall_time, 1e-9)
+    report.num_events = sum(per_actor.values())
+    report.events_per_actor_type = dict(per_actor)
+    report.events_per_phase = dict(per_phase)
+    return report
@@ -0,0 +1,73 @@
+"""Synchronized random streams, for common random numbers.
+
+With config.random_seed set, every source of randomness draws from its own
+stream, seeded from the random seed and the name of the stream:
+    arrival: arrival times, user ids and audio lengths of the client
+    users: user ids sampled outside of the arrival process
+    latency/<link>: latency multipliers of each link
+    actor/<name>: decisions of each actor, such as the frontend balancer of
+        the client, the worker selection of a frontend, and the model
+        update times of a worker
+    msg_id: ids of messages
+
+Thus simulations of different strategies with the same random seed see the
+same arrivals, the same update times of each worker, and the same latency
+draws on each link, as far as they make the same draws. Differences between
+strategies are then measured with much less noise, see comparison.py.
+
+Without a random seed, all streams are the global random module, or NumPy
+generators seeded from it, as before.
+"""
+import random
+import zlib
+from typing import Any, Optional
+import numpy as np
+
+
+def create_rng() -> np.random.Generator:
+    """Create a NumPy generator seeded from the random module.
+
+    Thus random.seed() also makes NumPy sampling reproducible.
+    """
+    return np.random.default_rng(random.getrandbits(64))
+
+
+class RandomStreams:
+    """Named random streams derived from one seed."""
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed
+        self.python_streams: dict[str, random.Random] = {}
+
+    @property
+    def seeded(self) -> bool:
+        return self.seed is not None
+
+    def get_seed_sequence(self, name: str) -> np.random.SeedSequence:
+        # crc32 is stable across processes, unlike hash().
+        return np.random.SeedSequence(
+            entropy=self.seed,
+            spawn_key=(zlib.crc32(name.encode("utf-8")),))
+
+    def get_numpy(self, name: str) -> np.random.Generator:
+        """A new NumPy generator of a stream."""
+        if not self.seeded:
+            return create_rng()
+        return np.random.default_rng(self.get_seed_sequence(name))
+
+    def get_python(self, name: str) -> Any:
+        """The Python random generator of a stream, shared by all callers.
+
+        Returns the random module itself if not seeded.
+        """
+        if not self.seeded:
+            return random
+        if name not in self.python_streams:
+            state = self.get_seed_sequence(name).generate_state(4)
+            self.python_streams[name] = random.Random(
+                int.from_bytes(state.tobytes(), "little"))
+        return self.python_streams[name]
+
+
+# Streams of actors that are not part of a NetworkSystem.
+UNSEEDED = RandomStreams()
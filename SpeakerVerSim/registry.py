@@ -0,0 +1,98 @@
+"""Registry of strategies.
+
+Each strategy is a build_system(config) function that returns a
+NetworkSystem ready to simulate. Strategy modules are only imported when
+their strategy is first used, so importing the package stays cheap.
+
+External packages can add strategies, with their own frontend, worker and
+database classes, in either of these ways:
+    calling register_strategy(), or using it as a decorator of
+        build_system, in a module that is imported before simulation
+    declaring an entry point in the group ENTRY_POINT_GROUP, such as
+        my-strategy = "my_package.my_module:build_system"
+        which is only loaded when the strategy is first used
+"""
+import importlib
+from typing import Callable, Optional, Union
+
+ENTRY_POINT_GROUP = "speakerversim.strategies"
+
+# Mapping from strategy name to either the path of a module that defines
+# build_system, or the build_system function itself once loaded.
+_strategies: dict[str, Union[str, Callable]] = {
+    "SSO": "SpeakerVerSim.server_single_simple",
+    "SSO-sync": "SpeakerVerSim.server_single_sync",
+    "SSO-hash": "SpeakerVerSim.server_single_hash",
+    "SSO-mul": "SpeakerVerSim.server_single_multiprofile",
+    "SD": "SpeakerVerSim.server_double",
+}
+
+_entry_points_loaded = False
+
+
+def get_name(strategy) -> str:
+    """Name of a strategy, which may also be a Strategy enum."""
+    return str(getattr(strategy, "value", strategy))
+
+
+def register_strategy(
+        name: str,
+        target: Union[str, Callable, None] = None) -> Callable:
+    """Register a strategy.
+
+    Args:
+        name: name of the strategy, used as config.strategy
+        target: either the path of a module that defines build_system,
+            which is imported lazily, or a build_system function; if None,
+            returns a decorator of build_system
+
+    Returns:
+        target, or the decorator
+    """
+    if target is None:
+        return lambda build_system: register_strategy(name, build_system)
+    _strategies[get_name(name)] = target
+    return target
+
+
+def load_entry_points() -> None:
+    """Register the strategies declared as entry points, without loading."""
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    # Imported here since it is slow to import.
+    from importlib import metadata
+    for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name not in _strategies:
+            _strategies[entry_point.name] = entry_point
+
+
+def list_strategies() -> list[str]:
+    """Names of all registered strategies."""
+    load_entry_points()
+    return list(_strategies.keys())
+
+
+def get_build_system(strategy) -> Callable:
+    """Get the build_system function of a strategy, importing it if needed.
+
+    Raises:
+        ValueError: if the strategy is not registered
+    """
+    name = get_name(strategy)
+    if name not in _strategies:
+        load_entry_points()
+    target: Optional[object] = _strategies.get(name)
+    if target is None:
+        raise ValueError(f"Strategy not supported: {strategy}")
+    if isinstance(target, str):
+        target = importlib.import_module(target)
+    elif hasattr(target, "load"):
+        # An entry point.
+        target = target.load()
+    if not callable(target):
+        # A module that defines build_system.
+        target = target.build_system
+    _strategies[name] = target
+    return target
@@ -0,0 +1,122 @@
+"""Reading and writing request logs for replay.
+
+A request log has one row per request, sorted by timestamp, with columns:
+    timestamp: arrival time in seconds
+    user_id: integer ID of the user
+    audio_length: length of the audio in seconds (optional)
+
+Two formats are supported:
+    CSV: a file with a header row, which is read in chunks
+    columnar: a directory with one .npy file per column, which is
+        memory-mapped
+Neither is loaded into RAM as a whole.
+"""
+import csv
+import os
+from typing import Iterator
+import numpy as np
+
+COLUMN_DTYPES = {
+    "timestamp": np.float64,
+    "user_id": np.int64,
+    "audio_length": np.float64,
+}
+REQUIRED_COLUMNS = ["timestamp", "user_id"]
+
+
+def check_columns(columns: list[str], path: str) -> None:
+    """Check that the columns of a request log are valid."""
+    for column in REQUIRED_COLUMNS:
+        if column not in columns:
+            raise ValueError(f"Missing column {column} in {path}")
+    for column in columns:
+        if column not in COLUMN_DTYPES:
+            raise ValueError(f"Unknown column {column} in {path}")
+
+
+def iter_csv_chunks(
+        path: str, chunk_size: int) -> Iterator[dict[str, np.ndarray]]:
+    """Iterate over chunks of a CSV request log."""
+    with open(path, "r", newline="") as f:
+        reader = csv.reader(f)
+        columns = [x.strip() for x in next(reader)]
+        check_columns(columns, path)
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            rows.append(row)
+            if len(rows) == chunk_size:
+                yield rows_to_chunk(rows, columns)
+                rows = []
+        if rows:
+            yield rows_to_chunk(rows, columns)
+
+
+def rows_to_chunk(
+        rows: list[list[str]], columns: list[str]) -> dict[str, np.ndarray]:
+    """Convert CSV rows to a chunk of columns."""
+    return {
+        column: np.array([row[i] for row in rows]).astype(
+            COLUMN_DTYPES[column])
+        for i, column in enumerate(columns)}
+
+
+def open_columnar(path: str) -> dict[str, np.ndarray]:
+    """Memory-map all columns of a columnar request log."""
+    columns = {}
+    for column in COLUMN_DTYPES:
+        column_file = os.path.join(path, column + ".npy")
+        if os.path.exists(column_file):
+            columns[column] = np.load(column_file, mmap_mode="r")
+    check_columns(list(columns.keys()), path)
+    return columns
+
+
+def iter_columnar_chunks(
+        path: str, chunk_size: int) -> Iterator[dict[str, np.ndarray]]:
+    """Iterate over chunks of a columnar request log."""
+    columns = open_columnar(path)
+    num_rows = len(columns["timestamp"])
+    for start in range(0, num_rows, chunk_size):
+        yield {
+            column: np.asarray(values[start:start + chunk_size])
+            for column, values in columns.items()}
+
+
+def iter_request_log(
+        path: str, chunk_size: int) -> Iterator[dict[str, np.ndarray]]:
+    """Iterate over chunks of a request log in either format."""
+    if os.path.isdir(path):
+        return iter_columnar_chunks(path, chunk_size)
+    return iter_csv_chunks(path, chunk_size)
+
+
+def convert_csv_to_columnar(
+        csv_path: str,
+        columnar_path: str,
+        chunk_size: int = 100000) -> None:
+    """Convert a CSV request log to the columnar format.
+
+    The CSV file is read twice, once to count rows and once to fill the
+    memory-mapped columns, so it is never loaded into RAM as a whole.
+    """
+    num_rows = 0
+    columns = []
+    for chunk in iter_csv_chunks(csv_path, chunk_size):
+        num_rows += len(chunk["timestamp"])
+        columns = list(chunk.keys())
+    os.makedirs(columnar_path, exist_ok=True)
+    outputs = {
+        column: np.lib.format.open_memmap(
+            os.path.join(columnar_path, column + ".npy"),
+            mode="w+", dtype=COLUMN_DTYPES[column], shape=(num_rows,))
+        for column in columns}
+    start = 0
+    for chunk in iter_csv_chunks(csv_path, chunk_size):
+        end = start + len(chunk["timestamp"])
+        for column, values in chunk.items():
+            outputs[column][start:end] = values
+        start = end
+    for output in outputs.values():
+        output.flush()
@@ -0,0 +1,104 @@
+"""Scheduling of inferences on a worker with limited concurrency.
+
+With config.worker_concurrency, requests wait in a queue for a free
+inference slot. Each request belongs to a class:
+    verification: a user-facing verification request
+    enrollment: a re-enrollment request, in the foreground for SSO
+        strategies, or in the background for SD
+and the next request to run is picked by config.worker_scheduling:
+    fifo: the earliest request of any class
+    strict: verification requests before any enrollment request
+    weighted_fair: each class gets a share of inference time proportional
+        to its weight in config.worker_class_weights, while it has waiting
+        requests
+    deadline: the earliest deadline, where the deadline of a request is its
+        arrival time plus the deadline of its class in
+        config.worker_class_deadlines
+Requests of the same class always run in arrival order.
+"""
+import collections
+from typing import Any
+import simpy
+
+VERIFICATION = "verification"
+ENROLLMENT = "enrollment"
+CLASSES = (VERIFICATION, ENROLLMENT)
+
+
+def get_class(msg: Any) -> str:
+    """Scheduling class of a request."""
+    return ENROLLMENT if msg.is_enroll else VERIFICATION
+
+
+class WorkerScheduler:
+    """Grants inference slots of a worker to waiting requests."""
+
+    def __init__(self, env: simpy.Environment, config: Any, capacity: int):
+        self.env = env
+        self.capacity = capacity
+        self.policy = config.worker_scheduling
+        self.weights = config.worker_class_weights
+        self.deadlines = config.worker_class_deadlines
+        self.num_running = 0
+        # Waiting requests of each class, as (event, arrival order, arrival
+        # time, cost) in arrival order.
+        self.queues: dict[str, collections.deque] = {
+            name: collections.deque() for name in CLASSES}
+        self.num_arrivals = 0
+        # Virtual time of each class for weighted_fair, which advances by
+        # cost / weight for each request that runs.
+        self.virtual_times = {name: 0.0 for name in CLASSES}
+        self.virtual_time = 0.0
+
+    @property
+    def queue_length(self) -> int:
+        """Count of waiting requests."""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def request(self, msg: Any, cost: float = 1.0) -> simpy.Event:
+        """An event that succeeds once the request gets a slot.
+
+        Args:
+            msg: the request
+            cost: expected inference time of the request, relative to
+                other requests, used by weighted_fair
+        """
+        name = get_class(msg)
+        queue = self.queues[name]
+        if not queue:
+            # An idle class does not bank credit.
+            self.virtual_times[name] = max(
+                self.virtual_times[name], self.virtual_time)
+        event = self.env.event()
+        queue.append((event, self.num_arrivals, self.env.now, cost))
+        self.num_arrivals += 1
+        self.dispatch()
+        return event
+
+    def release(self) -> None:
+        """A running request has finished."""
+        self.num_running -= 1
+        self.dispatch()
+
+    def select_class(self) -> str:
+        """The class of the next request to run."""
+        waiting = [name for name in CLASSES if self.queues[name]]
+        if self.policy == "strict":
+            return waiting[0]
+        if self.policy == "weighted_fair":
+            return min(waiting, key=lambda name: self.virtual_times[name])
+        if self.policy == "deadline":
+            return min(waiting, key=lambda name: (
+                self.queues[name][0][2] + self.deadlines[name],
+                self.queues[name][0][1]))
+        return min(waiting, key=lambda name: self.queues[name][0][1])
+
+    def dispatch(self) -> None:
+        """Grant free slots to waiting requests."""
+        while self.num_running < self.capacity and self.queue_length:
+            name = self.select_class()
+            event, _, _, cost = self.queues[name].popleft()
+            self.virtual_time = self.virtual_times[name]
+            self.virtual_times[name] += cost / self.weights[name]
+            self.num_running += 1
+            event.succeed()
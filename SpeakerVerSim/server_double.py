@@ -1,13 +1,13 @@
 """Basic server-side double version strategy (SD)."""
-import simpy
-import random
 from typing import Generator
-import copy
 import munch
 
+from SpeakerVerSim import profiling
+from SpeakerVerSim.config import compile_config
 from SpeakerVerSim.common import (
     Strategy, Message, BaseFrontend, BaseWorker, NetworkSystem,
-    MultiVersionDatabase, GlobalStats)
+    MultiVersionDatabase, GlobalStats, create_frontends)
+from SpeakerVerSim.tracing import EventCode
 from SpeakerVerSim import server_single_simple
 
 
@@ -16,13 +16,19 @@ class BackgroundReenrollFrontend(BaseFrontend):
 
     Re-enrollment happens as non-blocking background process.
     """
-    # A helper mapping for summing flops.
-    # Only needed for stats.
+    # A helper mapping for summing flops of in-flight background
+    # enrollments. Only needed for stats.
     id_to_msg: dict[int, Message]
 
+    # Time when each in-flight background enrollment was sent.
+    id_to_send_time: dict[int, float]
+
     def setup(self) -> None:
         self.id_to_msg = dict()
+        self.id_to_send_time = dict()
         self.env.process(self.handle_messages())
+        if self.config.enroll_expiry_time > 0:
+            self.env.process(self.expire_enrollments())
 
     def handle_messages(self) -> Generator:
         while True:
@@ -36,7 +42,13 @@ class BackgroundReenrollFrontend(BaseFrontend):
                 # No need to resend request to worker.
                 msg.is_enroll = False
                 msg.is_request = True
-                self.id_to_msg[msg.msg_id].total_flops += msg.total_flops
+                self.id_to_send_time.pop(msg.msg_id, None)
+                orig_msg = self.id_to_msg.pop(msg.msg_id, None)
+                if orig_msg is None:
+                    self.log("enrollment response arrived after expiry", 1)
+                else:
+                    orig_msg.total_flops += msg.total_flops
+                    self.client.release_response(orig_msg)
                 self.env.process(self.update_database(msg))
             else:
                 # Send response back to client.
@@ -46,8 +58,11 @@ class BackgroundReenrollFrontend(BaseFrontend):
         """Fetch profile from database and send request to worker."""
         # Part 1: Fetch database.
         if len(msg.profile_versions) == 0:
-            self.log("fetch database")
-            yield from self.database.fetch_profile(msg)
+            if self.trace_hops:
+                self.tracer.emit(
+                    self.env.now, self.actor_id,
+                    EventCode.FETCH_DATABASE, msg.msg_id)
+            yield from self.fetch_profile(msg)
             if len(msg.profile_versions) == 0:
                 raise ValueError("fetch_profile failed.")
         else:
@@ -59,24 +74,67 @@ class BackgroundReenrollFrontend(BaseFrontend):
 
         # Part 3: Decide whether need to trigger background re-enrollment.
         if max(worker.versions) not in msg.profile_versions:
-            enroll_msg = copy.deepcopy(msg)
-            enroll_msg.is_enroll = True
-            enroll_msg.total_flops = 0
+            if self.join_enrollment(msg, max(worker.versions)) is not None:
+                # The same enrollment is already running in the background.
+                return
+            enroll_msg = self.create_enroll_request(msg)
             self.env.process(self.send_to_worker(worker, enroll_msg))
             # Note: Since enrollment is in a different background process,
             # its flops are not included in the original msg.
             # Thus we need to manually add them later.
             self.id_to_msg[msg.msg_id] = msg
+            self.id_to_send_time[msg.msg_id] = self.env.now
+
+    def create_enroll_request(self, msg: Message) -> Message:
+        """Create a background enrollment request from a request.
+
+        Only the fields needed for enrollment are copied. The list of
+        profile_versions is shared, since workers never modify it.
+        """
+        return Message(
+            msg_id=msg.msg_id,
+            user_id=msg.user_id,
+            audio_length=msg.audio_length,
+            profile_versions=msg.profile_versions,
+            is_request=True,
+            is_enroll=True,
+            client_send_time=msg.client_send_time,
+        )
+
+    def expire_enrollments(self) -> Generator:
+        """Periodically drop enrollments that never got a response."""
+        expiry_time = self.config.enroll_expiry_time
+        while True:
+            yield self.env.timeout(expiry_time)
+            deadline = self.env.now - expiry_time
+            expired = [
+                msg_id for msg_id, send_time in self.id_to_send_time.items()
+                if send_time <= deadline]
+            for msg_id in expired:
+                del self.id_to_send_time[msg_id]
+                msg = self.id_to_msg.pop(msg_id)
+                self.client.release_response(msg)
+                self.complete_enrollment(msg)
+                self.log("background enrollment expired", 1)
 
     def update_database(self, msg: Message) -> Generator:
         """After background re-enroll, update database."""
-        self.log("update database")
-        yield from self.database.update_profile(msg)
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.UPDATE_DATABASE, msg.msg_id)
+        yield from self.update_profile(msg)
+        self.complete_enrollment(msg)
 
     def send_client_response(self, msg: Message) -> Generator:
         """Send response back to client."""
         yield from self.send_to_client(msg)
 
+    def is_pending(self, msg: Message) -> bool:
+        # The flops of the background enrollment are added to the response
+        # once the enrollment responds.
+        return self.id_to_msg.get(msg.msg_id) is msg
+
 
 class DoubleVersionWorker(BaseWorker):
     """A backend worker serving two versions of models."""
@@ -97,7 +155,10 @@ class DoubleVersionWorker(BaseWorker):
 
     def handle_one_request(self, msg: Message) -> Generator:
         """Handle a single request and convert it to a reponse."""
-        self.log("handle request")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.HANDLE_REQUEST, msg.msg_id)
         msg.worker_receive_time = self.env.now
         msg.worker_name = self.name
 
@@ -113,22 +174,29 @@ class DoubleVersionWorker(BaseWorker):
 
         # Run inference.
         yield from self.run_inference(msg)
-        self.log("complete request")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.COMPLETE_REQUEST, msg.msg_id)
 
         # Send response back to frontend.
         msg.is_request = False
         yield from self.send_to_frontend(msg)
 
+    def can_serve(self, msg: Message) -> bool:
+        return any(
+            version in msg.profile_versions for version in self.versions)
+
     def update_version(self) -> Generator:
         """Replace the oldest version (v1) by a new version (v3)."""
-        update_time = random.expovariate(
+        update_time = self.random.expovariate(
             1.0 / self.config.worker_update_mean_time)
         yield self.env.timeout(update_time)
         # Delete oldest version.
         del self.versions[0]
         # Add newest version.
         self.versions.append(self.versions[-1] + 1)
-        self.log("update model version")
+        self.record_update()
 
 
 class DoubleVersionNetworkSystem(NetworkSystem):
@@ -142,25 +210,31 @@ class DoubleVersionNetworkSystem(NetworkSystem):
             worker.set_model_versions([1, 2])
 
 
-def simulate(config: munch.Munch) -> GlobalStats:
-    """Run simulation."""
+def build_system(config: munch.Munch) -> NetworkSystem:
+    """Build the network system of this strategy."""
+    config = compile_config(config)
     if config.strategy != Strategy.SD:
         print(config.strategy)
         print(Strategy.SD)
         raise ValueError("Incorrect strategy being used.")
-    env = simpy.Environment()
+    env = profiling.create_environment(config)
     stats = GlobalStats(config=config)
     client = server_single_simple.SimpleClient(env, "client", config, stats)
-    frontend = BackgroundReenrollFrontend(env, "frontend", config, stats)
+    frontends = create_frontends(
+        BackgroundReenrollFrontend, env, config, stats)
     workers = [
         DoubleVersionWorker(env, f"worker-{i}", config, stats)
-        for i in range(config["num_cloud_workers"])]
+        for i in range(config.num_cloud_workers)]
     database = MultiVersionDatabase(env, "database", config, stats)
     database.create(init_versions=[1, 2])
-    netsys = DoubleVersionNetworkSystem(
+    return DoubleVersionNetworkSystem(
         env,
         client,
-        frontend,
+        frontends,
         workers,
         database)
-    return netsys.simulate()
+
+
+def simulate(config: munch.Munch) -> GlobalStats:
+    """Run simulation."""
+    return build_system(config).simulate()
@@ -4,12 +4,13 @@ The frontend server implements a load balancing algorithm based
 on the hash value of the user’s ID, such that requests for each
 user are always dispatched to the same cloud computing server.
 """
-import simpy
 import munch
 
+from SpeakerVerSim import profiling
+from SpeakerVerSim.config import compile_config
 from SpeakerVerSim.common import (
     Strategy, Message, BaseWorker, NetworkSystem, SingleVersionDatabase,
-    GlobalStats)
+    GlobalStats, create_frontends)
 from SpeakerVerSim import server_single_simple
 
 
@@ -23,24 +24,29 @@ class UserHashFrontend(server_single_simple.ForegroundReenrollFrontend):
         return self.workers[user_hash]
 
 
-def simulate(config: munch.Munch) -> GlobalStats:
-    """Run simulation."""
+def build_system(config: munch.Munch) -> NetworkSystem:
+    """Build the network system of this strategy."""
+    config = compile_config(config)
     if config.strategy != Strategy.SSO_HASH:
         raise ValueError("Incorrect strategy being used.")
-    env = simpy.Environment()
+    env = profiling.create_environment(config)
     stats = GlobalStats(config=config)
     client = server_single_simple.SimpleClient(env, "client", config, stats)
-    frontend = UserHashFrontend(env, "frontend", config, stats)
+    frontends = create_frontends(UserHashFrontend, env, config, stats)
     workers = [
         server_single_simple.SingleVersionWorker(
             env, f"worker-{i}", config, stats)
-        for i in range(config["num_cloud_workers"])]
+        for i in range(config.num_cloud_workers)]
     database = SingleVersionDatabase(env, "database", config, stats)
     database.create(init_version=1)
-    netsys = NetworkSystem(
+    return NetworkSystem(
         env,
         client,
-        frontend,
+        frontends,
         workers,
         database)
-    return netsys.simulate()
+
+
+def simulate(config: munch.Munch) -> GlobalStats:
+    """Run simulation."""
+    return build_system(config).simulate()
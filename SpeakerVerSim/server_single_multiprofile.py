@@ -5,13 +5,15 @@ We store multiple versions of profiles for each user in the database.
 Once the re-enrollment for a user has completed, we will store both
 the old version and the new version of this user's profile.
 """
-import simpy
 from typing import Generator
 import munch
 
+from SpeakerVerSim import profiling
+from SpeakerVerSim.config import compile_config
 from SpeakerVerSim.common import (
-    Strategy, Message, NetworkSystem, MultiVersionDatabase,
-    GlobalStats)
+    Strategy, Message, NetworkSystem, MultiVersionDatabase, GlobalStats,
+    create_frontends)
+from SpeakerVerSim.tracing import EventCode
 from SpeakerVerSim import server_single_simple
 
 
@@ -22,8 +24,11 @@ class MultiProfileFrontend(server_single_simple.ForegroundReenrollFrontend):
         """Fetch profiles from database and send request to worker."""
         # Part 1: Fetch database.
         if len(msg.profile_versions) == 0:
-            self.log("fetch database")
-            yield from self.database.fetch_profile(msg)
+            if self.trace_hops:
+                self.tracer.emit(
+                    self.env.now, self.actor_id,
+                    EventCode.FETCH_DATABASE, msg.msg_id)
+            yield from self.fetch_profile(msg)
             if len(msg.profile_versions) == 0:
                 raise ValueError("fetch_profile failed.")
         else:
@@ -32,10 +37,19 @@ class MultiProfileFrontend(server_single_simple.ForegroundReenrollFrontend):
         # Part 2: Re-enroll if necessary.
         worker = self.select_worker(msg)
         if worker.version not in msg.profile_versions:
-            if worker.version > max(msg.profile_versions):
-                self.stats.forward_bounce_count += 1
-            else:
-                self.stats.backward_bounce_count += 1
+            if not self.in_warmup(msg):
+                if worker.version > max(msg.profile_versions):
+                    self.stats.forward_bounce_count += 1
+                else:
+                    self.stats.backward_bounce_count += 1
+            inflight = self.join_enrollment(msg, worker.version)
+            if inflight is not None:
+                # Reuse the in-flight enrollment of the same user.
+                yield inflight
+                msg.profile_version = worker.version
+                worker = self.select_worker(msg)
+                yield from self.send_to_worker(worker, msg)
+                return
             # Mark the request as an enrollment request.
             msg.is_enroll = True
 
@@ -45,32 +59,41 @@ class MultiProfileFrontend(server_single_simple.ForegroundReenrollFrontend):
     def resend_worker_request(self, msg: Message) -> Generator:
         """After re-enroll, send worker request again."""
         # Part 1: Update database with re-enrolled profile.
-        self.log("update database")
-        yield from self.database.update_profile(msg)
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.UPDATE_DATABASE, msg.msg_id)
+        yield from self.update_profile(msg)
+        self.complete_enrollment(msg)
 
         # Part 2: Re-send request to worker.
         worker = self.select_worker(msg)
         yield from self.send_to_worker(worker, msg)
 
 
-def simulate(config: munch.Munch) -> GlobalStats:
-    """Run simulation."""
+def build_system(config: munch.Munch) -> NetworkSystem:
+    """Build the network system of this strategy."""
+    config = compile_config(config)
     if config.strategy != Strategy.SSO_MUL:
         raise ValueError("Incorrect strategy being used.")
-    env = simpy.Environment()
+    env = profiling.create_environment(config)
     stats = GlobalStats(config=config)
     client = server_single_simple.SimpleClient(env, "client", config, stats)
-    frontend = MultiProfileFrontend(env, "frontend", config, stats)
+    frontends = create_frontends(MultiProfileFrontend, env, config, stats)
     workers = [
         server_single_simple.SingleVersionWorker(
             env, f"worker-{i}", config, stats)
-        for i in range(config["num_cloud_workers"])]
+        for i in range(config.num_cloud_workers)]
     database = MultiVersionDatabase(env, "database", config, stats)
     database.create(init_versions=[1])
-    netsys = NetworkSystem(
+    return NetworkSystem(
         env,
         client,
-        frontend,
+        frontends,
         workers,
         database)
-    return netsys.simulate()
+
+
+def simulate(config: munch.Munch) -> GlobalStats:
+    """Run simulation."""
+    return build_system(config).simulate()
@@ -1,27 +1,57 @@
 """Basic server-side single version online strategy (SSO)."""
-import simpy
-import random
-from typing import Generator
+from typing import Generator, Optional
 import sys
 import munch
 
+from SpeakerVerSim import arrival
+from SpeakerVerSim import message_log
+from SpeakerVerSim import profiling
+from SpeakerVerSim.config import compile_config
 from SpeakerVerSim.common import (
-    Strategy, Message, BaseClient, BaseFrontend, BaseWorker,
-    NetworkSystem, SingleVersionDatabase, GlobalStats)
+    Strategy, Message, BaseClient, BaseFrontend, BaseWorker, NetworkSystem,
+    SingleVersionDatabase, GlobalStats, create_frontends)
+from SpeakerVerSim.tracing import EventCode
 
 
 class SimpleClient(BaseClient):
-    """A client that does not store user profiles."""
+    """A client that does not store user profiles.
+
+    If config.spill_messages_file is set, final messages are spilled to
+    that file in chunks instead of being kept in stats.final_messages.
+
+    A response is only final once its frontend no longer adds flops to it,
+    such that spilled messages are the same as those kept in memory.
+    """
+    arrivals: arrival.ArrivalProcess
+    user_sampler: Optional[arrival.UserSampler] = None
+    message_writer: Optional[message_log.MessageWriter] = None
+
+    # Received responses that are not final yet, by msg_id.
+    pending_messages: dict[int, Message]
 
     def setup(self) -> None:
+        self.pending_messages = {}
+        self.arrivals = arrival.create_arrival_process(
+            self.config, self.streams.get_numpy("arrival"))
+        if self.config.spill_messages_file:
+            self.message_writer = message_log.MessageWriter(
+                self.config.spill_messages_file,
+                self.config.spill_chunk_size)
         self.env.process(self.send_frontend_requests())
         self.env.process(self.receive_frontend_responses())
 
-    def create_init_request(self) -> Message:
+    def create_init_request(
+            self,
+            user_id: Optional[int] = None,
+            audio_length: Optional[float] = None) -> Message:
         """Create the initial request with random msg_id."""
+        if user_id is None:
+            user_id = self.get_user_id()
+        msg_ids = self.streams.get_python("msg_id")
         return Message(
-            msg_id=random.randint(0, sys.maxsize),
-            user_id=self.get_user_id(),
+            msg_id=msg_ids.randint(0, sys.maxsize),
+            user_id=user_id,
+            audio_length=audio_length,
             is_request=True,
             is_enroll=False,
         )
@@ -34,38 +64,62 @@ class SimpleClient(BaseClient):
         Different users send requests with different frequency, depending
         on self.config.user_distribution.
         """
-        user_ids = list(range(self.config.num_users))
-        if self.config.user_distribution == "uniform":
-            user_weights = [1 for _ in user_ids]
-        elif self.config.user_distribution == "linear":
-            user_weights = [x + 1 for x in user_ids]
-        elif self.config.user_distribution == "exponential":
-            user_weights = [0.8**x for x in user_ids]
-        else:
-            raise ValueError(
-                "Unsupported user_distribution: {}".format(
-                    self.config.user_distribution))
-        return random.choices(user_ids, weights=user_weights, k=1)[0]
+        if self.user_sampler is None:
+            self.user_sampler = arrival.UserSampler(
+                self.config, self.streams.get_numpy("users"))
+        return int(self.user_sampler.sample(1)[0])
 
     def send_frontend_requests(self) -> Generator:
-        """Keep sending requests to frontend with intervals."""
-        while True:
-            self.env.process(self.send_one_frontend_request())
-            yield self.env.timeout(self.config.client_request_interval)
+        """Send requests to frontend at the times of the arrival process.
 
-    def send_one_frontend_request(self) -> Generator:
-        """Send one request to frontend."""
-        msg = self.create_init_request()
-        yield from self.send_to_frontend(msg)
+        A single process consumes the precomputed arrivals.
+        """
+        for arrival_time, user_id, audio_length in self.arrivals:
+            if arrival_time > self.env.now:
+                yield self.env.timeout(arrival_time - self.env.now)
+            self.post_to_frontend(
+                self.create_init_request(user_id, audio_length))
 
     def receive_frontend_responses(self) -> Generator:
         """Receive the final responses."""
         while True:
             msg = yield self.message_pool.get()
-            self.log("receive response")
+            if self.trace_hops:
+                self.tracer.emit(
+                    self.env.now, self.actor_id,
+                    EventCode.RECEIVE_RESPONSE, msg.msg_id)
             msg.client_return_time = self.env.now
+            if not self.record_response(msg):
+                continue
+            frontend = self.frontend_dict[msg.frontend_name]
+            if frontend.is_pending(msg):
+                self.pending_messages[msg.msg_id] = msg
+            else:
+                self.add_final_message(msg)
+
+    def release_response(self, msg: Message) -> None:
+        if self.pending_messages.pop(msg.msg_id, None) is not None:
+            self.add_final_message(msg)
+
+    def add_final_message(self, msg: Message) -> None:
+        """Keep or spill a final response."""
+        if self.windowed_metrics is not None:
+            self.windowed_metrics.add_flops(msg.total_flops)
+        if self.message_writer is not None:
+            self.message_writer.append(msg)
+        else:
             self.stats.final_messages.append(msg)
 
+    def finish(self) -> None:
+        """Add responses that are not final yet, and flush spilled
+        messages."""
+        for msg in self.pending_messages.values():
+            self.add_final_message(msg)
+        self.pending_messages = {}
+        if self.message_writer is not None:
+            self.message_writer.close()
+            self.stats.final_messages_file = self.message_writer.path
+
 
 class ForegroundReenrollFrontend(BaseFrontend):
     """A basic frontend that runs re-enrollment on-the-fly.
@@ -96,8 +150,11 @@ class ForegroundReenrollFrontend(BaseFrontend):
         """Fetch profile from database and send request to worker."""
         # Part 1: Fetch database.
         if msg.profile_version is None:
-            self.log("fetch database")
-            yield from self.database.fetch_profile(msg)
+            if self.trace_hops:
+                self.tracer.emit(
+                    self.env.now, self.actor_id,
+                    EventCode.FETCH_DATABASE, msg.msg_id)
+            yield from self.fetch_profile(msg)
             if msg.profile_version is None:
                 raise ValueError("fetch_profile failed.")
         else:
@@ -106,10 +163,19 @@ class ForegroundReenrollFrontend(BaseFrontend):
         # Part 2: Re-enroll if necessary.
         worker = self.select_worker(msg)
         if worker.version != msg.profile_version:
-            if worker.version < msg.profile_version:
-                self.stats.backward_bounce_count += 1
-            else:
-                self.stats.forward_bounce_count += 1
+            if not self.in_warmup(msg):
+                if worker.version < msg.profile_version:
+                    self.stats.backward_bounce_count += 1
+                else:
+                    self.stats.forward_bounce_count += 1
+            inflight = self.join_enrollment(msg, worker.version)
+            if inflight is not None:
+                # Reuse the in-flight enrollment of the same user.
+                yield inflight
+                msg.profile_version = worker.version
+                worker = self.select_worker(msg)
+                yield from self.send_to_worker(worker, msg)
+                return
             # Mark the request as an enrollment request.
             msg.is_enroll = True
 
@@ -119,8 +185,12 @@ class ForegroundReenrollFrontend(BaseFrontend):
     def resend_worker_request(self, msg: Message) -> Generator:
         """After re-enroll, send worker request again."""
         # Part 1: Update database with re-enrolled profile.
-        self.log("update database")
-        yield from self.database.update_profile(msg)
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.UPDATE_DATABASE, msg.msg_id)
+        yield from self.update_profile(msg)
+        self.complete_enrollment(msg)
 
         # Part 2: Re-send request to worker.
         worker = self.select_worker(msg)
@@ -149,7 +219,10 @@ class SingleVersionWorker(BaseWorker):
 
     def handle_one_request(self, msg: Message) -> Generator:
         """Handle a single request and convert it to a reponse."""
-        self.log("handle request")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.HANDLE_REQUEST, msg.msg_id)
         msg.worker_receive_time = self.env.now
         msg.worker_name = self.name
 
@@ -159,38 +232,51 @@ class SingleVersionWorker(BaseWorker):
 
         # Run inference.
         yield from self.run_inference(msg)
-        self.log("complete request")
+        if self.trace_hops:
+            self.tracer.emit(
+                self.env.now, self.actor_id,
+                EventCode.COMPLETE_REQUEST, msg.msg_id)
 
         # Send response back to frontend.
         msg.is_request = False
         yield from self.send_to_frontend(msg)
 
+    def can_serve(self, msg: Message) -> bool:
+        return (self.version == msg.profile_version
+                or self.version in msg.profile_versions)
+
     def update_version(self) -> Generator:
         """Update the model to a new version."""
-        update_time = random.expovariate(
+        update_time = self.random.expovariate(
             1.0 / self.config.worker_update_mean_time)
         yield self.env.timeout(update_time)
         self.version += 1
-        self.log("update model version")
+        self.record_update()
 
 
-def simulate(config: munch.Munch) -> GlobalStats:
-    """Run simulation."""
+def build_system(config: munch.Munch) -> NetworkSystem:
+    """Build the network system of this strategy."""
+    config = compile_config(config)
     if config.strategy != Strategy.SSO:
         raise ValueError("Incorrect strategy being used.")
-    env = simpy.Environment()
+    env = profiling.create_environment(config)
     stats = GlobalStats(config=config)
     client = SimpleClient(env, "client", config, stats)
-    frontend = ForegroundReenrollFrontend(env, "frontend", config, stats)
+    frontends = create_frontends(
+        ForegroundReenrollFrontend, env, config, stats)
     workers = [
         SingleVersionWorker(env, f"worker-{i}", config, stats)
         for i in range(config.num_cloud_workers)]
     database = SingleVersionDatabase(env, "database", config, stats)
     database.create(init_version=1)
-    netsys = NetworkSystem(
+    return NetworkSystem(
         env,
         client,
-        frontend,
+        frontends,
         workers,
         database)
-    return netsys.simulate()
+
+
+def simulate(config: munch.Munch) -> GlobalStats:
+    """Run simulation."""
+    return build_system(config).simulate()
@@ -1,18 +1,25 @@
 """Server-side single version online strategy with sync (SSO-sync).
 
-The frontend server can periodically send synchronization requests
-to all cloud computing servers, and maintain a table to record the
-current model version of each cloud computing server.
+The frontend server maintains a table to record the current model version
+of each cloud computing server. The table learns new versions in one or
+more ways, see config.version_propagation:
+    poll: the frontend periodically sends synchronization requests to all
+        cloud computing servers
+    push: each cloud computing server notifies all frontends once it has
+        updated its model
+    piggyback: each response of a cloud computing server carries its
+        current version
 """
 import simpy
-import random
 import dataclasses
 from typing import Generator, Optional
 import munch
 
+from SpeakerVerSim import profiling
+from SpeakerVerSim.config import compile_config
 from SpeakerVerSim.common import (
-    Strategy, Message, BaseWorker, NetworkSystem, SingleVersionDatabase,
-    GlobalStats)
+    Strategy, Message, BaseFrontend, BaseWorker, NetworkSystem,
+    SingleVersionDatabase, GlobalStats, create_frontends)
 from SpeakerVerSim import server_single_simple
 
 
@@ -26,13 +33,21 @@ class VersionQuery:
     # Which worker handled this request.
     worker_name: str = ""
 
+    # Which frontend sent this request.
+    frontend_name: str = ""
+
     # The version of the model served by the worker.
     version: Optional[int] = None
 
+    # Whether this is a notification pushed by the worker, rather than a
+    # response to a query of the frontend.
+    is_push: bool = False
+
 
 class VersionSyncFrontend(server_single_simple.ForegroundReenrollFrontend):
     """A frontend that keeps a model version table."""
     worker_version_table: dict
+    worker_dict: dict[str, BaseWorker]
     query_pool: simpy.Store
 
     def setup(self) -> None:
@@ -41,12 +56,14 @@ class VersionSyncFrontend(server_single_simple.ForegroundReenrollFrontend):
         self.worker_version_table = dict()
         for worker in self.workers:
             self.worker_version_table[worker.name] = worker.version
+        self.worker_dict = {worker.name: worker for worker in self.workers}
 
         # A pool for version query responses.
         self.query_pool = simpy.Store(self.env)
 
         # New processes.
-        self.env.process(self.send_version_queries())
+        if "poll" in self.config.version_propagation:
+            self.env.process(self.send_version_queries())
         self.env.process(self.handle_version_responses())
 
     def select_worker(self, msg: Message) -> BaseWorker:
@@ -54,7 +71,9 @@ class VersionSyncFrontend(server_single_simple.ForegroundReenrollFrontend):
         # Avoid backward version bouncing.
         if msg.profile_version is None:
             raise ValueError("Message version is unset.")
-        worker = random.choice(self.workers)
+        worker = self.random.choice(self.workers)
+        if not self.in_warmup(msg):
+            self.count_version_lookup(worker)
         if self.worker_version_table[worker.name] < msg.profile_version:
             # Retry to find a worker with newer version.
             updated_workers = []
@@ -65,9 +84,52 @@ class VersionSyncFrontend(server_single_simple.ForegroundReenrollFrontend):
             # Note: updated_workers can be empty, if the worker has updated,
             # but has not sync'ed with frontend yet.
             if len(updated_workers) > 0:
-                return random.choice(updated_workers)
+                return self.random.choice(updated_workers)
         return worker
 
+    def count_version_lookup(self, worker: BaseWorker) -> None:
+        """Count a lookup of the table, and whether it is stale."""
+        lookups = self.stats.version_table_lookup_count
+        lookups[self.name] = lookups.get(self.name, 0) + 1
+        if self.worker_version_table[worker.name] != worker.version:
+            stale = self.stats.stale_version_lookup_count
+            stale[self.name] = stale.get(self.name, 0) + 1
+
+    def update_version_table(self, worker_name: str, version: int) -> None:
+        """Update the table, and record how stale the old entry was."""
+        old_version = self.worker_version_table[worker_name]
+        if version <= old_version:
+            return
+        self.worker_version_table[worker_name] = version
+        worker = self.worker_dict[worker_name]
+        # Time since the first update that the table missed.
+        update_time = worker.version_update_times.get(old_version + 1)
+        if update_time is not None:
+            self.record_latency(
+                "version_staleness", self.env.now - update_time)
+
+    def refresh_from_response(self, msg: Message) -> None:
+        """Update the table from the version piggybacked on a response."""
+        if msg.worker_version is None:
+            return
+        if not self.in_warmup(msg):
+            counts = self.stats.version_piggyback_count
+            counts[self.name] = counts.get(self.name, 0) + 1
+        self.update_version_table(msg.worker_name, msg.worker_version)
+
+    def resend_worker_request(self, msg: Message) -> Generator:
+        self.refresh_from_response(msg)
+        yield from super().resend_worker_request(msg)
+
+    def send_client_response(self, msg: Message) -> Generator:
+        self.refresh_from_response(msg)
+        yield from super().send_client_response(msg)
+
+    def count_version_query(self) -> None:
+        """Count a version query message sent or received."""
+        counts = self.stats.version_query_count
+        counts[self.name] = counts.get(self.name, 0) + 1
+
     def send_version_queries(self) -> Generator:
         """Send version queries to all workers at intervals."""
         while True:
@@ -77,9 +139,12 @@ class VersionSyncFrontend(server_single_simple.ForegroundReenrollFrontend):
 
     def send_one_version_query(self, worker: BaseWorker) -> Generator:
         """Send one query to one worker."""
-        query = VersionQuery()
+        query = VersionQuery(frontend_name=self.name)
+        self.count_version_query()
         # Simulate network latency.
-        yield self.get_latency(self.config.frontend_worker_latency)
+        yield self.get_latency(
+            self.config.frontend_worker_latency
+            + self.get_region_latency(worker.region), "frontend_worker")
         worker.query_pool.put(query)  # pytype: disable=attribute-error
 
     def handle_version_responses(self) -> Generator:
@@ -89,15 +154,25 @@ class VersionSyncFrontend(server_single_simple.ForegroundReenrollFrontend):
             if (query.is_request) or (
                     query.version is None) or (not query.worker_name):
                 raise ValueError("Invalid query.")
-            self.worker_version_table[query.worker_name] = query.version
+            if query.is_push:
+                counts = self.stats.version_push_count
+                counts[self.name] = counts.get(self.name, 0) + 1
+            else:
+                self.count_version_query()
+            self.update_version_table(query.worker_name, query.version)
 
 
 class VersionSyncWorker(server_single_simple.SingleVersionWorker):
     """A cloud worker that responds to version queries from frontend."""
     query_pool: simpy.Store
 
+    # Mapping from each version after the initial one to the time when the
+    # worker updated to it.
+    version_update_times: dict[int, float]
+
     def setup(self) -> None:
         super().setup()
+        self.version_update_times = {}
 
         # A pool for version query responses.
         self.query_pool = simpy.Store(self.env)
@@ -121,28 +196,66 @@ class VersionSyncWorker(server_single_simple.SingleVersionWorker):
         else:
             raise ValueError("Query received by worker must be request.")
 
+        frontend = self.frontends[query.frontend_name]
         # Simulate network latency.
-        yield self.get_latency(self.config.frontend_worker_latency)
-        self.frontend.query_pool.put(query)  # pytype: disable=attribute-error
+        yield self.get_latency(
+            self.config.frontend_worker_latency
+            + self.get_region_latency(frontend.region), "frontend_worker")
+        frontend.query_pool.put(query)  # pytype: disable=attribute-error
 
+    def update_version(self) -> Generator:
+        """Update the model, and notify all frontends if pushing."""
+        yield from super().update_version()
+        self.version_update_times[self.version] = self.env.now
+        if "push" in self.config.version_propagation:
+            for frontend in self.frontends.values():
+                # With local routing, only frontends of the same region
+                # send requests to this worker.
+                if self in frontend.workers:
+                    self.env.process(self.push_version(frontend))
 
-def simulate(config: munch.Munch) -> GlobalStats:
-    """Run simulation."""
+    def push_version(self, frontend: BaseFrontend) -> Generator:
+        """Notify one frontend of the current version."""
+        query = VersionQuery(
+            is_request=False,
+            worker_name=self.name,
+            frontend_name=frontend.name,
+            version=self.version,
+            is_push=True)
+        # Simulate network latency.
+        yield self.get_latency(
+            self.config.frontend_worker_latency
+            + self.get_region_latency(frontend.region), "frontend_worker")
+        frontend.query_pool.put(query)  # pytype: disable=attribute-error
+
+    def send_to_frontend(self, msg: Message) -> Generator:
+        if "piggyback" in self.config.version_propagation:
+            msg.worker_version = self.version
+        yield from super().send_to_frontend(msg)
+
+
+def build_system(config: munch.Munch) -> NetworkSystem:
+    """Build the network system of this strategy."""
+    config = compile_config(config)
     if config.strategy != Strategy.SSO_SYNC:
         raise ValueError("Incorrect strategy being used.")
-    env = simpy.Environment()
+    env = profiling.create_environment(config)
     stats = GlobalStats(config=config)
     client = server_single_simple.SimpleClient(env, "client", config, stats)
-    frontend = VersionSyncFrontend(env, "frontend", config, stats)
+    frontends = create_frontends(VersionSyncFrontend, env, config, stats)
     workers = [
         VersionSyncWorker(env, f"worker-{i}", config, stats)
         for i in range(config.num_cloud_workers)]
     database = SingleVersionDatabase(env, "database", config, stats)
     database.create(init_version=1)
-    netsys = NetworkSystem(
+    return NetworkSystem(
         env,
         client,
-        frontend,
+        frontends,
         workers,
         database)
-    return netsys.simulate()
+
+
+def simulate(config: munch.Munch) -> GlobalStats:
+    """Run simulation."""
+    return build_system(config).simulate()
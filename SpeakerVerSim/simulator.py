@@ -1,27 +1,50 @@
 """The simulator API to simplify calling different strategies."""
-from SpeakerVerSim.common import Strategy, GlobalStats
-from SpeakerVerSim import server_single_simple
-from SpeakerVerSim import server_single_sync
-from SpeakerVerSim import server_single_hash
-from SpeakerVerSim import server_single_multiprofile
-from SpeakerVerSim import server_double
+from SpeakerVerSim.common import GlobalStats, NetworkSystem
+from SpeakerVerSim.config import SimulationConfig, compile_config
+from SpeakerVerSim import registry
 
 from typing import Union
 import yaml
 import munch
 
 
-def simulate(config: Union[str, munch.Munch]) -> GlobalStats:
+def build_system(
+        config: Union[munch.Munch, SimulationConfig]) -> NetworkSystem:
+    """Build the network system of the strategy in the config.
+
+    The config is validated and compiled first, see config.py, and the
+    strategy is looked up in the registry, see registry.py.
+
+    Args:
+        config: a Munch of the configurations, or a compiled config
+
+    Returns:
+        the network system, ready to simulate
+
+    Raises:
+        TypeError: if a value in the config has the wrong type
+        ValueError: if the config is invalid, or the strategy in the config
+            is unsupported
+    """
+    config = compile_config(config)
+    return registry.get_build_system(config.strategy)(config)
+
+
+def simulate(
+        config: Union[str, munch.Munch, SimulationConfig]) -> GlobalStats:
     """Main simulation function of this module.
 
     Args:
-        config: either the path to a YAML file, or a Munch
+        config: either the path to a YAML file, a Munch, or a compiled
+            config
 
     Returns:
         stats from the simulation
 
     Raises:
-        ValueError: if the strategy in the config is unsupported
+        TypeError: if a value in the config has the wrong type
+        ValueError: if the config is invalid, or the strategy in the config
+            is unsupported
     """
 
     if isinstance(config, str):
@@ -29,17 +52,4 @@ def simulate(config: Union[str, munch.Munch]) -> GlobalStats:
         with open(config_file, "r") as f:
             config = munch.Munch.fromDict(yaml.safe_load(f))
 
-    strategy = config.strategy
-    match strategy:
-        case Strategy.SSO:
-            return server_single_simple.simulate(config)
-        case Strategy.SSO_SYNC:
-            return server_single_sync.simulate(config)
-        case Strategy.SSO_HASH:
-            return server_single_hash.simulate(config)
-        case Strategy.SSO_MUL:
-            return server_single_multiprofile.simulate(config)
-        case Strategy.SD:
-            return server_double.simulate(config)
-        case _:
-            raise ValueError(f"Strategy not supported: {strategy}")
+    return build_system(config).simulate()
@@ -0,0 +1,111 @@
+"""Mergeable quantile sketches of latencies.
+
+This is a DDSketch (https://arxiv.org/abs/1908.10693): values are counted
+in logarithmic buckets, such that every quantile is estimated within a
+relative error of relative_accuracy. Sketches with the same accuracy can
+be merged exactly, e.g. to combine the replicates of a parameter sweep
+without keeping the raw messages.
+"""
+import math
+from typing import Iterable
+
+# Values below this are counted as zero.
+MIN_VALUE = 1e-9
+
+
+class DDSketch:
+    """A quantile sketch with relative accuracy guarantees."""
+
+    def __init__(
+            self,
+            relative_accuracy: float = 0.01,
+            max_buckets: int = 2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1).")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.inv_log_gamma = 1 / math.log(self.gamma)
+        self.max_buckets = max_buckets
+        # Mapping from bucket index to count. Bucket i holds values in
+        # (gamma^(i-1), gamma^i].
+        self.buckets: dict[int, int] = {}
+        # Count of values too small for any bucket.
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        """Add a non-negative value."""
+        if value < 0:
+            raise ValueError("Cannot add negative value to sketch.")
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value < MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) * self.inv_log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    def collapse(self) -> None:
+        """Merge the lowest buckets to bound the number of buckets."""
+        indices = sorted(self.buckets)
+        num_collapsed = len(indices) - self.max_buckets + 1
+        target = indices[num_collapsed - 1]
+        for index in indices[:num_collapsed - 1]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def merge(self, other: "DDSketch") -> None:
+        """Merge another sketch into this one."""
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches of different accuracy.")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile, where q is in [0, 1]."""
+        if not 0 <= q <= 1:
+            raise ValueError("Quantile must be in [0, 1].")
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return self.min
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+def merge_sketches(
+        sketch_dicts: Iterable[dict[str, DDSketch]]) -> dict[str, DDSketch]:
+    """Merge dicts of sketches keyed by metric, e.g. of many replicates."""
+    merged: dict[str, DDSketch] = {}
+    for sketches in sketch_dicts:
+        for metric, sketch in sketches.items():
+            if metric not in merged:
+                merged[metric] = DDSketch(
+                    sketch.relative_accuracy, sketch.max_buckets)
+            merged[metric].merge(sketch)
+    return merged
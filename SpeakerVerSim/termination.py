@@ -0,0 +1,102 @@
+"""Early termination of simulations.
+
+A simulation always stops at config.time_to_run, but may stop earlier on
+any of these conditions:
+    stop_after_requests: this many responses have been recorded
+    stop_settle_time: all workers have been updated, and there has been no
+        bounce or enrollment for this long; checked every stop_settle_time
+        seconds
+    stop_stability_tolerance: the relative change of stop_stability_metric
+        of the e2e latency, such as "mean" or "p99", has been below this
+        for stop_stability_checks consecutive checks, every
+        stop_stability_interval seconds
+
+Requests sent before config.warmup_time are excluded from stats, so the
+settle condition is only checked after it.
+"""
+from typing import Any, Generator
+import simpy
+
+
+class Termination:
+    """Stops the simulation of a NetworkSystem on early stopping conditions.
+
+    The simulation stops when self.stop_event is processed.
+    """
+
+    def __init__(self, system: Any):
+        self.system = system
+        self.env: simpy.Environment = system.env
+        self.config = system.config
+        self.stats = system.client.stats
+        self.num_responses = 0
+        self.max_responses = self.config.stop_after_requests
+        self.stop_event = self.env.event()
+        self.stop_event.callbacks.append(simpy.core.StopSimulation.callback)
+        if self.config.stop_settle_time > 0:
+            self.env.process(self.watch_settle())
+        if self.config.stop_stability_tolerance > 0:
+            self.env.process(self.watch_stability())
+
+    def stop(self, reason: str) -> None:
+        """Stop the simulation after the current event."""
+        if not self.stop_event.triggered:
+            self.stats.stop_reason = reason
+            self.stop_event.succeed()
+
+    def on_response(self) -> None:
+        """Count a recorded response."""
+        self.num_responses += 1
+        if self.max_responses and self.num_responses >= self.max_responses:
+            self.stop("stop_after_requests")
+
+    def get_activity(self) -> int:
+        """Count of bounces and enrollments so far."""
+        return (self.stats.forward_bounce_count
+                + self.stats.backward_bounce_count
+                + self.stats.enrollment_count)
+
+    def watch_settle(self) -> Generator:
+        """Stop once all workers are updated and activity has settled."""
+        settle_time = self.config.stop_settle_time
+        last_activity = -1
+        while True:
+            yield self.env.timeout(settle_time)
+            activity = self.get_activity()
+            if (self.env.now > self.config.warmup_time
+                    and self.stats.num_worker_updates
+                    >= len(self.system.workers)
+                    and activity == last_activity):
+                self.stop("stop_settle_time")
+            last_activity = activity
+
+    def get_metric(self) -> float:
+        """Running estimate of the e2e latency metric, or 0 if unknown."""
+        e2e = self.stats.latency_sketches.get("e2e")
+        if e2e is None:
+            return 0.0
+        metric = self.config.stop_stability_metric
+        if metric == "mean":
+            return e2e.mean
+        if metric.startswith("p"):
+            return e2e.quantile(float(metric[1:]) / 100)
+        raise ValueError(f"Unsupported stop_stability_metric: {metric}")
+
+    def watch_stability(self) -> Generator:
+        """Stop once the latency metric has stabilized."""
+        tolerance = self.config.stop_stability_tolerance
+        num_checks = self.config.stop_stability_checks
+        last_value = 0.0
+        num_stable = 0
+        while True:
+            yield self.env.timeout(
+                self.config.stop_stability_interval)
+            value = self.get_metric()
+            if value > 0 and last_value > 0 and (
+                    abs(value - last_value) <= tolerance * last_value):
+                num_stable += 1
+            else:
+                num_stable = 0
+            if num_stable >= num_checks:
+                self.stop("stop_stability_tolerance")
+            last_value = value
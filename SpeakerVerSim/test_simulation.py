@@ -1,13 +1,41 @@
+import dataclasses
+import itertools
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
 import unittest
 import yaml
 import munch
+import numpy as np
+import simpy
 
+from SpeakerVerSim import admission
+from SpeakerVerSim import arrival
+from SpeakerVerSim import benchmark
+from SpeakerVerSim import common
+from SpeakerVerSim import comparison
+from SpeakerVerSim import config
+from SpeakerVerSim import latency
+from SpeakerVerSim import message_log
+from SpeakerVerSim import optimizer
+from SpeakerVerSim import planner
+from SpeakerVerSim import profiling
+from SpeakerVerSim import random_streams
+from SpeakerVerSim import registry
+from SpeakerVerSim import request_log
+from SpeakerVerSim import scheduling
+from SpeakerVerSim import sketch
+from SpeakerVerSim import tracing
 from SpeakerVerSim import server_single_simple
 from SpeakerVerSim import server_single_sync
 from SpeakerVerSim import server_single_hash
 from SpeakerVerSim import server_single_multiprofile
 from SpeakerVerSim import server_double
 from SpeakerVerSim import simulate
+from SpeakerVerSim import simulator
 
 
 class TestServerSimulation(unittest.TestCase):
@@ -110,5 +138,1576 @@ class TestSimulatorAPI(unittest.TestCase):
         self.assertGreater(stats.forward_bounce_count, 1)
 
 
+class TestStrategyRegistry(unittest.TestCase):
+    """Test the strategy registry."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+
+    def test_register_decorator(self):
+
+        @registry.register_strategy("test-always-first-worker")
+        def build_system(config):
+            system = server_single_simple.build_system(
+                dataclasses.replace(config, strategy="SSO"))
+            for frontend in system.frontends:
+                frontend.set_workers(system.workers[:1])
+            return system
+
+        self.assertIn("test-always-first-worker", registry.list_strategies())
+        self.config.strategy = "test-always-first-worker"
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertEqual(
+            {msg.worker_name for msg in stats.final_messages}, {"worker-0"})
+
+    def test_enum_lookup(self):
+        self.assertIs(
+            registry.get_build_system(common.Strategy.SSO_SYNC),
+            server_single_sync.build_system)
+
+    def test_lazy_import(self):
+        code = (
+            "import sys\n"
+            "import SpeakerVerSim\n"
+            "print(sorted(x for x in sys.modules\n"
+            "             if x.startswith(('numpy', 'simpy',\n"
+            "                              'SpeakerVerSim.server'))))\n")
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True, capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_import_time(self):
+        self.assertGreater(benchmark.measure_import_time(repeats=1), 0)
+
+
+class TestMultiVersionDatabase(unittest.TestCase):
+    """Test the MultiVersionDatabase."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.num_users = 3
+        self.env = simpy.Environment()
+        self.database = common.MultiVersionDatabase(
+            self.env, "database", self.config, common.GlobalStats())
+
+    def update(self, user_id, version):
+        msg = common.Message(user_id=user_id, profile_version=version)
+        self.env.run(self.env.process(self.database.update_profile(msg)))
+
+    def fetch(self, user_id):
+        msg = common.Message(user_id=user_id)
+        self.env.run(self.env.process(self.database.fetch_profile(msg)))
+        return msg.profile_versions
+
+    def test_users_are_isolated(self):
+        self.database.create(init_versions=[1])
+        self.update(0, 2)
+        self.assertEqual(self.fetch(0), [1, 2])
+        self.assertEqual(self.fetch(1), [1])
+        self.assertTrue(self.database.has_version(0, 2))
+        self.assertFalse(self.database.has_version(1, 2))
+
+    def test_sparse_create(self):
+        self.config.num_users = 10**7
+        self.database.create(init_versions=[1])
+        self.assertEqual(len(self.database.data), 0)
+        self.update(10**7 - 1, 2)
+        self.assertEqual(len(self.database.data), 1)
+        self.assertEqual(self.fetch(10**7 - 1), [1, 2])
+        self.assertEqual(self.fetch(0), [1])
+        with self.assertRaises(ValueError):
+            self.fetch(10**7)
+
+    def test_retention_keeps_latest_versions(self):
+        self.config.profile_retention_versions = 2
+        self.database.create(init_versions=[1, 2])
+        self.update(0, 3)
+        self.update(0, 4)
+        self.assertEqual(self.fetch(0), [3, 4])
+
+    def test_drop_unserved_versions(self):
+        self.config.drop_unserved_profile_versions = True
+        worker = server_single_simple.SingleVersionWorker(
+            self.env, "worker-0", self.config, common.GlobalStats())
+        worker.set_model_version(2)
+        self.database.set_workers([worker])
+        self.database.create(init_versions=[1])
+        self.update(0, 2)
+        self.assertEqual(self.fetch(0), [2])
+        # The newest version is always kept.
+        self.assertEqual(self.fetch(1), [1])
+
+
+class TestCoalesceEnrollments(unittest.TestCase):
+    """Test coalescing of concurrent re-enrollments."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.client_request_interval = 0.2
+        self.config.time_to_run = 600
+        self.config.worker_update_mean_time = 60
+        self.config.coalesce_enrollments = True
+
+    def test_coalesce_SSO(self):
+        self.config.strategy = "SSO"
+        stats = simulate(self.config)
+        self.assertGreater(len(stats.final_messages), 2990)
+        self.assertGreater(stats.coalesced_enroll_count, 0)
+        self.assertEqual(
+            stats.coalesced_enroll_flops_saved,
+            stats.coalesced_enroll_count * self.config.flops_per_inference)
+
+    def test_coalesce_SD(self):
+        self.config.strategy = "SD"
+        # With a single worker, all requests during its update bounce.
+        self.config.num_cloud_workers = 1
+        stats = simulate(self.config)
+        self.assertGreater(len(stats.final_messages), 2990)
+        self.assertGreater(stats.coalesced_enroll_count, 0)
+        self.assertEqual(stats.backward_bounce_count, 0)
+
+
+class TestBackgroundReenrollFrontend(unittest.TestCase):
+    """Test the in-flight state of BackgroundReenrollFrontend."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.strategy = "SD"
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+
+    def test_in_flight_state_is_cleaned_up(self):
+        netsys = server_double.build_system(self.config)
+        stats = netsys.simulate()
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertLessEqual(len(netsys.frontend.id_to_msg), 1)
+
+    def test_enrollment_expiry(self):
+        # Shorter than the latency of an enrollment.
+        self.config.enroll_expiry_time = 0.1
+        self.config.coalesce_enrollments = True
+        netsys = server_double.build_system(self.config)
+        stats = netsys.simulate()
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertEqual(len(netsys.frontend.id_to_msg), 0)
+        self.assertEqual(len(netsys.frontend.inflight_enrollments), 0)
+
+
+class TestTracing(unittest.TestCase):
+    """Test structured event tracing."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+
+    def test_disabled_by_default(self):
+        stats = simulate(self.config)
+        self.assertIsNone(stats.trace)
+
+    def test_trace_hops(self):
+        self.config.trace_level = tracing.TRACE_HOP
+        stats = simulate(self.config)
+        lines = list(tracing.format_trace(
+            stats.trace, stats.trace_actor_names))
+        self.assertEqual(lines[0], "[0.00000] [client] send request")
+        self.assertTrue(lines[1].endswith("[frontend] fetch database"))
+
+    def test_trace_version_updates(self):
+        self.config.trace_level = tracing.TRACE_VERSION
+        stats = simulate(self.config)
+        self.assertTrue(all(
+            code == tracing.EventCode.UPDATE_MODEL_VERSION
+            for code in stats.trace["code"]))
+
+    def test_ring_buffer(self):
+        tracer = tracing.Tracer(capacity=3)
+        actor_id = tracer.register_actor("client")
+        for i in range(5):
+            tracer.emit(i, actor_id, tracing.EventCode.SEND_REQUEST, i)
+        self.assertEqual(list(tracer.events()["msg_id"]), [2, 3, 4])
+
+    def test_trace_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_file = os.path.join(temp_dir, "trace.bin")
+            self.config.trace_level = tracing.TRACE_HOP
+            self.config.trace_buffer_size = 1000
+            self.config.trace_file = trace_file
+            stats = simulate(self.config)
+            events, actor_names = tracing.read_trace_file(trace_file)
+            self.assertGreater(len(events), 1000)
+            self.assertEqual(actor_names, stats.trace_actor_names)
+            self.assertEqual(
+                list(events[-1000:]["msg_id"]), list(stats.trace["msg_id"]))
+            del events
+
+
+class TestProfiling(unittest.TestCase):
+    """Test the performance report of a simulation."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.profile_simulation = True
+
+    def test_profile_report(self):
+        self.config.strategy = "SD"
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        report = stats.profile
+        self.assertAlmostEqual(report.sim_time, self.config.time_to_run)
+        self.assertGreater(report.num_events, 0)
+        self.assertEqual(
+            sum(report.events_per_actor_type.values()), report.num_events)
+        self.assertEqual(
+            sum(report.events_per_phase.values()), report.num_events)
+        self.assertIn("BackgroundReenrollFrontend",
+                      report.events_per_actor_type)
+        self.assertGreater(report.peak_memory, 0)
+        self.assertIn("Wall time", report.summary())
+
+    def test_peek_event(self):
+        env = profiling.ProfiledEnvironment()
+        events = [env.timeout(2), env.timeout(1), env.timeout(1)]
+        events.append(env.event().succeed())
+        for expected in [events[3], events[1], events[2], events[0]]:
+            self.assertIs(env.peek_event(), expected)
+            env.step()
+            self.assertTrue(expected.processed)
+        self.assertIsNone(env.peek_event())
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the benchmark suite."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+
+    def test_get_cases(self):
+        matrix = benchmark.BenchmarkMatrix(
+            num_cloud_workers=[10],
+            num_users=[1],
+            client_request_interval=[10],
+            version_query_interval=[60, 600])
+        cases = benchmark.get_cases(self.config, matrix)
+        # Only SSO-sync sweeps version_query_interval.
+        self.assertEqual(len(cases), 6)
+        self.assertEqual(
+            cases["SSO-sync/w10/u1/i10/q60"].version_query_interval, 60)
+
+    def test_run_case(self):
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        result = benchmark.run_case(self.config)
+        self.assertEqual(result["num_messages"], 1080)
+        self.assertGreater(result["num_events"], 1080)
+        self.assertGreater(result["events_per_second"], 0)
+
+    def test_compare(self):
+        baseline = {"results": {
+            "a": {"wall_time": 1.0, "peak_rss_mb": 10},
+            "b": {"wall_time": 1.0, "peak_rss_mb": 10}}}
+        current = {"results": {
+            "a": {"wall_time": 1.05, "peak_rss_mb": 10},
+            "b": {"wall_time": 2.0, "peak_rss_mb": 10},
+            "c": {"wall_time": 5.0, "peak_rss_mb": 10}}}
+        regressions = benchmark.compare(baseline, current, threshold=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]["case"], "b")
+        self.assertEqual(regressions[0]["metric"], "wall_time")
+
+
+class TestArrivalProcesses(unittest.TestCase):
+    """Test the arrival processes of requests."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.arrival_block_size = 100
+        self.rng = np.random.default_rng(0)
+
+    def get_times(self, num_arrivals):
+        process = arrival.create_arrival_process(self.config, self.rng)
+        return [t for t, _, _ in itertools.islice(process, num_arrivals)]
+
+    def test_periodic(self):
+        times = self.get_times(250)
+        self.assertEqual(times[:3], [0, 10, 20])
+        self.assertAlmostEqual(times[-1], 2490)
+
+    def test_poisson(self):
+        self.config.arrival_process = "poisson"
+        times = self.get_times(10000)
+        self.assertTrue(all(np.diff(times) >= 0))
+        self.assertAlmostEqual(times[-1] / 10000, 10, delta=0.5)
+
+    def test_diurnal(self):
+        self.config.arrival_process = "diurnal"
+        self.config.diurnal_amplitude = 1
+        self.config.diurnal_period = 1000
+        self.config.client_request_interval = 1
+        times = np.array(self.get_times(20000)) % 1000
+        # Rate is highest around the peak, and zero in the opposite phase.
+        near_peak = np.sum((times < 100) | (times > 900))
+        near_trough = np.sum((times > 400) & (times < 600))
+        self.assertGreater(near_peak, 5 * near_trough)
+
+    def test_mmpp(self):
+        self.config.arrival_process = "mmpp"
+        self.config.client_request_interval = 1
+        self.config.burst_mean_gap = 100
+        self.config.burst_mean_duration = 100
+        times = self.get_times(20000)
+        self.assertTrue(all(np.diff(times) >= 0))
+        # Half of the time in bursts with 10x rate.
+        self.assertAlmostEqual(times[-1] / 20000, 2 / 11, delta=0.05)
+
+    def test_user_sampler(self):
+        self.config.num_users = 3
+        self.config.user_distribution = "linear"
+        sampler = arrival.UserSampler(self.config, self.rng)
+        counts = np.bincount(sampler.sample(60000), minlength=3)
+        self.assertTrue(np.allclose(counts / 60000, [1 / 6, 2 / 6, 3 / 6],
+                                    atol=0.01))
+
+    def test_bad_arrival_process(self):
+        self.config.arrival_process = "bad"
+        with self.assertRaises(ValueError):
+            simulate(self.config)
+
+    def test_simulate_poisson(self):
+        self.config.arrival_process = "poisson"
+        self.config.num_users = 1000
+        self.config.client_request_interval = 1
+        stats = simulate(self.config)
+        self.assertAlmostEqual(len(stats.final_messages), 10800, delta=500)
+
+
+class TestRequestLogReplay(unittest.TestCase):
+    """Test replaying request logs."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.arrival_process = "replay"
+        self.config.arrival_block_size = 7
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, "log.csv")
+        with open(self.csv_file, "w") as f:
+            f.write("timestamp,user_id,audio_length\n")
+            for i in range(100):
+                f.write(f"{1000 + i * 10},{i * 7},{2.5 if i % 2 else 5}\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_replay_csv(self):
+        self.config.request_log_file = self.csv_file
+        self.config.request_log_user_mapping = "modulo"
+        self.config.num_users = 10
+        self.config.request_log_time_scale = 2
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 100)
+        msg = stats.final_messages[-1]
+        self.assertAlmostEqual(msg.client_send_time, 1980)
+        self.assertEqual(msg.user_id, 99 * 7 % 10)
+        self.assertEqual(msg.audio_length, 2.5)
+        # Flops scale with audio length.
+        self.assertIn(msg.total_flops, {
+            self.config.flops_per_inference / 2,
+            self.config.flops_per_inference})
+
+    def test_replay_columnar(self):
+        columnar_dir = os.path.join(self.temp_dir.name, "columnar")
+        request_log.convert_csv_to_columnar(
+            self.csv_file, columnar_dir, chunk_size=30)
+        csv_chunks = list(request_log.iter_request_log(self.csv_file, 30))
+        columnar_chunks = list(request_log.iter_request_log(columnar_dir, 30))
+        self.assertEqual(len(csv_chunks), len(columnar_chunks))
+        for csv_chunk, columnar_chunk in zip(csv_chunks, columnar_chunks):
+            for column in request_log.COLUMN_DTYPES:
+                self.assertTrue(np.array_equal(
+                    csv_chunk[column], columnar_chunk[column]))
+
+        self.config.request_log_file = columnar_dir
+        self.config.request_log_user_mapping = "dense"
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 100)
+        self.assertEqual(stats.final_messages[0].user_id, 0)
+
+    def test_user_id_out_of_range(self):
+        self.config.request_log_file = self.csv_file
+        with self.assertRaises(ValueError):
+            simulate(self.config)
+
+
+class TestMultipleFrontends(unittest.TestCase):
+    """Test topologies with multiple frontends."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.num_frontends = 4
+
+    def test_SSO_sync(self):
+        self.config.strategy = "SSO-sync"
+        netsys = server_single_sync.build_system(self.config)
+        stats = netsys.simulate()
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertEqual(len(netsys.frontends), 4)
+        self.assertEqual(
+            set(stats.frontend_request_count.keys()),
+            {f"frontend-{i}" for i in range(4)})
+        for i in range(4):
+            # 17 rounds of queries and responses to 10 workers.
+            self.assertEqual(
+                stats.version_query_count[f"frontend-{i}"], 17 * 2 * 10)
+        # Requests after re-enrollment look up the table again.
+        self.assertGreaterEqual(
+            sum(stats.version_table_lookup_count.values()), 1080)
+        for msg in stats.final_messages:
+            self.assertIn(msg.frontend_name, stats.frontend_request_count)
+
+    def test_round_robin_SD(self):
+        self.config.strategy = "SD"
+        self.config.frontend_balancer = "round_robin"
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertEqual(
+            list(stats.frontend_request_count.values()), [270] * 4)
+        self.assertEqual(stats.backward_bounce_count, 0)
+
+    def test_profile_cache(self):
+        self.config.strategy = "SSO"
+        self.config.frontend_balancer = "user_hash"
+        self.config.profile_cache_ttl = 60
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertGreater(stats.profile_cache_hit_count, 0)
+        self.assertGreater(stats.profile_cache_miss_count, 0)
+
+    def test_bad_balancer(self):
+        self.config.frontend_balancer = "bad"
+        with self.assertRaises(ValueError):
+            simulate(self.config)
+
+
+class TestMultiRegion(unittest.TestCase):
+    """Test multi-region topologies."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.num_users = 10
+        self.config.num_frontends = 2
+        self.config.regions = ["us", "eu"]
+        self.config.region_latency = [[0, 0.1], [0.1, 0]]
+
+    def test_placement(self):
+        self.config.strategy = "SSO"
+        self.config.database_regions = ["eu", "us"]
+        netsys = server_single_simple.build_system(self.config)
+        self.assertEqual([x.region for x in netsys.frontends], [0, 1])
+        self.assertEqual(
+            [x.region for x in netsys.workers], [0, 1] * 5)
+        self.assertEqual(
+            [x.name for x in netsys.databases],
+            ["database", "database-us"])
+        self.assertEqual([x.region for x in netsys.databases], [1, 0])
+        # Each frontend uses the replica in its own region.
+        self.assertEqual(netsys.frontends[0].database.name, "database-us")
+        self.assertEqual(netsys.frontends[1].database.name, "database")
+
+    def test_local_routing(self):
+        self.config.strategy = "SSO"
+        self.config.database_regions = ["us", "eu"]
+        self.config.frontend_routing = "local"
+        self.config.worker_routing = "local"
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertEqual(stats.cross_region_request_count, 0)
+        self.assertGreater(stats.replication_count, 0)
+        for msg in stats.final_messages:
+            self.assertEqual(msg.frontend_name, f"frontend-{msg.region}")
+        self.config.frontend_routing = "global"
+        self.config.worker_routing = "global"
+        global_stats = simulate(self.config)
+        self.assertLess(
+            stats.average_e2e_latency, global_stats.average_e2e_latency)
+
+    def test_global_routing(self):
+        self.config.strategy = "SSO"
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        self.assertGreater(stats.cross_region_request_count, 0)
+        self.assertEqual(stats.replication_count, 0)
+        # Requests of remote users pay for the extra round trips.
+        self.assertGreater(stats.average_e2e_latency_by_region["eu"], 1.1)
+
+    def test_replication_SSO_mul(self):
+        self.config.strategy = "SSO-mul"
+        self.config.database_regions = ["us", "eu"]
+        self.config.replication_lag = 0.5
+        netsys = server_single_multiprofile.build_system(self.config)
+        stats = netsys.simulate()
+        self.assertGreater(stats.replication_count, 0)
+        # Replicas converge after all workers have been updated.
+        self.assertEqual(
+            netsys.databases[0].data, netsys.databases[1].data)
+
+    def test_replicas_out_of_order(self):
+        self.config.strategy = "SSO"
+        self.config.database_regions = ["us", "eu"]
+        self.config.replication_lag = 5
+        self.config.random_seed = 1
+        netsys = server_single_simple.build_system(self.config)
+        database, replica = netsys.databases
+        env = netsys.env
+        # Version 2 is written at time 1, and version 3 at time 2, but the
+        # replica of version 2 arrives last.
+        env.run(until=1)
+        env.process(replica.send_replica(database, 0, 2, env.now))
+        env.run(until=2)
+        replica.apply_replica(0, 3, env.now)
+        database.apply_replica(0, 3, env.now)
+        env.run(until=10)
+        self.assertEqual(database.get_data(0), 3)
+        self.assertEqual(replica.get_data(0), 3)
+
+    def test_bad_latency_matrix(self):
+        self.config.region_latency = [[0, 0.1]]
+        with self.assertRaises(ValueError):
+            simulate(self.config)
+
+
+class TestLatencyDistributions(unittest.TestCase):
+    """Test latency distributions."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.rng = np.random.default_rng(0)
+
+    def test_unit_mean(self):
+        for spec in [
+                {"type": "normal", "cv": 0.1},
+                {"type": "lognormal", "sigma": 1},
+                {"type": "gamma", "shape": 2},
+                {"type": "empirical",
+                 "quantiles": [[0, 1], [0.5, 2], [0.99, 5], [1, 20]]}]:
+            distribution = latency.create_distribution(spec)
+            samples = distribution.sample_block(self.rng, 100000)
+            self.assertAlmostEqual(samples.mean(), 1, delta=0.02)
+
+    def test_heavy_tail(self):
+        normal = latency.create_distribution({"type": "normal"})
+        lognormal = latency.create_distribution(
+            {"type": "lognormal", "sigma": 0.5})
+        self.assertGreater(
+            np.quantile(lognormal.sample_block(self.rng, 10000), 0.99),
+            np.quantile(normal.sample_block(self.rng, 10000), 0.99))
+
+    def test_empirical_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "quantiles.csv")
+            with open(path, "w") as f:
+                f.write("0,2\n0.5,4\n1,6\n")
+            distribution = latency.create_distribution(
+                {"type": "empirical", "quantiles_file": path})
+        samples = distribution.sample_block(self.rng, 1000)
+        self.assertGreaterEqual(samples.min(), 0.5)
+        self.assertLessEqual(samples.max(), 1.5)
+
+    def test_bad_distributions(self):
+        for spec in [
+                {"type": "bad"},
+                {"type": "gamma", "shape": 0},
+                {"type": "empirical", "quantiles": [[0, 1]]},
+                {"type": "empirical", "quantiles": [[0, 2], [1, 1]]}]:
+            with self.assertRaises(ValueError):
+                latency.create_distribution(spec)
+
+    def test_buffered_samples(self):
+        self.config.latency_block_size = 10
+        model = latency.LatencyModel(self.config, self.rng)
+        for _ in range(25):
+            model.sample("frontend_worker")
+        self.assertEqual(len(model.buffers["frontend_worker"]), 5)
+
+    def test_link_distributions(self):
+        self.config.strategy = "SSO"
+        self.config.latency_distributions = {
+            "default": {"type": "normal", "cv": 0.1},
+            "worker_inference": {"type": "lognormal", "sigma": 1},
+        }
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 1080)
+        inference_times = [
+            msg.worker_return_time - msg.worker_receive_time
+            for msg in stats.final_messages if not msg.is_enroll]
+        # With sigma of 1, some inferences take over twice the mean.
+        self.assertGreater(max(inference_times), 1)
+
+
+class TestLatencySketches(unittest.TestCase):
+    """Test quantile sketches of latencies."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+
+    def test_relative_accuracy(self):
+        values = np.random.default_rng(0).lognormal(0, 1, 10000)
+        ddsketch = sketch.DDSketch(relative_accuracy=0.01)
+        for value in values:
+            ddsketch.add(value)
+        for q in [0, 0.5, 0.95, 0.99, 1]:
+            expected = np.quantile(values, q, method="lower")
+            self.assertAlmostEqual(
+                ddsketch.quantile(q), expected, delta=0.02 * expected)
+        self.assertEqual(ddsketch.count, 10000)
+        self.assertAlmostEqual(ddsketch.mean, values.mean())
+
+    def test_merge(self):
+        values = np.random.default_rng(0).exponential(1, 2000)
+        whole = sketch.DDSketch()
+        parts = [sketch.DDSketch(), sketch.DDSketch()]
+        for i, value in enumerate(values):
+            whole.add(value)
+            parts[i % 2].add(value)
+        merged = sketch.merge_sketches(
+            [{"e2e": parts[0]}, {"e2e": parts[1]}])["e2e"]
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assertEqual(merged.quantile(0.99), whole.quantile(0.99))
+        with self.assertRaises(ValueError):
+            merged.merge(sketch.DDSketch(relative_accuracy=0.05))
+
+    def test_bounded_buckets(self):
+        ddsketch = sketch.DDSketch(max_buckets=10)
+        for i in range(1, 1000):
+            ddsketch.add(float(i))
+        self.assertLessEqual(len(ddsketch.buckets), 10)
+        self.assertAlmostEqual(ddsketch.quantile(1), 999, delta=20)
+
+    def test_stats(self):
+        self.config.strategy = "SSO"
+        self.config.num_users = 10
+        stats = simulate(self.config)
+        self.assertEqual(
+            set(stats.latency_sketches.keys()),
+            {"e2e", "database", "worker", "enrollment_overhead"})
+        self.assertEqual(stats.latency_sketches["e2e"].count, 1080)
+        e2e = stats.latency_percentiles["e2e"]
+        self.assertLessEqual(e2e["p50"], e2e["p95"])
+        self.assertLessEqual(e2e["p95"], e2e["p99"])
+        self.assertLessEqual(e2e["p99"], stats.max_e2e_latency)
+        latencies = [
+            msg.client_return_time - msg.client_send_time
+            for msg in stats.final_messages]
+        self.assertAlmostEqual(
+            e2e["p99"], np.quantile(latencies, 0.99, method="lower"),
+            delta=0.02 * e2e["p99"])
+
+
+class TestTimeSeries(unittest.TestCase):
+    """Test time series of metrics."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.num_users = 10
+        self.config.metric_window = 600
+
+    def test_windows_SSO(self):
+        self.config.strategy = "SSO"
+        stats = simulate(self.config)
+        series = stats.time_series
+        self.assertEqual(len(series["window_start"]), 18)
+        np.testing.assert_array_equal(
+            series["window_start"], np.arange(18) * 600)
+        self.assertEqual(series["request_count"].sum(), 1080)
+        self.assertEqual(
+            series["forward_bounce_count"].sum(),
+            stats.forward_bounce_count)
+        self.assertEqual(
+            series["backward_bounce_count"].sum(),
+            stats.backward_bounce_count)
+        self.assertEqual(
+            series["enrollment_count"].sum(), stats.enrollment_count)
+        self.assertEqual(
+            series["num_worker_updates"].sum(), stats.num_worker_updates)
+        self.assertEqual(
+            len(stats.worker_update_times), stats.num_worker_updates)
+        self.assertTrue(np.all(series["p50_latency"] <= series["p99_latency"]))
+        self.assertAlmostEqual(
+            series["total_flops"].sum(),
+            sum(msg.total_flops for msg in stats.final_messages))
+
+    def test_partial_window(self):
+        self.config.strategy = "SD"
+        self.config.time_to_run = 1000
+        stats = simulate(self.config)
+        np.testing.assert_array_equal(
+            stats.time_series["window_start"], [0, 600])
+
+    def test_disabled(self):
+        self.config.strategy = "SSO"
+        self.config.metric_window = 0
+        stats = simulate(self.config)
+        self.assertEqual(stats.time_series, {})
+
+
+class TestTermination(unittest.TestCase):
+    """Test early termination of simulations."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.num_users = 10
+
+    def test_no_termination(self):
+        self.config.strategy = "SSO"
+        stats = simulate(self.config)
+        self.assertEqual(stats.stop_reason, "time_to_run")
+        self.assertEqual(stats.simulated_time, 10800)
+
+    def test_stop_after_requests(self):
+        self.config.strategy = "SSO-sync"
+        self.config.stop_after_requests = 100
+        stats = simulate(self.config)
+        self.assertEqual(stats.stop_reason, "stop_after_requests")
+        self.assertEqual(len(stats.final_messages), 100)
+        self.assertLess(stats.simulated_time, 1100)
+
+    def test_stop_settle_time(self):
+        self.config.strategy = "SD"
+        self.config.worker_update_mean_time = 60
+        self.config.stop_settle_time = 300
+        stats = simulate(self.config)
+        self.assertEqual(stats.stop_reason, "stop_settle_time")
+        self.assertEqual(stats.num_worker_updates, 10)
+        self.assertLess(stats.simulated_time, 10800)
+
+    def test_stop_stability(self):
+        self.config.strategy = "SSO"
+        self.config.stop_stability_tolerance = 0.05
+        self.config.stop_stability_metric = "p95"
+        stats = simulate(self.config)
+        self.assertEqual(stats.stop_reason, "stop_stability_tolerance")
+        self.assertLess(stats.simulated_time, 10800)
+
+    def test_warmup_with_profiling(self):
+        self.config.strategy = "SSO-mul"
+        self.config.warmup_time = 1000
+        self.config.stop_after_requests = 50
+        self.config.profile_simulation = True
+        stats = simulate(self.config)
+        self.assertEqual(len(stats.final_messages), 50)
+        self.assertEqual(stats.latency_sketches["e2e"].count, 50)
+        for msg in stats.final_messages:
+            self.assertGreaterEqual(msg.client_send_time, 1000)
+        self.assertAlmostEqual(
+            stats.profile.sim_time, stats.simulated_time)
+
+    def test_warmup_excludes_bounces(self):
+        self.config.strategy = "SSO"
+        self.config.random_seed = 1
+        baseline = simulate(self.config)
+        self.config.warmup_time = 3000
+        warm = simulate(self.config)
+        self.assertGreater(baseline.backward_bounce_count,
+                           warm.backward_bounce_count)
+        self.assertGreater(baseline.forward_bounce_count,
+                           warm.forward_bounce_count)
+        self.assertGreater(baseline.enrollment_count,
+                           warm.enrollment_count)
+        self.assertEqual(sum(warm.frontend_request_count.values()),
+                         len(warm.final_messages))
+
+        # Nothing is counted if all requests are sent during warm-up.
+        self.config.warmup_time = self.config.time_to_run
+        stats = simulate(self.config)
+        self.assertEqual(stats.backward_bounce_count, 0)
+        self.assertEqual(stats.forward_bounce_count, 0)
+        self.assertEqual(stats.enrollment_count, 0)
+        self.assertEqual(stats.frontend_request_count, {})
+        self.assertEqual(stats.workload, {})
+        self.assertGreater(stats.num_worker_updates, 0)
+
+
+class TestSpillMessages(unittest.TestCase):
+    """Test spilling final messages to disk."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.num_users = 10
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config.spill_messages_file = os.path.join(
+            self.tmp_dir.name, "messages.bin")
+        self.config.spill_chunk_size = 100
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_spill_SSO(self):
+        self.config.strategy = "SSO"
+        stats = simulate(self.config)
+        self.assertEqual(stats.final_messages, [])
+        self.assertEqual(
+            stats.final_messages_file, self.config.spill_messages_file)
+        self.assertEqual(stats.total_num_messages, 1080)
+        chunks = list(message_log.iter_message_chunks(
+            stats.final_messages_file))
+        self.assertEqual(
+            [len(chunk["msg_id"]) for chunk in chunks], [100] * 10 + [80])
+        messages = list(message_log.iter_messages(stats.final_messages_file))
+        self.assertEqual(len(messages), 1080)
+        self.assertIsNone(messages[0].audio_length)
+        self.assertTrue(messages[0].worker_name.startswith("worker-"))
+        self.assertAlmostEqual(
+            stats.average_e2e_latency,
+            np.mean([msg.client_return_time - msg.client_send_time
+                     for msg in messages]))
+
+    def test_same_stats(self):
+        self.config.strategy = "SD"
+        random.seed(0)
+        spilled = simulate(self.config)
+        self.config.spill_messages_file = ""
+        random.seed(0)
+        kept = simulate(self.config)
+        self.assertEqual(spilled.total_num_messages, kept.total_num_messages)
+        self.assertAlmostEqual(
+            spilled.average_e2e_latency, kept.average_e2e_latency)
+        self.assertEqual(spilled.max_total_flops, kept.max_total_flops)
+
+    def test_same_stats_with_queueing(self):
+        # Background enrollments respond after the requests they belong to.
+        self.config.strategy = "SD"
+        self.config.random_seed = 7
+        self.config.num_users = 50
+        self.config.client_request_interval = 0.5
+        self.config.worker_concurrency = 1
+        self.config.worker_scheduling = "strict"
+        self.config.num_cloud_workers = 3
+        self.config.time_to_run = 3600
+        self.config.worker_update_mean_time = 600
+        self.config.spill_chunk_size = 10
+        spilled = simulate(self.config)
+        self.config.spill_messages_file = ""
+        kept = simulate(self.config)
+        self.assertEqual(spilled.total_num_messages, kept.total_num_messages)
+        self.assertEqual(
+            spilled.average_total_flops, kept.average_total_flops)
+        self.assertEqual(spilled.max_total_flops, kept.max_total_flops)
+        np.testing.assert_array_equal(
+            spilled.time_series["total_flops"],
+            kept.time_series["total_flops"])
+        # The time series has the final flops of each response.
+        self.assertAlmostEqual(
+            spilled.time_series["total_flops"].sum()
+            / kept.average_total_flops,
+            kept.total_num_messages)
+
+    def test_bad_file(self):
+        path = os.path.join(self.tmp_dir.name, "bad.bin")
+        with open(path, "wb") as f:
+            f.write(b"not a message file")
+        with self.assertRaises(ValueError):
+            list(message_log.iter_message_chunks(path))
+
+
+class TestConfig(unittest.TestCase):
+    """Test compiling and validating the config."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+
+    def test_compile(self):
+        compiled = config.compile_config(self.config)
+        self.assertIsInstance(compiled, config.SimulationConfig)
+        self.assertIs(config.compile_config(compiled), compiled)
+        self.assertEqual(compiled.num_cloud_workers, 10)
+        self.assertEqual(compiled.regions, ("default",))
+        self.assertEqual(compiled.get("missing", 3), 3)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            compiled.num_users = 2
+        self.assertEqual(pickle.loads(pickle.dumps(compiled)), compiled)
+
+    def test_defaults(self):
+        compiled = config.compile_config({"strategy": "SD"})
+        self.assertEqual(compiled.warmup_time, 0)
+        self.assertEqual(compiled.frontend_balancer, "random")
+
+    def test_simulate_compiled(self):
+        self.config.strategy = "SSO-mul"
+        stats = simulate(config.compile_config(self.config))
+        self.assertIsInstance(stats.config, config.SimulationConfig)
+        self.assertEqual(len(stats.final_messages), 1080)
+
+    def test_extra(self):
+        self.config.extra = {"my_key": 5}
+        compiled = config.compile_config(self.config)
+        self.assertEqual(compiled.my_key, 5)
+        self.assertEqual(compiled.get("my_key"), 5)
+        with self.assertRaises(AttributeError):
+            compiled.other_key
+
+    def test_unknown_key(self):
+        self.config.num_worker = 3
+        with self.assertRaisesRegex(ValueError, "num_cloud_workers"):
+            simulate(self.config)
+
+    def test_wrong_type(self):
+        self.config.num_users = "10"
+        with self.assertRaises(TypeError):
+            simulate(self.config)
+        self.config.num_users = 10.5
+        with self.assertRaises(TypeError):
+            simulate(self.config)
+
+    def test_out_of_range(self):
+        self.config.client_request_interval = 0
+        with self.assertRaisesRegex(ValueError, "client_request_interval"):
+            simulate(self.config)
+
+    def test_bad_choice(self):
+        self.config.worker_routing = "nearest"
+        with self.assertRaisesRegex(ValueError, "worker_routing"):
+            simulate(self.config)
+
+    def test_strategy_requirements(self):
+        self.config.strategy = "SSO-sync"
+        self.config.version_query_interval = 0
+        with self.assertRaisesRegex(ValueError, "version_query_interval"):
+            simulate(self.config)
+        self.config.strategy = "SSO"
+        self.assertEqual(
+            config.compile_config(self.config).version_query_interval, 0)
+
+    def test_replay_requires_file(self):
+        self.config.arrival_process = "replay"
+        with self.assertRaisesRegex(ValueError, "request_log_file"):
+            simulate(self.config)
+
+
+class TestCapacityPlanner(unittest.TestCase):
+    """Test planning the worker count for an SLO."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.time_to_run = 120
+        self.config.client_request_interval = 0.1
+        self.config.num_users = 100
+        self.config.worker_concurrency = 1
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_worker_concurrency(self):
+        self.config.num_cloud_workers = 2
+        stats = simulate(self.config)
+        self.assertGreater(
+            stats.latency_sketches["worker_queue"].quantile(0.5), 1)
+        self.config.worker_concurrency = 0
+        stats = simulate(self.config)
+        self.assertNotIn("worker_queue", stats.latency_sketches)
+        self.assertLess(stats.latency_percentiles["e2e"]["p50"], 2)
+
+    def test_plan(self):
+        slo = planner.SLO(max_latency=3)
+        cache_file = os.path.join(self.tmp_dir.name, "cache.pickle")
+        plan = planner.plan_capacity(
+            self.config, slo, 1, 16, replicates=2, processes=2,
+            cache_file=cache_file)
+        self.assertTrue(plan.feasible)
+        self.assertGreater(plan.min_workers, 5)
+        self.assertLessEqual(plan.lower_bound, plan.min_workers)
+        if plan.upper_bound is not None:
+            self.assertGreaterEqual(plan.upper_bound, plan.min_workers)
+        self.assertTrue(plan.probes[plan.min_workers].meets(
+            slo.get_limits()))
+        if plan.min_workers - 1 in plan.probes:
+            self.assertFalse(plan.probes[plan.min_workers - 1].meets(
+                slo.get_limits()))
+        self.assertEqual(plan.num_simulations, 2 * len(plan.probes))
+
+        # Rerun with the cache.
+        cached = planner.plan_capacity(
+            self.config, slo, 1, 16, replicates=2, cache_file=cache_file)
+        self.assertEqual(cached.num_simulations, 0)
+        self.assertEqual(cached.min_workers, plan.min_workers)
+
+    def test_replicates_with_random_seed(self):
+        # Replicates differ even if the config sets a random seed.
+        self.config.random_seed = 7
+        self.config.num_cloud_workers = 4
+        probe = planner.CapacityPlanner(
+            self.config, planner.SLO(max_latency=3), replicates=3).probe(4)
+        self.assertEqual(len(set(probe.metrics["latency"])), 3)
+        self.assertGreater(probe.half_widths["latency"], 0)
+        knob = optimizer.Knob("client_request_interval", 0.1, 1)
+        evaluations = optimizer.Optimizer(
+            self.config, [knob], optimizer.Objective(), num_candidates=2,
+            replicates=3).evaluate([(0.5,)], 3)
+        self.assertEqual(len(set(evaluations[0].values)), 3)
+
+    def test_infeasible(self):
+        plan = planner.plan_capacity(
+            self.config, planner.SLO(max_latency=0.1), 1, 4, replicates=1)
+        self.assertFalse(plan.feasible)
+        self.assertIsNone(plan.min_workers)
+        self.assertEqual(list(plan.probes), [4])
+
+    def test_bisect(self):
+        self.assertEqual(planner.bisect(lambda x: x >= 7, 1, 100), 7)
+        self.assertEqual(planner.bisect(lambda x: x >= 7, 1, 7), 7)
+        self.assertEqual(planner.bisect(lambda x: True, 3, 100), 3)
+        self.assertIsNone(planner.bisect(lambda x: x >= 7, 1, 6))
+
+    def test_bad_slo(self):
+        with self.assertRaises(ValueError):
+            planner.CapacityPlanner(self.config, planner.SLO())
+        with self.assertRaises(ValueError):
+            planner.CapacityPlanner(
+                self.config, planner.SLO(max_latency=1),
+                key="client_request_interval")
+
+
+class TestOptimizer(unittest.TestCase):
+    """Test optimizing config knobs."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.strategy = "SSO-sync"
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.time_to_run = 600
+        self.config.num_users = 10
+        self.config.worker_update_mean_time = 300
+
+    def test_optimize(self):
+        knob = optimizer.Knob("version_query_interval", 1, 1000)
+        result = optimizer.optimize(
+            self.config, [knob], optimizer.Objective(query_weight=0.1),
+            num_candidates=4, rounds=2, replicates=1, processes=2)
+        interval = result.best["version_query_interval"]
+        self.assertGreater(interval, 1)
+        self.assertLessEqual(interval, 1000)
+        # The first round has 1 replicate and the second has 2.
+        self.assertEqual(len(result.best_evaluation.values), 2)
+        self.assertLess(result.num_simulations, 4 + 4 * 2)
+        self.assertEqual(
+            result.best_evaluation.mean,
+            min(x.mean for x in result.evaluations
+                if len(x.values) == 2))
+
+    def test_query_cost(self):
+        knob = optimizer.Knob("version_query_interval", 1, 1000)
+        cheap = optimizer.optimize(
+            self.config, [knob], optimizer.Objective(query_weight=0),
+            num_candidates=4, rounds=1, replicates=1)
+        costly = optimizer.optimize(
+            self.config, [knob], optimizer.Objective(query_weight=10),
+            num_candidates=4, rounds=1, replicates=1)
+        self.assertLessEqual(
+            cheap.best["version_query_interval"],
+            costly.best["version_query_interval"])
+
+    def test_integer_knob(self):
+        knob = optimizer.Knob("num_cloud_workers", 2, 20)
+        result = optimizer.optimize(
+            self.config, [knob], num_candidates=3, rounds=1, replicates=1)
+        for evaluation in result.evaluations:
+            self.assertIsInstance(evaluation.params["num_cloud_workers"], int)
+
+    def test_knob(self):
+        self.assertEqual(optimizer.Knob("x", 1, 100).from_unit(0.5), 10)
+        self.assertEqual(
+            optimizer.Knob("x", 0, 100, log_scale=False).from_unit(0.5), 50)
+        with self.assertRaises(ValueError):
+            optimizer.Knob("x", 0, 100)
+        with self.assertRaises(ValueError):
+            optimizer.optimize(self.config, [optimizer.Knob("bad", 1, 2)])
+
+    def test_latin_hypercube(self):
+        points = optimizer.latin_hypercube(4, 2, random.Random(0))
+        for dim in range(2):
+            self.assertEqual(
+                sorted(point[dim] for point in points),
+                [0.125, 0.375, 0.625, 0.875])
+
+
+class TestCommonRandomNumbers(unittest.TestCase):
+    """Test synchronized random streams and paired comparisons."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.num_users = 10
+        self.config.time_to_run = 1800
+        self.config.worker_update_mean_time = 600
+        self.config.random_seed = 1
+
+    def test_reproducible(self):
+        self.config.strategy = "SSO-sync"
+        random.seed(1)
+        first = simulate(self.config)
+        random.seed(2)
+        second = simulate(self.config)
+        self.assertEqual(first.average_e2e_latency, second.average_e2e_latency)
+        self.assertEqual(
+            [msg.msg_id for msg in first.final_messages],
+            [msg.msg_id for msg in second.final_messages])
+
+    def test_synchronized_across_strategies(self):
+        self.config.arrival_process = "poisson"
+        self.config.strategy = "SSO"
+        simple = simulate(self.config)
+        self.config.strategy = "SD"
+        double = simulate(self.config)
+        self.assertEqual(
+            simple.worker_update_times, double.worker_update_times)
+        self.assertEqual(
+            sorted(msg.client_send_time for msg in simple.final_messages),
+            sorted(msg.client_send_time for msg in double.final_messages))
+
+    def test_streams(self):
+        streams = random_streams.RandomStreams(3)
+        self.assertIs(streams.get_python("a"), streams.get_python("a"))
+        self.assertNotEqual(
+            streams.get_python("a").random(),
+            streams.get_python("b").random())
+        self.assertEqual(
+            streams.get_numpy("c").random(),
+            random_streams.RandomStreams(3).get_numpy("c").random())
+        self.assertIs(random_streams.UNSEEDED.get_python("a"), random)
+
+    def test_compare_strategies(self):
+        report = comparison.compare_strategies(
+            self.config, ["SSO", "SSO-sync"], replicates=5, processes=2)
+        self.assertEqual(report.baseline, "SSO")
+        self.assertEqual(report.num_simulations, 10)
+        self.assertEqual(
+            len(report.differences), len(comparison.METRICS))
+        differences = {x.metric: x for x in report.differences}
+        latency_diff = differences["mean_latency"]
+        self.assertAlmostEqual(
+            latency_diff.mean,
+            np.mean(report.metrics["SSO-sync"]["mean_latency"])
+            - np.mean(report.metrics["SSO"]["mean_latency"]))
+        # SSO-sync avoids most backward bounces of SSO.
+        self.assertLess(differences["backward_bounce_rate"].mean, 0)
+        # Paired differences are more precise than independent runs.
+        self.assertLess(
+            latency_diff.half_width, latency_diff.unpaired_half_width)
+        self.assertGreater(latency_diff.variance_reduction, 1)
+        self.assertEqual(len(report.format()), 1 + len(comparison.METRICS))
+
+    def test_independent(self):
+        report = comparison.compare_strategies(
+            self.config, ["SSO", "SSO-sync"], replicates=2,
+            common_random_numbers=False)
+        self.assertEqual(report.num_simulations, 4)
+
+
+class TestVersionPropagation(unittest.TestCase):
+    """Test push and piggyback version propagation of SSO-sync."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.strategy = "SSO-sync"
+        self.config.num_cloud_workers = 50
+        self.config.random_seed = 1
+
+    def simulate(self, modes):
+        self.config.version_propagation = modes
+        return server_single_sync.simulate(self.config)
+
+    def test_poll(self):
+        stats = self.simulate(["poll"])
+        # 17 rounds of queries and responses to 50 workers.
+        self.assertEqual(sum(stats.version_query_count.values()), 1700)
+        self.assertEqual(stats.version_push_count, {})
+        self.assertEqual(stats.version_piggyback_count, {})
+        self.assertGreater(
+            stats.latency_sketches["version_staleness"].mean, 60)
+
+    def test_push(self):
+        stats = self.simulate(["push"])
+        self.assertEqual(stats.version_query_count, {})
+        # One notification to the only frontend per update.
+        self.assertEqual(
+            sum(stats.version_push_count.values()), stats.num_worker_updates)
+        self.assertEqual(sum(stats.stale_version_lookup_count.values()), 0)
+        # Only the network latency.
+        self.assertLess(
+            stats.latency_sketches["version_staleness"].mean, 1)
+
+    def test_piggyback(self):
+        stats = self.simulate(["piggyback"])
+        self.assertEqual(stats.version_query_count, {})
+        self.assertEqual(stats.version_push_count, {})
+        # Every response refreshes the table.
+        self.assertGreaterEqual(
+            sum(stats.version_piggyback_count.values()),
+            len(stats.final_messages))
+        self.assertIn("version_staleness", stats.latency_sketches)
+
+    def test_push_with_multiple_frontends(self):
+        self.config.num_frontends = 3
+        stats = self.simulate(["push", "piggyback"])
+        for i in range(3):
+            self.assertEqual(
+                stats.version_push_count[f"frontend-{i}"],
+                stats.num_worker_updates)
+        self.assertEqual(planner.run_replicate(self.config, 0, 99)[
+            "query_rate"], 3 * stats.num_worker_updates / 10800)
+
+    def test_push_with_local_routing(self):
+        self.config.regions = ["a", "b"]
+        self.config.num_frontends = 2
+        self.config.worker_routing = "local"
+        self.config.version_propagation = ["push"]
+        netsys = server_single_sync.build_system(self.config)
+        stats = netsys.simulate()
+        # Each worker only notifies the frontend of its region.
+        self.assertEqual(
+            sum(stats.version_push_count.values()), stats.num_worker_updates)
+        self.assertEqual(sum(stats.stale_version_lookup_count.values()), 0)
+        for frontend in netsys.frontends:
+            self.assertEqual(len(frontend.worker_version_table), 25)
+
+    def test_invalid_modes(self):
+        for modes in [[], ["poll", "poll"], ["gossip"]]:
+            self.config.version_propagation = modes
+            with self.assertRaisesRegex(ValueError, "version_propagation"):
+                config.compile_config(self.config)
+        # No query interval is needed without polling.
+        self.config.version_propagation = ["push"]
+        self.config.version_query_interval = 0
+        config.compile_config(self.config)
+
+
+class TestHedging(unittest.TestCase):
+    """Test hedged and timeout-retried worker requests."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.random_seed = 3
+        self.config.worker_concurrency = 1
+        self.config.client_request_interval = 0.1
+        self.config.time_to_run = 300
+
+    def assert_unique_responses(self, stats):
+        msg_ids = [msg.msg_id for msg in stats.final_messages]
+        self.assertEqual(len(msg_ids), len(set(msg_ids)))
+
+    def test_disabled(self):
+        netsys = simulator.build_system(self.config)
+        self.assertIsNone(netsys.frontends[0].hedger)
+        stats = netsys.simulate()
+        self.assertEqual(stats.hedge_count, 0)
+        self.assertEqual(stats.duplicate_flops, 0)
+
+    def test_hedge_delay(self):
+        for strategy in ["SSO", "SD"]:
+            self.config.strategy = strategy
+            self.config.hedge_delay = 0
+            baseline = simulator.simulate(self.config)
+            self.config.hedge_delay = 0.6
+            stats = simulator.simulate(self.config)
+            self.assertGreater(stats.hedge_count, 0)
+            self.assertEqual(stats.retry_count, 0)
+            self.assertLessEqual(
+                stats.duplicate_win_count, stats.hedge_count)
+            self.assertGreater(stats.cancelled_attempt_count, 0)
+            self.assertGreater(stats.duplicate_flops, 0)
+            self.assertIn("hedge_saved", stats.latency_sketches)
+            self.assert_unique_responses(stats)
+            self.assertLess(
+                stats.max_e2e_latency, baseline.max_e2e_latency)
+
+    def test_hedge_percentile(self):
+        self.config.strategy = "SSO"
+        self.config.hedge_percentile = 95
+        stats = simulator.simulate(self.config)
+        self.assertGreater(stats.hedge_count, 0)
+        # Hedges roughly the slowest 5% of requests.
+        self.assertLess(
+            stats.hedge_count, 0.2 * len(stats.final_messages))
+        self.assert_unique_responses(stats)
+
+    def test_timeout_retries(self):
+        self.config.strategy = "SSO"
+        self.config.worker_request_timeout = 1.0
+        self.config.worker_request_retries = 0
+        stats = simulator.simulate(self.config)
+        self.assertEqual(stats.retry_count, 0)
+        self.config.worker_request_retries = 2
+        stats = simulator.simulate(self.config)
+        self.assertGreater(stats.retry_count, 0)
+        self.assertEqual(stats.hedge_count, 0)
+        self.assert_unique_responses(stats)
+
+    def test_duplicates_serve_same_version(self):
+        self.config.strategy = "SSO"
+        self.config.hedge_delay = 0.6
+        self.config.worker_update_mean_time = 100
+        netsys = simulator.build_system(self.config)
+        workers = {worker.name: worker for worker in netsys.workers}
+        served = []
+        original = common.BaseWorker.send_to_frontend
+
+        def send_to_frontend(worker, msg):
+            if msg.attempt > 0:
+                served.append(worker.can_serve(msg))
+            yield from original(worker, msg)
+
+        for worker in workers.values():
+            worker.send_to_frontend = send_to_frontend.__get__(worker)
+        netsys.simulate()
+        self.assertGreater(len(served), 0)
+        self.assertGreater(sum(served), 0.9 * len(served))
+
+    def test_can_serve(self):
+        msg = common.Message(profile_version=2)
+        env = simpy.Environment()
+        stats = common.GlobalStats()
+        worker = server_single_simple.SingleVersionWorker(
+            env, "worker", self.config, stats)
+        worker.set_model_version(2)
+        self.assertTrue(worker.can_serve(msg))
+        worker.set_model_version(3)
+        self.assertFalse(worker.can_serve(msg))
+        worker = server_double.DoubleVersionWorker(
+            env, "worker", self.config, stats)
+        worker.set_model_versions([2, 3])
+        self.assertTrue(worker.can_serve(
+            common.Message(profile_versions=[1, 2])))
+        self.assertFalse(worker.can_serve(
+            common.Message(profile_versions=[1])))
+
+    def test_invalid_percentile(self):
+        self.config.hedge_percentile = 101
+        with self.assertRaisesRegex(ValueError, "hedge_percentile"):
+            config.compile_config(self.config)
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """Test admission control and bounded worker queues in overload."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.random_seed = 3
+        self.config.worker_concurrency = 1
+        self.config.client_request_interval = 0.08
+        self.config.time_to_run = 300
+        self.config.worker_update_mean_time = 300
+
+    def test_token_bucket(self):
+        bucket = admission.TokenBucket(rate=2, burst=3)
+        self.assertEqual([bucket.take(0) for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+        # Refills up to the burst size.
+        self.assertEqual([bucket.take(100) for _ in range(4)],
+                         [True, True, True, False])
+
+    def test_admission_token_bucket(self):
+        self.config.admission_control = "token_bucket"
+        self.config.admission_rate = 4
+        self.config.admission_burst = 20
+        stats = simulator.simulate(self.config)
+        num_rejected = stats.rejected_count["admission"]
+        self.assertGreater(num_rejected, 0)
+        # Except those still on the way to the client at the end.
+        self.assertAlmostEqual(
+            stats.latency_sketches["rejection"].count, num_rejected,
+            delta=5)
+        self.assertLessEqual(len(stats.final_messages), 4 * 300 + 20)
+        for msg in stats.final_messages:
+            self.assertFalse(msg.rejected)
+
+    def test_admission_concurrency(self):
+        baseline = simulator.simulate(self.config)
+        self.assertEqual(baseline.rejected_count, {})
+        self.config.admission_control = "concurrency"
+        self.config.admission_concurrency = 20
+        netsys = simulator.build_system(self.config)
+        controller = netsys.frontends[0].admission
+        max_inflight = 0
+        original = controller.admit
+
+        def admit(msg):
+            nonlocal max_inflight
+            admitted = original(msg)
+            max_inflight = max(max_inflight, len(controller.inflight))
+            return admitted
+
+        controller.admit = admit
+        stats = netsys.simulate()
+        self.assertEqual(max_inflight, 20)
+        self.assertGreater(stats.rejected_count["admission"], 0)
+        self.assertLess(stats.max_e2e_latency, baseline.max_e2e_latency)
+
+    def test_worker_queue_capacity(self):
+        for strategy in ["SSO", "SD"]:
+            self.config.strategy = strategy
+            self.config.worker_queue_capacity = 2
+            stats = simulator.simulate(self.config)
+            self.assertGreater(stats.rejected_count["worker_queue"], 0)
+            self.assertNotIn("admission", stats.rejected_count)
+            self.assertGreater(
+                planner.run_replicate(self.config, 0, 99)[
+                    "rejection_rate"], 0)
+
+    def test_worker_queue_requires_concurrency(self):
+        self.config.worker_queue_capacity = 2
+        self.config.worker_concurrency = 0
+        with self.assertRaisesRegex(ValueError, "worker_concurrency"):
+            config.compile_config(self.config)
+
+
+class TestWorkerScheduling(unittest.TestCase):
+    """Test scheduling of verification and enrollment on workers."""
+
+    def setUp(self):
+        with open("example_config.yml", "r") as f:
+            self.config = munch.Munch.fromDict(yaml.safe_load(f))
+        self.config.log_verbosity = 0
+        self.config.print_stats = False
+        self.config.random_seed = 3
+        self.config.worker_concurrency = 1
+        self.config.client_request_interval = 0.06
+        self.config.time_to_run = 300
+        self.config.worker_update_mean_time = 200
+        self.config.num_users = 300
+        self.config.user_distribution = "uniform"
+
+    def get_order(self, policy, arrivals):
+        """Order of requests granted by a scheduler with one slot.
+
+        Args:
+            policy: config.worker_scheduling
+            arrivals: (time, is_enroll) of each request, while the slot is
+                busy until all have arrived
+        """
+        env = simpy.Environment()
+        self.config.worker_scheduling = policy
+        scheduler = scheduling.WorkerScheduler(env, self.config, 1)
+        order = []
+
+        def run(index, arrival_time, is_enroll):
+            yield env.timeout(arrival_time)
+            yield scheduler.request(common.Message(is_enroll=is_enroll))
+            order.append(index)
+            yield env.timeout(1)
+            scheduler.release()
+
+        for index, (arrival_time, is_enroll) in enumerate(arrivals):
+            env.process(run(index, arrival_time, is_enroll))
+        env.run()
+        return order
+
+    def test_policies(self):
+        # Request 0 takes the slot, the others wait.
+        arrivals = [(0, False), (0.1, True), (0.2, True), (0.3, False),
+                    (0.4, False), (0.5, False), (0.6, False)]
+        self.assertEqual(
+            self.get_order("fifo", arrivals), [0, 1, 2, 3, 4, 5, 6])
+        self.assertEqual(
+            self.get_order("strict", arrivals), [0, 3, 4, 5, 6, 1, 2])
+        # Weights of 4 to 1.
+        self.assertEqual(
+            self.get_order("weighted_fair", arrivals), [0, 1, 3, 4, 5, 6, 2])
+        # Deadlines of 1 and 30 seconds.
+        self.assertEqual(
+            self.get_order("deadline", arrivals), [0, 3, 4, 5, 6, 1, 2])
+        self.config.worker_class_deadlines = {
+            "verification": 1, "enrollment": 1}
+        self.assertEqual(
+            self.get_order("deadline", arrivals), [0, 1, 2, 3, 4, 5, 6])
+
+    def test_strict_priority_SD(self):
+        self.config.strategy = "SD"
+        fifo = simulator.simulate(self.config)
+        self.config.worker_scheduling = "strict"
+        strict = simulator.simulate(self.config)
+        for stats in [fifo, strict]:
+            self.assertEqual(
+                stats.latency_sketches["worker_queue"].count,
+                stats.latency_sketches["worker_queue/verification"].count
+                + stats.latency_sketches["worker_queue/enrollment"].count)
+        self.assertLess(
+            strict.latency_sketches["worker_queue/verification"].max,
+            fifo.latency_sketches["worker_queue/verification"].max)
+        self.assertGreater(
+            strict.latency_sketches["worker_queue/enrollment"].max,
+            fifo.latency_sketches["worker_queue/enrollment"].max)
+        self.assertLess(strict.max_e2e_latency, fifo.max_e2e_latency)
+        self.assertGreater(strict.starvation_count["enrollment"], 0)
+
+    def test_invalid_class_weights(self):
+        self.config.worker_class_weights = {"verification": 1}
+        with self.assertRaisesRegex(ValueError, "worker_class_weights"):
+            config.compile_config(self.config)
+        self.config.worker_class_weights = {
+            "verification": 1, "enrollment": 0}
+        with self.assertRaisesRegex(ValueError, "worker_class_weights"):
+            config.compile_config(self.config)
+
+
 if __name__ == "__main__":
     unittest.main()
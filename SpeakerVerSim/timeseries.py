@@ -0,0 +1,94 @@
+"""Time series of metrics over windows of simulated time.
+
+Simulated time is split into windows of config.metric_window seconds. For
+each window, the metrics of the responses received by the client in that
+window are recorded, as well as the counts of events that happened in that
+window. The flops of a response are recorded in the window where they are
+final, which is later if a frontend still adds flops of a background
+enrollment, see SimpleClient. Memory grows with the number of windows, not
+with the number of requests.
+"""
+from typing import Any, Generator
+import numpy as np
+import simpy
+
+from SpeakerVerSim import sketch
+
+# Counters of GlobalStats recorded for each window.
+COUNTERS = [
+    "forward_bounce_count",
+    "backward_bounce_count",
+    "enrollment_count",
+    "num_worker_updates",
+]
+INTEGER_COLUMNS = set(COUNTERS + ["request_count"])
+
+
+class WindowedMetrics:
+    """Records metrics of each window of simulated time.
+
+    stats is the GlobalStats of the simulation.
+    """
+
+    def __init__(self, env: simpy.Environment, stats: Any):
+        self.env = env
+        self.stats = stats
+        config = stats.config
+        self.width = config.metric_window
+        self.percentiles = config.reported_percentiles
+        self.relative_accuracy = config.sketch_relative_accuracy
+        self.columns: dict[str, list] = {"window_start": []}
+        self.columns["request_count"] = []
+        self.columns["average_latency"] = []
+        for percentile in self.percentiles:
+            self.columns[f"p{percentile:g}_latency"] = []
+        self.columns["total_flops"] = []
+        for counter in COUNTERS:
+            self.columns[counter] = []
+        self.start_window(0.0)
+
+    def start_window(self, start_time: float) -> None:
+        self.window_start = start_time
+        self.latency_sketch = sketch.DDSketch(self.relative_accuracy)
+        self.total_flops = 0.0
+        self.counter_values = [
+            getattr(self.stats, counter) for counter in COUNTERS]
+
+    def add_response(self, latency: float) -> None:
+        """Record a final response received in the current window."""
+        self.latency_sketch.add(latency)
+
+    def add_flops(self, flops: float) -> None:
+        """Record the final flops of a response."""
+        self.total_flops += flops
+
+    def close_window(self) -> None:
+        """Append the metrics of the current window, and start the next."""
+        columns = self.columns
+        columns["window_start"].append(self.window_start)
+        columns["request_count"].append(self.latency_sketch.count)
+        columns["average_latency"].append(self.latency_sketch.mean)
+        for percentile in self.percentiles:
+            columns[f"p{percentile:g}_latency"].append(
+                self.latency_sketch.quantile(percentile / 100))
+        columns["total_flops"].append(self.total_flops)
+        for counter, start_value in zip(COUNTERS, self.counter_values):
+            columns[counter].append(
+                getattr(self.stats, counter) - start_value)
+        self.start_window(self.env.now)
+
+    def run(self) -> Generator:
+        """Close a window every self.width seconds."""
+        while True:
+            yield self.env.timeout(
+                self.window_start + self.width - self.env.now)
+            self.close_window()
+
+    def finish(self) -> dict[str, np.ndarray]:
+        """Close the last partial window, and convert columns to arrays."""
+        if self.env.now > self.window_start:
+            self.close_window()
+        return {
+            name: np.array(values, dtype=(
+                np.int64 if name in INTEGER_COLUMNS else np.float64))
+            for name, values in self.columns.items()}
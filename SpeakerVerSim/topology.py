@@ -0,0 +1,67 @@
+"""Multi-region topology.
+
+Actors are assigned to regions, and every hop between two regions adds the
+latency in config.region_latency, a matrix of seconds indexed by the source
+and destination regions. Users are assigned to regions by user_id modulo
+the number of regions.
+
+Routing is controlled by config.frontend_routing and config.worker_routing:
+    global: route to any frontend or worker
+    local: only route to frontends or workers in the same region, unless
+        there is none
+"""
+import munch
+
+
+class RegionTopology:
+    """Regions of all actors, and latencies between regions."""
+
+    def __init__(self, config: munch.Munch):
+        self.config = config
+        self.regions = list(config.regions or ["default"])
+        num_regions = len(self.regions)
+        matrix = config.region_latency or [
+            [0] * num_regions for _ in range(num_regions)]
+        if len(matrix) != num_regions or any(
+                len(row) != num_regions for row in matrix):
+            raise ValueError(
+                f"region_latency must be a {num_regions}x{num_regions} "
+                "matrix.")
+        self.latency = [[float(x) for x in row] for row in matrix]
+        if any(x < 0 for row in self.latency for x in row):
+            raise ValueError("region_latency must be non-negative.")
+        for key in ["frontend_routing", "worker_routing"]:
+            routing = getattr(config, key)
+            if routing not in {"global", "local"}:
+                raise ValueError(f"Unsupported {key}: {routing}")
+
+    @property
+    def num_regions(self) -> int:
+        return len(self.regions)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether there is more than one region."""
+        return self.num_regions > 1
+
+    def get_region(self, kind: str, index: int) -> int:
+        """Get the region of the index-th actor of a kind.
+
+        Regions are taken from config.<kind>_regions if set, as a list of
+        region names; otherwise actors are spread over regions round-robin.
+        """
+        names = getattr(self.config, f"{kind}_regions")
+        if not names:
+            return index % self.num_regions
+        name = names[index % len(names)]
+        if name not in self.regions:
+            raise ValueError(f"Unknown region in {kind}_regions: {name}")
+        return self.regions.index(name)
+
+    def get_user_region(self, user_id: int) -> int:
+        return user_id % self.num_regions
+
+    def get_local(self, actors: list, region: int) -> list:
+        """Actors in a region, or all actors if there is none."""
+        local = [actor for actor in actors if actor.region == region]
+        return local or actors
@@ -0,0 +1,166 @@
+"""Structured event tracing of actors.
+
+Actors emit compact events (timestamp, actor id, event code, msg_id) into
+a ring buffer, which can optionally be flushed to a binary file. Events
+are only rendered as text on demand.
+"""
+import enum
+import json
+import struct
+from typing import Iterator
+import numpy as np
+
+
+class EventCode(enum.IntEnum):
+    """Codes of all traced events."""
+    SEND_REQUEST = 1
+    SEND_RESPONSE = 2
+    RECEIVE_RESPONSE = 3
+    FETCH_DATABASE = 4
+    UPDATE_DATABASE = 5
+    HANDLE_REQUEST = 6
+    RUN_INFERENCE = 7
+    COMPLETE_REQUEST = 8
+    UPDATE_MODEL_VERSION = 9
+
+
+# Text of each event, same as the old log format.
+EVENT_TEXTS = {
+    EventCode.SEND_REQUEST: "send request",
+    EventCode.SEND_RESPONSE: "send response",
+    EventCode.RECEIVE_RESPONSE: "receive response",
+    EventCode.FETCH_DATABASE: "fetch database",
+    EventCode.UPDATE_DATABASE: "update database",
+    EventCode.HANDLE_REQUEST: "handle request",
+    EventCode.RUN_INFERENCE: "run inference",
+    EventCode.COMPLETE_REQUEST: "complete request",
+    EventCode.UPDATE_MODEL_VERSION: "update model version",
+}
+
+# Trace levels. Larger is more verbose.
+#   0: disabled
+#   1: model version updates
+#   2: every hop of every message
+TRACE_OFF = 0
+TRACE_VERSION = 1
+TRACE_HOP = 2
+
+# Binary layout of one event.
+EVENT_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("actor_id", "<i4"),
+    ("code", "<i2"),
+    ("msg_id", "<i8"),
+])
+
+# Magic bytes at the beginning of a trace file.
+TRACE_FILE_MAGIC = b"SVSTRACE"
+
+
+class Tracer:
+    """A ring buffer of events shared by all actors of a simulation.
+
+    If trace_file is set, the buffer is flushed to the file every time it
+    is full, such that the file contains all events.
+    """
+
+    def __init__(self, capacity: int, trace_file: str = ""):
+        if capacity <= 0:
+            raise ValueError("Tracer capacity must be positive.")
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.actor_names: list[str] = []
+        self.trace_file = trace_file
+
+        # Total number of emitted events.
+        self.size = 0
+
+        # Total number of events written to trace_file.
+        self.num_flushed = 0
+
+        self.file = None
+
+    def register_actor(self, name: str) -> int:
+        """Register an actor and return its id."""
+        self.actor_names.append(name)
+        return len(self.actor_names) - 1
+
+    def emit(
+            self,
+            time: float,
+            actor_id: int,
+            code: EventCode,
+            msg_id: int) -> None:
+        """Record one event."""
+        index = self.size % self.capacity
+        self.buffer[index] = (time, actor_id, code, msg_id)
+        self.size += 1
+        if self.trace_file and index == self.capacity - 1:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write events that have not been written yet to trace_file."""
+        if not self.trace_file:
+            return
+        if self.file is None:
+            self.file = open(self.trace_file, "wb")
+            header = json.dumps(
+                {"actor_names": self.actor_names}).encode("utf-8")
+            self.file.write(TRACE_FILE_MAGIC)
+            self.file.write(struct.pack("<Q", len(header)))
+            self.file.write(header)
+        start = self.num_flushed % self.capacity
+        end = (self.size - 1) % self.capacity + 1
+        if self.size > self.num_flushed:
+            self.file.write(self.buffer[start:end].tobytes())
+        self.num_flushed = self.size
+
+    def close(self) -> None:
+        """Flush remaining events and close trace_file."""
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def events(self) -> np.ndarray:
+        """Return the events still in the buffer, in chronological order."""
+        if self.size <= self.capacity:
+            return self.buffer[:self.size].copy()
+        index = self.size % self.capacity
+        return np.concatenate((self.buffer[index:], self.buffer[:index]))
+
+
+def read_trace_file(trace_file: str) -> tuple[np.ndarray, list[str]]:
+    """Read a trace file written by Tracer.
+
+    The events are memory-mapped, so large files are not loaded into RAM.
+
+    Returns:
+        events and actor names
+    """
+    with open(trace_file, "rb") as f:
+        if f.read(len(TRACE_FILE_MAGIC)) != TRACE_FILE_MAGIC:
+            raise ValueError(f"Not a trace file: {trace_file}")
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+        offset = f.tell()
+        f.seek(0, 2)
+        num_events = (f.tell() - offset) // EVENT_DTYPE.itemsize
+    if num_events == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE), header["actor_names"]
+    events = np.memmap(
+        trace_file, dtype=EVENT_DTYPE, mode="r", offset=offset,
+        shape=(num_events,))
+    return events, header["actor_names"]
+
+
+def format_trace(
+        events: np.ndarray,
+        actor_names: list[str],
+        with_msg_id: bool = False) -> Iterator[str]:
+    """Render events in the text format of Actor.log."""
+    for time, actor_id, code, msg_id in events:
+        line = f"[{time:.5f}] [{actor_names[actor_id]}] {EVENT_TEXTS[code]}"
+        if with_msg_id:
+            line += f" (msg_id={msg_id})"
+        yield line
@@ -0,0 +1,66 @@
+"""Script to benchmark the in-flight state of SD over a long horizon.
+
+The size of the in-flight enrollment bookkeeping of the frontend should
+stay flat instead of growing with the re-enrollment volume.
+"""
+import argparse
+import sys
+import time
+from typing import Generator
+import yaml
+import munch
+
+from SpeakerVerSim import server_double
+from SpeakerVerSim.common import NetworkSystem
+
+
+def monitor(
+        netsys: NetworkSystem,
+        interval: float,
+        samples: list) -> Generator:
+    """Periodically record the size of the in-flight state."""
+    frontend = netsys.frontend
+    while True:
+        yield netsys.env.timeout(interval)
+        samples.append((
+            netsys.env.now,
+            len(frontend.id_to_msg),
+            sys.getsizeof(frontend.id_to_msg),
+            len(frontend.inflight_enrollments)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="benchmark_sd_memory",
+        description="Benchmark in-flight state of SD over a long horizon.")
+    parser.add_argument("-c", "--config", default="example_config.yml")
+    parser.add_argument("--hours", type=float, default=12)
+    parser.add_argument("--num_users", type=int, default=1000)
+    parser.add_argument("--request_interval", type=float, default=1)
+    parser.add_argument("--num_samples", type=int, default=12)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = munch.Munch.fromDict(yaml.safe_load(f))
+    config.strategy = "SD"
+    config.log_verbosity = 0
+    config.print_stats = False
+    config.time_to_run = args.hours * 3600
+    config.num_users = args.num_users
+    config.client_request_interval = args.request_interval
+
+    netsys = server_double.build_system(config)
+    samples = []
+    netsys.env.process(monitor(
+        netsys, config.time_to_run / args.num_samples, samples))
+    start = time.time()
+    stats = netsys.simulate()
+    print(f"Wall time: {time.time() - start:.2f}s")
+    print(f"Total messages: {stats.total_num_messages}")
+    print("sim_time  in_flight  dict_bytes  inflight_keys")
+    for now, in_flight, dict_bytes, keys in samples:
+        print(f"{now:8.0f}  {in_flight:9d}  {dict_bytes:10d}  {keys:13d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Script to benchmark the performance of all strategies across scales."""
+import argparse
+import dataclasses
+import sys
+import yaml
+import munch
+
+from SpeakerVerSim import benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="run_benchmark",
+        description="Benchmark all strategies across scales.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark.")
+    run_parser.add_argument("-c", "--config", default="example_config.yml")
+    run_parser.add_argument("-o", "--output", default="benchmark.json")
+    run_parser.add_argument(
+        "--preset", choices=benchmark.PRESETS.keys(), default="quick")
+    run_parser.add_argument("--strategies", nargs="+")
+    run_parser.add_argument("--num_cloud_workers", nargs="+", type=int)
+    run_parser.add_argument("--num_users", nargs="+", type=int)
+    run_parser.add_argument(
+        "--client_request_interval", nargs="+", type=float)
+    run_parser.add_argument(
+        "--version_query_interval", nargs="+", type=float)
+    run_parser.add_argument("--time_to_run", type=float)
+    run_parser.add_argument("--repeats", type=int, default=1)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two benchmark results.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="Relative increase above which a metric is a regression.")
+
+    import_parser = subparsers.add_parser(
+        "import", help="Measure the import time of modules.")
+    import_parser.add_argument(
+        "modules", nargs="*", default=["SpeakerVerSim"])
+    import_parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        with open(args.config, "r") as f:
+            config = munch.Munch.fromDict(yaml.safe_load(f))
+        if args.time_to_run:
+            config.time_to_run = args.time_to_run
+        overrides = {}
+        for field in ["strategies", "num_cloud_workers", "num_users",
+                      "client_request_interval", "version_query_interval"]:
+            if getattr(args, field):
+                overrides[field] = getattr(args, field)
+        matrix = dataclasses.replace(
+            benchmark.PRESETS[args.preset], **overrides)
+        results = benchmark.run_suite(config, matrix, args.repeats)
+        benchmark.save_results(results, args.output)
+        print(f"Results saved to {args.output}")
+    elif args.command == "import":
+        for module in args.modules:
+            import_time = benchmark.measure_import_time(module, args.repeats)
+            print(f"import {module}: {import_time * 1000:.1f} ms")
+    else:
+        regressions = benchmark.compare(
+            benchmark.load_results(args.baseline),
+            benchmark.load_results(args.current),
+            args.threshold)
+        for regression in regressions:
+            print("Regression in {case}: {metric} {baseline:.3f} -> "
+                  "{current:.3f} (+{change:.1%})".format(**regression))
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
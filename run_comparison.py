@@ -0,0 +1,52 @@
+"""Script to compare strategies with common random numbers."""
+import argparse
+import yaml
+import munch
+
+import SpeakerVerSim
+from SpeakerVerSim import comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="run_comparison",
+        description="Compare strategies by paired differences, where each "
+        "replicate simulates all strategies with the same random numbers.")
+    parser.add_argument("-c", "--config", default="example_config.yml")
+    parser.add_argument("-s", "--strategies", nargs="+",
+                        choices=SpeakerVerSim.list_strategies())
+    parser.add_argument("-b", "--baseline",
+                        help="Strategy to compare against. Defaults to the "
+                        "first strategy.")
+    parser.add_argument("--replicates", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency_percentile", type=float, default=99)
+    parser.add_argument("--independent", action="store_true",
+                        help="Use different random numbers for each "
+                        "strategy, as independent runs.")
+    parser.add_argument("--cache", default="",
+                        help="Pickle file to cache simulation results.")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = munch.Munch.fromDict(yaml.safe_load(f))
+
+    report = comparison.compare_strategies(
+        config,
+        strategies=args.strategies,
+        baseline=args.baseline,
+        replicates=args.replicates,
+        processes=args.processes,
+        confidence=args.confidence,
+        seed=args.seed,
+        percentile=args.latency_percentile,
+        common_random_numbers=not args.independent,
+        cache_file=args.cache)
+    print("\n".join(report.format()))
+    print(f"Simulations run: {report.num_simulations}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
-"""Batch script to run experiments reported in the paper."""
+"""Batch script to run experiments reported in the paper.
+
+Strategies are run with independent randomness here. For paired
+comparisons with common random numbers, see run_comparison.py.
+"""
 import pickle
 import yaml
 from tqdm import trange
@@ -0,0 +1,72 @@
+"""Script to optimize config knobs, such as version_query_interval."""
+import argparse
+import yaml
+import munch
+
+import SpeakerVerSim
+from SpeakerVerSim import optimizer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="run_optimizer",
+        description="Optimize config knobs under a noisy objective of "
+        "latency, bounces and version query traffic.")
+    parser.add_argument("-c", "--config", default="example_config.yml")
+    parser.add_argument("-s", "--strategy", default="SSO-sync",
+                        choices=SpeakerVerSim.list_strategies())
+    parser.add_argument("--knob", nargs=3, action="append",
+                        metavar=("NAME", "LOW", "HIGH"),
+                        help="A config key to optimize within [LOW, HIGH] "
+                        "on a log scale. Can be repeated. Defaults to "
+                        "version_query_interval 1 3600.")
+    parser.add_argument("--num_cloud_workers", nargs="+", type=int,
+                        help="Optimize separately for each fleet size.")
+    parser.add_argument("--latency_weight", type=float, default=1.0)
+    parser.add_argument("--latency_percentile", type=float,
+                        help="Use this percentile of the e2e latency "
+                        "instead of the mean.")
+    parser.add_argument("--bounce_weight", type=float, default=1.0)
+    parser.add_argument("--query_weight", type=float, default=0.01)
+    parser.add_argument("--num_candidates", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--replicates", type=int, default=2)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", default="",
+                        help="Pickle file to cache simulation results.")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = munch.Munch.fromDict(yaml.safe_load(f))
+    config.strategy = args.strategy
+
+    knobs = [
+        optimizer.Knob(name, float(low), float(high))
+        for name, low, high in args.knob or [
+            ("version_query_interval", 1, 3600)]]
+    objective = optimizer.Objective(
+        latency_weight=args.latency_weight,
+        bounce_weight=args.bounce_weight,
+        query_weight=args.query_weight,
+        latency_percentile=args.latency_percentile)
+
+    for num_workers in args.num_cloud_workers or [config.num_cloud_workers]:
+        config.num_cloud_workers = num_workers
+        result = optimizer.optimize(
+            config, knobs, objective,
+            num_candidates=args.num_candidates,
+            rounds=args.rounds,
+            replicates=args.replicates,
+            processes=args.processes,
+            seed=args.seed,
+            cache_file=args.cache)
+        best = result.best_evaluation
+        print(f"num_cloud_workers={num_workers}: best " + ", ".join(
+            f"{name}={value:.4g}" for name, value in result.best.items())
+            + f", objective {best.mean:.4g} +/- {best.half_width:.2g}, "
+            f"{result.num_simulations} simulations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Script to find the minimal worker count that meets a latency SLO."""
+import argparse
+import math
+import yaml
+import munch
+
+import SpeakerVerSim
+from SpeakerVerSim import planner
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="run_planner",
+        description="Find the minimal worker count that meets a latency SLO.")
+    parser.add_argument("-c", "--config", default="example_config.yml")
+    parser.add_argument("-s", "--strategy",
+                        choices=SpeakerVerSim.list_strategies())
+    parser.add_argument("--key", default="num_cloud_workers",
+                        help="Integer config key to search, such as "
+                        "num_cloud_workers or worker_concurrency.")
+    parser.add_argument("--low", type=int, default=1)
+    parser.add_argument("--high", type=int, default=100)
+    parser.add_argument("--latency_percentile", type=float, default=99)
+    parser.add_argument("--max_latency", type=float, default=math.inf,
+                        help="Limit of the e2e latency percentile in "
+                        "seconds.")
+    parser.add_argument("--max_backward_bounce_rate", type=float,
+                        default=math.inf,
+                        help="Limit of backward bounces per response.")
+    parser.add_argument("--replicates", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", default="",
+                        help="Pickle file to cache simulation results.")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = munch.Munch.fromDict(yaml.safe_load(f))
+    if args.strategy:
+        config.strategy = args.strategy
+
+    slo = planner.SLO(
+        latency_percentile=args.latency_percentile,
+        max_latency=args.max_latency,
+        max_backward_bounce_rate=args.max_backward_bounce_rate)
+    plan = planner.plan_capacity(
+        config, slo, args.low, args.high,
+        key=args.key,
+        replicates=args.replicates,
+        processes=args.processes,
+        confidence=args.confidence,
+        seed=args.seed,
+        cache_file=args.cache)
+
+    for value in sorted(plan.probes):
+        probe = plan.probes[value]
+        print(f"{args.key}={value}: " + ", ".join(
+            f"{metric} {probe.means[metric]:.4g} "
+            f"+/- {probe.half_widths[metric]:.2g}"
+            for metric in probe.means))
+    print(f"Simulations run: {plan.num_simulations}")
+    if not plan.feasible:
+        print(f"SLO not met with {args.key}={args.high}.")
+        return
+    print(f"Minimal {args.key}: {plan.min_workers}, "
+          f"{args.confidence:.0%} bounds: "
+          f"[{plan.lower_bound}, {plan.upper_bound}]")
+
+
+if __name__ == "__main__":
+    main()
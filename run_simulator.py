@@ -1,6 +1,8 @@
 """Script to run one single simulation."""
 import SpeakerVerSim
 import argparse
+import cProfile
+import pstats
 import yaml
 import munch
 
@@ -11,7 +13,15 @@ def main():
         description="Run a single simulation.")
 
     parser.add_argument("-c", "--config", default="example_config.yml")
-    parser.add_argument("-s", "--strategy", choices=SpeakerVerSim.STRATEGIES)
+    parser.add_argument("-s", "--strategy",
+                        choices=SpeakerVerSim.list_strategies())
+    parser.add_argument("-t", "--print_trace", action="store_true",
+                        help="Trace every hop and print it after simulation.")
+    parser.add_argument("-r", "--report", action="store_true",
+                        help="Print a performance report of the simulation.")
+    parser.add_argument("-p", "--profile", default="",
+                        help="Write a cProfile dump to this file, and print "
+                        "the hot spots.")
     args = parser.parse_args()
 
     with open(args.config, "r") as f:
@@ -20,7 +30,31 @@ def main():
     if args.strategy:
         config.strategy = args.strategy
 
-    SpeakerVerSim.simulate(config)
+    if args.print_trace:
+        config.trace_level = SpeakerVerSim.tracing.TRACE_HOP
+
+    if args.report:
+        config.profile_simulation = True
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        stats = profiler.runcall(SpeakerVerSim.simulate, config)
+        profiler.dump_stats(args.profile)
+        print("========================================")
+        print("Hot spots:")
+        pstats.Stats(args.profile).sort_stats("tottime").print_stats(15)
+    else:
+        stats = SpeakerVerSim.simulate(config)
+
+    if args.report:
+        print("========================================")
+        print("Performance report:")
+        print(stats.profile.summary())
+
+    if args.print_trace:
+        for line in SpeakerVerSim.tracing.format_trace(
+                stats.trace, stats.trace_actor_names):
+            print(line)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,8 @@
-"""Script to sweep version_query_interval for SSO-sync."""
+"""Script to sweep version_query_interval for SSO-sync.
+
+To find the best interval with far fewer simulations, see
+run_optimizer.py.
+"""
 import pickle
 import yaml
 from tqdm import trange
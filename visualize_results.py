@@ -5,6 +5,7 @@ import os
 from typing import Callable
 import matplotlib.pyplot as plt
 
+from SpeakerVerSim import message_log
 from SpeakerVerSim.common import STRATEGIES
 
 NUM_RUNS = 100
@@ -38,7 +39,11 @@ def visualize_single_run_metrics(
             # Only first run.
             stats = results[strategy][0]
 
-            for msg in stats.final_messages:
+            messages = stats.final_messages
+            if stats.final_messages_file:
+                messages = message_log.iter_messages(
+                    stats.final_messages_file)
+            for msg in messages:
                 x.append(strategy)
                 y.append(get_metrics(msg))
                 hue.append(num_workers)